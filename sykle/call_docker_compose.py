@@ -13,10 +13,10 @@ def docker_compose_file_for_type(type):
         return './docker-compose.prod.yml'
 
 
-def call_docker_compose(
-    input, type='dev', project_name='tc-project',
-    debug=False, docker_vars={}, target=None, env_file=None
+def docker_compose_command(
+    input, type='dev', project_name='tc-project', env_file=None
 ):
+    """Returns the docker-compose command (as a list) for the given input"""
     dc_file = docker_compose_file_for_type(type)
 
     opts = []
@@ -41,7 +41,16 @@ def call_docker_compose(
                 opts.append('\"{}={}\"'.format(k, v))
             input = [input[0]] + opts + input[1:]
 
+    return ['docker-compose'] + project_command + ['-f', dc_file] + input
+
+
+def call_docker_compose(
+    input, type='dev', project_name='tc-project',
+    debug=False, docker_vars={}, target=None, env_file=None, capture=False
+):
     return call_subprocess(
-        ['docker-compose'] + project_command + ['-f', dc_file] + input,
-        debug=debug, env=docker_vars, target=target
+        docker_compose_command(
+            input, type=type, project_name=project_name, env_file=env_file
+        ),
+        debug=debug, env=docker_vars, target=target, capture=capture
     )
@@ -0,0 +1,72 @@
+import json
+import traceback
+import subprocess as _subprocess
+
+from . import remote_agent
+from .call_subprocess import CancelException, NonZeroReturnCodeException
+
+
+def remote_agent_program(ops):
+    """Returns the python program that runs `ops` through the remote agent"""
+    with open(remote_agent.__file__) as f:
+        source = f.read()
+    return '{}\nsys.exit(main(json.loads({!r})))\n'.format(
+        source, json.dumps(ops)
+    )
+
+
+def call_remote_agent(
+    ops, target, python='python3', debug=False, on_result=None
+):
+    """
+    Runs a batch of operations on a target using a single ssh session and
+    returns their results (see `sykle.remote_agent` for the format of
+    operations and results).
+
+    Parameters:
+        ops (array[dict]): the operations to run
+        target (string): ssh address of the machine to run the operations on
+        python (string): python 3 interpreter to use on the target
+        debug (bool): if true, will output the command and the operations
+        on_result (function): called with each result as it comes in
+    """
+    command = ['ssh', '-o', 'StrictHostKeyChecking=no', target, python, '-']
+    full_command = ' '.join(command)
+
+    if debug:
+        print('--BEGIN COMMAND--')
+        print('COMMAND:', full_command)
+        for op in ops:
+            print('OP:', json.dumps(op))
+        print('--END COMMAND--')
+
+    results = []
+    p = _subprocess.Popen(
+        command, stdin=_subprocess.PIPE, stdout=_subprocess.PIPE
+    )
+    try:
+        p.stdin.write(remote_agent_program(ops).encode())
+        p.stdin.close()
+
+        for line in p.stdout:
+            try:
+                result = json.loads(line.decode())
+            except ValueError:
+                # NB: anything that isn't a result (login banners, etc)
+                #     gets passed through
+                print(line.decode(errors='replace'), end='')
+                continue
+            results.append(result)
+            if on_result:
+                on_result(result)
+        p.wait()
+    except KeyboardInterrupt:
+        p.wait()
+        raise CancelException()
+
+    if p.returncode != 0:
+        raise NonZeroReturnCodeException(
+            process=p, stacktrace=traceback.format_stack(),
+            command=full_command
+        )
+    return results
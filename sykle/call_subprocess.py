@@ -1,4 +1,6 @@
 import os
+import shlex
+import threading
 import traceback
 import subprocess as _subprocess
 from functools import wraps
@@ -21,7 +23,23 @@ class NonZeroReturnCodeException(Exception):
         return self.message
 
 
-def call_subprocess(command, env=None, debug=False, target=None):
+def pipefail(command):
+    """
+    Wraps a shell pipeline (EX: ['pg_dump', '|', 'gzip', '>', 'file']) so
+    it fails when any of its commands fails, rather than only the last one
+    """
+    return ['bash', '-o', 'pipefail', '-c', shlex.quote(' '.join(command))]
+
+
+def _forward_lines(stream, callback):
+    for line in stream:
+        callback(line.decode(errors='replace').rstrip('\n'))
+
+
+def call_subprocess(
+    command, env=None, debug=False, target=None, capture=False,
+    on_stderr=None
+):
     """
     This is a utility function that will spawn a subprocess that runs the
     command passed in to the command argument.
@@ -38,6 +56,10 @@ def call_subprocess(command, env=None, debug=False, target=None):
                          NOTE: env vars will be interpolated based on LOCAL
                                environment variables, not TARGET environment
                                variables.
+        capture (bool): if true, the command's stdout is captured and
+                        returned as a string instead of being printed
+        on_stderr (function): if given, is called with each line the command
+                              writes to stderr (instead of printing it)
     """
     if env:
         # NB: we want the entire environment specified here
@@ -58,18 +80,39 @@ def call_subprocess(command, env=None, debug=False, target=None):
         print('COMMAND:', full_command)
         print('--END COMMAND--')
 
+    stdout = _subprocess.PIPE if capture else None
+    stderr = _subprocess.PIPE if on_stderr else None
     try:
         if env:
-            p = _subprocess.Popen(full_command, env=full_env, shell=True)
+            p = _subprocess.Popen(
+                full_command, env=full_env, shell=True, stdout=stdout,
+                stderr=stderr
+            )
         else:
-            p = _subprocess.Popen(full_command, shell=True)
-        p.wait()
+            p = _subprocess.Popen(
+                full_command, shell=True, stdout=stdout, stderr=stderr
+            )
+
+        if on_stderr:
+            # NB: stderr is read on its own thread so a full stdout pipe
+            #     can't block the command
+            reader = threading.Thread(
+                target=_forward_lines, args=(p.stderr, on_stderr)
+            )
+            reader.start()
+            output = p.stdout.read() if capture else None
+            p.wait()
+            reader.join()
+        else:
+            output, _ = p.communicate()
 
         if p.returncode != 0:
             raise NonZeroReturnCodeException(
                 process=p, stacktrace=traceback.format_stack(),
                 command=full_command
             )
+        if capture:
+            return output.decode()
     except KeyboardInterrupt:
         p.wait()
         raise CancelException()
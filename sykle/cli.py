@@ -7,7 +7,7 @@ Usage:
   syk [--debug] [--config=<file>] [--test | --prod | --prod-build] [--service=<service>] [--env=<env_file>] [--deployment=<name>] [--local-test] dc_run [INPUT ...]
   syk [--debug] [--config=<file>] [--test | --prod] [--service=<service>] dc_exec [INPUT ...]
   syk [--debug] [--config=<file>] [--test | --prod] [--deployment=<name>] [--local-test] build [INPUT ...]
-  syk [--debug] [--config=<file>] [--test | --prod] [--deployment=<name>] [--local-test] up [INPUT ...]
+  syk [--debug] [--config=<file>] [--test | --prod] [--deployment=<name>] [--local-test] [--wait] [--timeout=<seconds>] up [INPUT ...]
   syk [--debug] [--config=<file>] [--test | --prod] [--deployment=<name>] [--local-test] down
   syk [--debug] [--config=<file>] [--service=<service>] [--fast] unittest [INPUT ...]
   syk [--debug] [--config=<file>] [--service=<service>] [--fast] e2e [INPUT ...]
@@ -15,10 +15,12 @@ Usage:
   syk [--debug] [--config=<file>] [--deployment=<name>] ssh
   syk [--debug] [--config=<file>] [--deployment=<name>] [--dest=<dest>] ssh_cp [INPUT ...]
   syk [--debug] [--config=<file>] [--deployment=<name>] ssh_exec [INPUT ...]
-  syk [--debug] [--config=<file>] [--env=<env_file>] [--deployment=<name>] deploy
+  syk [--debug] [--config=<file>] [--env=<env_file>] [--deployment=<name>] [--force] [--wait] [--timeout=<seconds>] deploy
+  syk [--debug] [--config=<file>] [--deployment=<name>] status
+  syk [--debug] [--config=<file>] [--deployment=<name>] prune
   syk init
   syk plugins
-  syk plugins install
+  syk [--force] [--wheels=<dir>] plugins install
   syk config
   syk [--debug] [--test | --prod] [--config=<file>] [--deployment=<name>] [INPUT ...]
 
@@ -34,6 +36,14 @@ Option
   --service=<service>     Docker service on which to run the command
   --debug                 Prints debug information
   --deployment=<name>     Uses config for the given deployment
+  --force                 Deploys/installs even if nothing changed since the
+                          last deploy/install
+  --wait                  Waits for services to become healthy after starting
+                          them (starts services in the background)
+  --timeout=<seconds>     Seconds to wait for services to become healthy
+                          [default: 300]
+  --wheels=<dir>          Installs plugin requirements from a directory of
+                          wheels without using the package index
   --fast                  Runs tests without building images/containers
                           (you will need to have 'syk --test up' running)
   --local-test            Use this in conjunction with the deployment argument
@@ -55,6 +65,8 @@ Description:
   ssh_cp          Copies file to ssh target home directory
   ssh_exec        Executes command on ssh target
   deploy          Deploys and starts latest builds on ssh target
+  prune           Cleans up docker on ssh target (see "prune" in config)
+  status          Shows what was last deployed to ssh target
   init            Creates a blank config file
   plugins         Lists available plugins
   plugins install Installs plugin requirements
@@ -138,9 +150,13 @@ def process_args(args):
         plugins = Plugins.list()
         if args['install']:
             logger.info('Installing plugins:')
-            for plugin_name, plugin_dir in plugins.items():
+            for plugin_name in plugins.keys():
                 logger.info('  {}'.format(plugin_name))
-                plugin_dir.install_requirements()
+            installed = Plugins.install_requirements(
+                plugins, wheel_dir=args['--wheels'], force=args['--force']
+            )
+            if not installed:
+                logger.info('Plugin requirements are already installed')
         logger.info('Available plugins:')
         for plugin_name in plugins.keys():
             logger.info('  {}'.format(plugin_name))
@@ -199,7 +215,8 @@ def process_args(args):
         deployment = args['--deployment']
         sykle.up(
             docker_type=docker_type, deployment=deployment,
-            input=args['INPUT'], local_test=local_test
+            input=args['INPUT'], local_test=local_test,
+            wait=args['--wait'], timeout=int(args['--timeout'])
         )
     elif args['down']:
         local_test = args['--local-test']
@@ -238,7 +255,16 @@ def process_args(args):
         sykle.ssh(deployment=deployment)
     elif args['deploy']:
         deployment = args['--deployment'] or config.default_deployment
-        sykle.deploy(deployment)
+        sykle.deploy(
+            deployment, force=args['--force'],
+            wait=args['--wait'], timeout=int(args['--timeout'])
+        )
+    elif args['status']:
+        deployment = args['--deployment'] or config.default_deployment
+        sykle.status(deployment)
+    elif args['prune']:
+        deployment = args['--deployment'] or config.default_deployment
+        sykle.prune(deployment)
     else:
         deployment = args['--deployment']
         input = args['INPUT']
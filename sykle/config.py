@@ -1,5 +1,6 @@
 import os
 import json
+import shlex
 import collections
 import dotenv
 import logging
@@ -44,6 +45,66 @@ class Command:
         )
 
 
+class PrunePolicy:
+    """
+    Describes when and how a deployment target's docker system gets pruned
+    after a deploy.
+
+    - threshold: only prune once disk usage of the docker root directory
+                 reaches this percentage (0 always prunes)
+    - keep: number of most recent images to keep per repository so that
+            rolling back does not require a pull (0 removes all unused
+            images)
+    - detach: if true, the prune runs in the background on the target and
+              the deploy does not wait for it to finish
+    """
+    @staticmethod
+    def from_json(obj):
+        if obj is False:
+            return None
+        if obj is None or obj is True:
+            return PrunePolicy()
+        return PrunePolicy(**obj)
+
+    def __init__(self, threshold=0, keep=0, detach=False):
+        self.threshold = int(threshold)
+        self.keep = int(keep)
+        self.detach = detach
+
+    def to_script(self):
+        """Returns a shell script that applies the policy on the target"""
+        lines = []
+        if self.threshold > 0:
+            lines += [
+                "root=$(docker info --format '{{.DockerRootDir}}' "
+                "2>/dev/null || echo /var/lib/docker)",
+                "usage=$(df -P \"$root\" | "
+                "awk 'NR==2 {sub(\"%\", \"\", $5); print $5}')",
+                '[ "${{usage:-100}}" -lt {} ] && exit 0'.format(
+                    self.threshold
+                ),
+            ]
+        if self.keep > 0:
+            # NB: `docker images` lists newest images first, so everything
+            #     after the first `keep` images of a repository is older
+            lines += [
+                'docker container prune --force',
+                "docker images --format '{{{{.Repository}}}} {{{{.ID}}}}' | "
+                "awk '$1 != \"<none>\" && seen[$1]++ >= {} {{print $2}}' | "
+                "sort -u | xargs -r docker rmi 2>/dev/null".format(self.keep),
+                'docker system prune --force',
+            ]
+        else:
+            lines.append('docker system prune -a --force')
+        script = '\n'.join(lines)
+
+        if self.detach:
+            script = 'nohup sh -c {} >/dev/null 2>&1 &'.format(
+                shlex.quote(script)
+            )
+        return script
+
+
 class DeploymentConfig:
     @staticmethod
     def from_json(obj):
@@ -53,6 +114,11 @@ class DeploymentConfig:
         for k, v in kwargs.items():
             setattr(self, k, v)
 
+    @property
+    def prune_policy(self):
+        """Returns the `PrunePolicy` for the deployment (None if disabled)"""
+        return PrunePolicy.from_json(self.__dict__.get('prune'))
+
 
 class Config:
     REQUIRED_VERSION = 2
@@ -241,7 +307,35 @@ class ConfigV2(Config):
               // if a variable begins with a $ sign, it will pull the value
               // from that environment value
               "BUILD_NUMBER": "$BUILD_NUMBER"
-            }
+            },
+            // controls cleanup of the docker system after a deploy
+            // (OPTIONAL, defaults to pruning everything and waiting for it.
+            // set to false to disable pruning altogether)
+            "prune": {
+              // only prune when disk usage is at least 80%
+              "threshold": 80,
+              // keep the 2 most recent images of each repository
+              "keep": 2,
+              // don't wait for the prune to finish
+              "detach": true
+            },
+            // if true, each service is pulled on the target as soon as it
+            // has been pushed instead of waiting for every push (OPTIONAL)
+            "pipeline": true,
+            // if true, the remote steps of a deploy (pull, up, prune) run
+            // through a single ssh session using a python 3 agent on the
+            // target (OPTIONAL)
+            "batch": true,
+            // python 3 interpreter used by the agent (OPTIONAL)
+            "python": "python3",
+            // if true, records what was deployed on the target and skips
+            // deploys (or just the push and pull) when nothing changed.
+            // images are compared by registry digest (needs docker
+            // buildx). use 'syk deploy --force' to deploy anyway (OPTIONAL)
+            "track_state": true,
+            // if true, deploys block until all services are healthy
+            // (same as 'syk deploy --wait') (OPTIONAL)
+            "wait": true
         },
         // multiple deployments can be listed
         "staging": {
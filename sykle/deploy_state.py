@@ -0,0 +1,117 @@
+import re
+import json
+import hashlib
+import datetime
+
+from . import __version__
+
+# NB: relative to the home directory of the deployment target
+STATE_FILE = '~/.sykle-state.json'
+
+IMAGE_PATTERN = re.compile(r'^\s*image:\s*[\'"]?([^\'"\s]+)', re.MULTILINE)
+
+
+def file_hash(filename):
+    """Returns the sha256 of a file's contents (None if it doesn't exist)"""
+    try:
+        with open(filename, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def image_repository(image):
+    """Strips the tag or digest from an image ('repo:tag' -> 'repo')"""
+    image = image.split('@', 1)[0]
+    name, _, tag = image.rpartition(':')
+    # NB: a ':' followed by a '/' is a registry port (EX: host:5000/repo)
+    if name and '/' not in tag:
+        return name
+    return image
+
+
+def images_from_compose_config(config):
+    """Returns the images referenced by `docker-compose config` output"""
+    images = []
+    for image in IMAGE_PATTERN.findall(config):
+        if image not in images:
+            images.append(image)
+    return images
+
+
+class DeployState:
+    """
+    Record of what is deployed on a deployment target. It is written to
+    the target after each deploy so the next deploy can tell whether
+    anything changed.
+
+    Images are recorded by their registry digest (EX: 'repo@sha256:...'),
+    which is the same on every host. Images without one (EX: builds that
+    haven't been pushed yet) make the state incomplete, and incomplete
+    states never match.
+    """
+    COMPARED_FIELDS = ['images', 'compose_hash', 'env_hash', 'version']
+
+    @staticmethod
+    def from_json(obj):
+        return DeployState(**obj)
+
+    @staticmethod
+    def loads(string):
+        """Parses a state record (None if the record is missing/invalid)"""
+        try:
+            return DeployState.from_json(json.loads(string))
+        except (ValueError, TypeError, AttributeError):
+            return None
+
+    def __init__(
+        self, images={}, compose_hash=None, env_hash=None,
+        version=__version__, deployed_at=None
+    ):
+        self.images = images
+        self.compose_hash = compose_hash
+        self.env_hash = env_hash
+        self.version = version
+        self.deployed_at = deployed_at or datetime.datetime.utcnow() \
+            .replace(microsecond=0).isoformat()
+
+    @property
+    def complete(self):
+        return all(self.images.values())
+
+    def __eq__(self, other):
+        return self.same_images(other) and all(
+            getattr(self, field) == getattr(other, field)
+            for field in self.COMPARED_FIELDS
+        )
+
+    def same_images(self, other):
+        return isinstance(other, DeployState) and self.complete and \
+            other.complete and self.images == other.images
+
+    def to_json(self):
+        return {
+            'images': self.images,
+            'compose_hash': self.compose_hash,
+            'env_hash': self.env_hash,
+            'version': self.version,
+            'deployed_at': self.deployed_at,
+        }
+
+    def dumps(self):
+        return json.dumps(self.to_json(), sort_keys=True)
+
+    def __str__(self):
+        lines = [
+            'Deployed at: {} (sykle {})'.format(
+                self.deployed_at, self.version
+            ),
+            'Compose file hash: {}'.format(self.compose_hash),
+            'Env file hash: {}'.format(self.env_hash),
+            'Images:',
+        ]
+        lines += [
+            '  {} {}'.format(image, digest)
+            for image, digest in sorted(self.images.items())
+        ]
+        return '\n'.join(lines)
@@ -0,0 +1,100 @@
+import time
+from contextlib import contextmanager
+
+from .call_subprocess import NonZeroReturnCodeException
+
+
+class Event:
+    """
+    Something sykle did. Every instrumented operation emits a 'start' event
+    before it runs and a 'finish' event after it is done.
+
+    Attributes:
+        name (str): operation name ('dc', 'command', 'ssh_cp', 'ssh_exec' or
+                    'deploy_stage')
+        phase (str): 'start' or 'finish'
+        argv (array[str]): the command being run (if any)
+        docker_type (str): docker type used (if any)
+        deployment (str): deployment used (if any)
+        duration (float): seconds the operation took ('finish' only)
+        returncode (int): returncode of the operation ('finish' only, None if
+                          it raised something other than a non zero
+                          returncode)
+        error (Exception): exception raised by the operation (if any)
+        extras (dict): anything else specific to the operation (EX: 'stage'
+                       for 'deploy_stage' events, 'service' for 'command')
+    """
+    def __init__(
+        self, name, phase, argv=None, docker_type=None, deployment=None,
+        duration=None, returncode=None, error=None, **extras
+    ):
+        self.name = name
+        self.phase = phase
+        self.argv = argv
+        self.docker_type = docker_type
+        self.deployment = deployment
+        self.duration = duration
+        self.returncode = returncode
+        self.error = error
+        self.extras = extras
+
+    def __repr__(self):
+        return '<Event {} {} {}>'.format(self.name, self.phase, self.extras)
+
+
+class EventBus:
+    """
+    In process publish/subscribe for sykle events. Subscribing to '*'
+    receives every event. Subscribers are called synchronously (and may be
+    called from worker threads), so they should return quickly.
+    """
+    ALL = '*'
+
+    def __init__(self):
+        self._subscribers = {}
+
+    def subscribe(self, name, callback):
+        self._subscribers.setdefault(name, []).append(callback)
+        return callback
+
+    def unsubscribe(self, name, callback):
+        self._subscribers.get(name, []).remove(callback)
+
+    def has_subscribers(self, name):
+        return bool(
+            self._subscribers.get(name) or self._subscribers.get(self.ALL)
+        )
+
+    def emit(self, event):
+        for callback in self._subscribers.get(event.name, []):
+            callback(event)
+        for callback in self._subscribers.get(self.ALL, []):
+            callback(event)
+
+    @contextmanager
+    def span(self, name, **payload):
+        """Emits 'start' and 'finish' events around the wrapped operation"""
+        # NB: nothing gets timed or created unless someone is listening
+        if not self.has_subscribers(name):
+            yield
+            return
+
+        self.emit(Event(name, 'start', **payload))
+        start = time.time()
+        returncode = 0
+        error = None
+        try:
+            yield
+        except NonZeroReturnCodeException as e:
+            returncode = e.process.returncode
+            error = e
+            raise
+        except BaseException as e:
+            returncode = None
+            error = e
+            raise
+        finally:
+            self.emit(Event(
+                name, 'finish', duration=time.time() - start,
+                returncode=returncode, error=error, **payload
+            ))
@@ -0,0 +1,235 @@
+import re
+import json
+import time
+import datetime
+import queue
+import shlex
+import threading
+import subprocess as _subprocess
+
+from .exceptions import CommandException
+
+
+class HealthCheckException(CommandException):
+    pass
+
+
+INSPECT_FORMAT = (
+    '{{.Id}} {{index .Config.Labels "com.docker.compose.service"}} '
+    '{{json .State}}'
+)
+
+TIMESTAMP_PATTERN = re.compile(
+    r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:\d\d)$'
+)
+
+
+def compose_project_label(project_name):
+    """Returns the project name the way docker compose labels containers"""
+    return re.sub(r'[^-_a-z0-9]', '', project_name.lower())
+
+
+def _shell_command(script, target=None):
+    if target:
+        return ['ssh', '-o', 'StrictHostKeyChecking=no', target, script]
+    return ['sh', '-c', script]
+
+
+def _parse_timestamp(value):
+    """
+    Parses a docker timestamp (RFC 3339, with nanoseconds) into seconds
+    since the epoch (None for docker's zero time or unparsable values)
+    """
+    match = TIMESTAMP_PATTERN.match(value or '')
+    if not match or value.startswith('0001-'):
+        return None
+    seconds, fraction, zone = match.groups()
+    timestamp = datetime.datetime.fromisoformat(
+        seconds + ('+00:00' if zone == 'Z' else zone)
+    ).timestamp()
+    return timestamp + float('0.' + fraction) if fraction else timestamp
+
+
+def _ready_at(state):
+    """
+    Returns when a container that is ready became ready, from its state:
+    the end of the first passing health check since the last failing one,
+    or when it started (or exited, for one off containers)
+    """
+    health = state.get('Health')
+    if health:
+        ready_at = None
+        for check in health.get('Log') or []:
+            if check.get('ExitCode') == 0:
+                ready_at = ready_at or _parse_timestamp(check.get('End'))
+            else:
+                ready_at = None
+        return ready_at
+    if state.get('Status') == 'exited':
+        return _parse_timestamp(state.get('FinishedAt'))
+    return _parse_timestamp(state.get('StartedAt'))
+
+
+def _is_ready(status, exit_code, health):
+    if health:
+        return health == 'healthy'
+    return status == 'running' or (status == 'exited' and exit_code == '0')
+
+
+def _inspect_containers(filters, target=None, debug=False):
+    """
+    Returns (id, service, status, exit code, health, ready at) of each
+    container (see `_ready_at`)
+    """
+    script = (
+        'ids=$(docker ps -aq --no-trunc {}) && '
+        '[ -n "$ids" ] && docker inspect --format {} $ids'
+        .format(
+            ' '.join('--filter ' + shlex.quote(f) for f in filters),
+            shlex.quote(INSPECT_FORMAT)
+        )
+    )
+    command = _shell_command(script, target)
+    if debug:
+        print('--BEGIN COMMAND--')
+        print('COMMAND:', ' '.join(command))
+        print('--END COMMAND--')
+
+    p = _subprocess.run(command, stdout=_subprocess.PIPE)
+    containers = []
+    for line in p.stdout.decode().splitlines():
+        fields = line.split(' ', 2)
+        if len(fields) != 3:
+            continue
+        id, service, state = fields
+        try:
+            state = json.loads(state)
+        except ValueError:
+            continue
+        containers.append((
+            id, service, state.get('Status', ''),
+            str(state.get('ExitCode', '')),
+            (state.get('Health') or {}).get('Status', ''),
+            _ready_at(state)
+        ))
+    return containers
+
+
+def wait_until_healthy(
+    project_name, target=None, timeout=300, started=None, debug=False
+):
+    """
+    Blocks until every container of a docker compose project reports that it
+    is healthy (or is running, for containers without a healthcheck) and
+    returns the number of seconds each service took to become healthy.
+
+    Rather than polling, this subscribes to the `docker events` stream of
+    the project and only inspects the containers once up front.
+
+    Parameters:
+        project_name (str): docker compose project (EX: 'my-project-prod')
+        target (string): an optional ssh address specifying where the
+                         project is running (runs locally if not specified)
+        timeout (int): number of seconds to wait before giving up
+        started (float): time the services were started (defaults to now).
+                         events since then are replayed so none get missed
+        debug (bool): if true, will output the commands used
+    """
+    started = started or time.time()
+    filters = [
+        'label=com.docker.compose.project={}'.format(
+            compose_project_label(project_name)
+        ),
+        'label=com.docker.compose.oneoff=False',
+    ]
+    since = '{}s'.format(int(time.time() - started) + 1)
+    events_command = _shell_command(' '.join(
+        ['docker', 'events', '--since', since, '--filter', 'type=container'] +
+        ['--filter ' + shlex.quote(f) for f in filters] +
+        ['--format', shlex.quote('{{json .}}')]
+    ), target)
+    if debug:
+        print('--BEGIN COMMAND--')
+        print('COMMAND:', ' '.join(events_command))
+        print('--END COMMAND--')
+
+    # NB: the events stream is started before inspecting the containers so
+    #     that no status change can slip in between the two
+    events = _subprocess.Popen(events_command, stdout=_subprocess.PIPE)
+    lines = queue.Queue()
+
+    def read_events():
+        for line in events.stdout:
+            lines.put(line)
+        lines.put(None)
+
+    threading.Thread(target=read_events, daemon=True).start()
+
+    times = {}
+
+    def ready(service, ready_at=None):
+        # NB: a service is ready once its last container is
+        seconds = max(0, (ready_at or time.time()) - started)
+        times[service] = max(times.get(service, 0), round(seconds, 1))
+
+    try:
+        containers = _inspect_containers(
+            filters, target=target, debug=debug
+        )
+        if not containers:
+            raise HealthCheckException(
+                'No containers found for project "{}"'.format(project_name)
+            )
+
+        pending = {}
+        for id, service, status, exit_code, health, ready_at in containers:
+            # NB: containers that were ready before we started looking use
+            #     the time docker recorded rather than the current time
+            if _is_ready(status, exit_code, health):
+                ready(service, ready_at)
+            elif status in ['exited', 'dead'] or health == 'unhealthy':
+                raise HealthCheckException(
+                    'Service "{}" is {}'.format(service, health or status)
+                )
+            else:
+                pending[id] = (service, bool(health))
+
+        while pending:
+            remaining = timeout - (time.time() - started)
+            if remaining <= 0:
+                raise HealthCheckException(
+                    'Timed out waiting for {} to become healthy'.format(
+                        ', '.join(sorted(set(s for s, _ in pending.values())))
+                    )
+                )
+            try:
+                line = lines.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if line is None:
+                raise HealthCheckException('"docker events" stopped')
+
+            event = json.loads(line.decode())
+            id = event.get('id') or event.get('Actor', {}).get('ID')
+            if id not in pending:
+                continue
+            service, has_healthcheck = pending[id]
+            action = event.get('status') or event.get('Action', '')
+            attributes = event.get('Actor', {}).get('Attributes', {})
+
+            if action == 'health_status: healthy' or (
+                action == 'start' and not has_healthcheck
+            ) or (
+                action == 'die' and attributes.get('exitCode') == '0'
+            ):
+                ready(service)
+                del pending[id]
+            elif action in ['die', 'health_status: unhealthy']:
+                raise HealthCheckException('Service "{}" is {}'.format(
+                    service, 'unhealthy' if 'health' in action else 'dead'
+                ))
+    finally:
+        events.terminate()
+        events.wait()
+
+    return times
@@ -2,19 +2,87 @@ import pkgutil
 import sys
 import sykle.plugins
 import os
+import hashlib
+import importlib
+import importlib.util
+import types
 from distutils.version import LooseVersion
 
 from .call_subprocess import call_subprocess
 
+try:
+    from importlib.metadata import entry_points
+except ImportError:
+    try:
+        from importlib_metadata import entry_points
+    except ImportError:
+        entry_points = None
+
+
+ENTRY_POINT_GROUP = 'sykle.plugins'
+# NB: local plugins are imported under this package so they can't clash
+#     with other modules (EX: a local plugin named `json` or `docker`)
+LOCAL_PLUGINS_PACKAGE = '_sykle_local_plugins'
+INSTALL_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'sykle')
+
+
+def _plugin_entry_points():
+    """Returns the entry points of pip installed plugins (reads metadata
+    only, nothing gets imported)"""
+    if entry_points is None:
+        return []
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return eps.select(group=ENTRY_POINT_GROUP)
+    return eps.get(ENTRY_POINT_GROUP, [])
+
 
 class PluginDir:
+    """A plugin found in sykle's `plugins` package or in a project's
+    `.syk-plugins` directory. The plugin module is imported on first use.
+    """
     def __init__(self, name, file_finder):
         self.name = name
         self.file_finder = file_finder
 
+    @property
+    def module_name(self):
+        # NB: global plugins are imported as part of the sykle package so
+        #     they are only ever imported once
+        if self.file_finder.path in sykle.plugins.__path__:
+            return '{}.{}'.format(sykle.plugins.__name__, self.name)
+        return '{}.{}'.format(LOCAL_PLUGINS_PACKAGE, self.name)
+
     @property
     def module(self):
-        return self.file_finder.find_loader(self.name)[0]
+        name = self.module_name
+        if name in sys.modules:
+            return sys.modules[name]
+        if not name.startswith(LOCAL_PLUGINS_PACKAGE + '.'):
+            return importlib.import_module(name)
+
+        if LOCAL_PLUGINS_PACKAGE not in sys.modules:
+            package = types.ModuleType(LOCAL_PLUGINS_PACKAGE)
+            package.__path__ = []
+            sys.modules[LOCAL_PLUGINS_PACKAGE] = package
+
+        found = self.file_finder.find_spec(self.name)
+        spec = importlib.util.spec_from_file_location(
+            name, found.origin,
+            submodule_search_locations=found.submodule_search_locations
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[name]
+            raise
+        return module
+
+    @property
+    def plugin_class(self):
+        return self.module.Plugin
 
     @property
     def path(self):
@@ -32,6 +100,50 @@ class PluginDir:
             ])
 
 
+class EntryPointPlugin:
+    """A pip installed plugin registered under the `sykle.plugins` entry
+    point group, EX (in setup.py):
+
+        entry_points={'sykle.plugins': ['my_plugin = my_package.plugin']}
+
+    The entry point may name a module with a `Plugin` class or the plugin
+    class itself (`my_package.plugin:MyPlugin`). Nothing is imported until
+    the plugin is used.
+    """
+    def __init__(self, entry_point):
+        self.name = entry_point.name
+        self.entry_point = entry_point
+
+    @property
+    def module_name(self):
+        return self.entry_point.value.partition(':')[0].strip()
+
+    @property
+    def module(self):
+        return importlib.import_module(self.module_name)
+
+    @property
+    def plugin_class(self):
+        attr = self.entry_point.value.partition(':')[2].strip()
+        plugin_class = self.module
+        for name in (attr or 'Plugin').split('.'):
+            plugin_class = getattr(plugin_class, name)
+        return plugin_class
+
+    @property
+    def path(self):
+        spec = importlib.util.find_spec(self.module_name)
+        return os.path.dirname(spec.origin)
+
+    @property
+    def requirements_file(self):
+        # NB: pip already installed the plugin's requirements
+        return None
+
+    def install_requirements(self):
+        pass
+
+
 class Plugins():
     def __init__(self, config, sykle):
         self.config = config
@@ -48,13 +160,76 @@ class Plugins():
 
     @staticmethod
     def get_module_loaders():
+        return dict(Plugins._find_plugins(os.getcwd()))
+
+    @staticmethod
+    def requirements_hash(requirements_files):
+        """Hashes requirements files along with the current interpreter"""
+        sha = hashlib.sha256()
+        sha.update(sys.executable.encode())
+        sha.update(sys.version.encode())
+        for requirements_file in sorted(requirements_files):
+            sha.update(requirements_file.encode())
+            with open(requirements_file, 'rb') as f:
+                sha.update(f.read())
+        return sha.hexdigest()
+
+    @staticmethod
+    def install_requirements(plugins, wheel_dir=None, force=False):
+        """
+        Installs the requirements of all plugins using a single pip
+        invocation, so they get resolved together. Returns False without
+        calling pip if the same requirements were already installed for the
+        current interpreter.
+
+        - wheel_dir: if given, installs from this directory of wheels only
+                     (without using an index)
+        - force: if this is true, installs even if nothing changed
+        """
+        requirements_files = [
+            plugin.requirements_file for plugin in plugins.values()
+            if plugin.requirements_file and
+            os.path.isfile(plugin.requirements_file)
+        ]
+        if not requirements_files:
+            return False
+
+        marker = os.path.join(
+            INSTALL_CACHE_DIR, 'plugin-requirements-{}'.format(
+                Plugins.requirements_hash(requirements_files)
+            )
+        )
+        if os.path.isfile(marker) and not force:
+            return False
+
+        command = [sys.executable, '-m', 'pip', 'install']
+        if wheel_dir:
+            command += ['--no-index', '--find-links', wheel_dir]
+        for requirements_file in requirements_files:
+            command += ['-r', requirements_file]
+        call_subprocess(command)
+
+        os.makedirs(INSTALL_CACHE_DIR, exist_ok=True)
+        open(marker, 'w').close()
+        return True
+
+    @staticmethod
+    def _find_plugins(cwd):
         plugins = {}
         plugin_path = sykle.plugins.__path__
 
         for file_finder, name, _ in pkgutil.iter_modules(plugin_path):
             plugins[name] = PluginDir(name, file_finder)
 
-        plugins_path = os.path.join(os.getcwd(), '.syk-plugins')
+        for entry_point in _plugin_entry_points():
+            if entry_point.name in plugins:
+                print(
+                    'WARNING: installed "{}" plugin overwrites global plugin'
+                    .format(entry_point.name)
+                )
+            plugins[entry_point.name] = EntryPointPlugin(entry_point)
+
+        plugins_path = os.path.join(cwd, '.syk-plugins')
         if os.path.isdir(plugins_path):
             for file_finder, name, _ in pkgutil.iter_modules([plugins_path]):
                 if name in plugins:
@@ -67,13 +242,17 @@ class Plugins():
 
     def run(self, name):
         plugin_dir = self.plugins.get(name)
-        plugin_module = plugin_dir.module.load_module()
-        plugin = plugin_module.Plugin(
+        plugin = plugin_dir.plugin_class(
             config=self.config, sykle=self.sykle, dir=plugin_dir)
         plugin.run()
 
 
 class IPlugin():
+    # NB: modules that are slow to import (EX: sdks) should be imported
+    #     inside the subcommands that need them and listed here so that
+    #     `syk <plugin> --help` can be checked to never import them
+    DEFERRED_IMPORTS = []
+
     def __init__(self, config, sykle, dir):
         if not self.NAME:
             raise Exception('Must give a plugin a NAME attribute!')
@@ -100,5 +279,16 @@ class IPlugin():
     def dir(self):
         return self._dir
 
+    def subscribe(self, name, callback):
+        """
+        Calls `callback` with every `sykle.events.Event` named `name` ('*'
+        for all events) that the sykle instance emits. EX:
+
+            def run(self):
+                self.subscribe('deploy_stage', self.record_stage)
+                self.sykle.deploy(deployment)
+        """
+        return self.sykle.events.subscribe(name, callback)
+
     def run(self):
         raise NotImplementedError("Plugin needs a run method!")
@@ -35,7 +35,6 @@ from docopt import docopt
 
 from sykle.plugin_utils import IPlugin
 
-from .template_renderer import TemplateRenderer
 from .utils import kebab_arg_to_snake_case
 
 
@@ -44,6 +43,7 @@ logger = logging.getLogger(__name__)
 
 class Plugin(IPlugin):
     NAME = 'bootstrap'
+    DEFERRED_IMPORTS = ['jinja2', 'anytree']
 
     arg_extensions = [
         '--api-framework',
@@ -55,10 +55,16 @@ class Plugin(IPlugin):
         '--task-queue'
     ]
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    @staticmethod
+    def args_to_extensions(args):
+        return [
+            (kebab_arg_to_snake_case(k), v)
+            for k, v in args.items()
+            if k in Plugin.arg_extensions and v is not None
+        ]
 
-        self.args = docopt(__doc__, version=__version__)
+    def new_django_project(self):
+        from .template_renderer import TemplateRenderer
 
         extensions = Plugin.args_to_extensions(self.args)
 
@@ -71,19 +77,13 @@ class Plugin(IPlugin):
             extensions=extensions,
             app_names=app_names
         )
-
-    @staticmethod
-    def args_to_extensions(args):
-        return [
-            (kebab_arg_to_snake_case(k), v)
-            for k, v in args.items()
-            if k in Plugin.arg_extensions and v is not None
-        ]
-
-    def new_django_project(self):
         self.renderer.render()
 
-    @logger.halo(succeed=True)
     def run(self):
+        self.args = docopt(__doc__, version=__version__)
+        self._run()
+
+    @logger.halo(succeed=True)
+    def _run(self):
         if self.args['django']:
             self.new_django_project()
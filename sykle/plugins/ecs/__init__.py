@@ -1,13 +1,22 @@
 """Manage ECS deployments
 
 Usage:
-  syk ecs publish --deployment=<deployment> [--debug]
+  syk ecs publish --deployment=<deployment> [--wait] [--debug]
 
 Options:
   --deployment=<deployment>
+  --wait           Wait for every service to be stable again (and report
+                   how long each one took)
 
 Description:
-  publish          Build and push images and refresh ecs services.
+  publish          Build and push images and refresh the ecs services that
+                   use them.
+
+  Images are the `*_IMAGE` docker_vars. Services whose task definitions
+  don't have a container using one of them are left alone (every service is
+  refreshed when there are no `*_IMAGE` docker_vars). Pinned digests are
+  looked up in the registry for the tags that were pushed (needs docker
+  buildx).
 
 Example .sykle.json:
   {
@@ -15,6 +24,14 @@ Example .sykle.json:
       "production": {
         "cluster": "foo-production",
         "env_file": ".env.production",
+        "max_parallel_updates": 10,  // Services updated at once (OPTIONAL)
+        "wait_timeout": 900,         // Seconds --wait waits for (OPTIONAL)
+        "wait_interval": 15,         // Seconds between rollout checks
+                                     // (OPTIONAL)
+        "pin_digests": false,        // Register task definitions using the
+                                     // digests of the pushed images
+                                     // rather than forcing a new
+                                     // deployment of their tags (OPTIONAL)
         "docker_vars": {
           "BACKEND_IMAGE": "*****.amazonaws.com/foo-backend",
           "BUILD_NUMBER": "latest"
@@ -33,39 +50,303 @@ Example .sykle.json:
 """
 __version__ = '0.1.0'
 import os
+import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from docopt import docopt
-from boto3.session import Session
+from sykle.config import Config
+from sykle.deploy_state import image_repository, images_from_compose_config
 from sykle.plugin_utils import IPlugin
 
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# NB: describe_services accepts at most 10 services per call
+DESCRIBE_SERVICES_LIMIT = 10
+
+# NB: the fields of a described task definition that can be registered again
+TASK_DEFINITION_FIELDS = [
+    'family', 'taskRoleArn', 'executionRoleArn', 'networkMode',
+    'containerDefinitions', 'volumes', 'placementConstraints',
+    'requiresCompatibilities', 'cpu', 'memory', 'pidMode', 'ipcMode',
+    'proxyConfiguration', 'inferenceAccelerators', 'ephemeralStorage',
+    'runtimePlatform',
+]
+
+
+def chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def pushed_images(docker_vars, env=os.environ, pushed=()):
+    """
+    Returns repository -> pushed image (with its tag) for each of the
+    `*_IMAGE` docker_vars. Tags come from `pushed` (the images docker
+    compose pushed, EX: 'repo:12') or else from the docker_var itself
+    (docker's default tag, 'latest', if it has none).
+    """
+    values = Config.interpolate_env_values(docker_vars or {}, env)
+    images = {}
+    for key, image in values.items():
+        if key.endswith('_IMAGE') and image:
+            repository = image_repository(image)
+            images[repository] = image if image != repository \
+                else image + ':latest'
+    for image in pushed:
+        if image_repository(image) in images:
+            images[image_repository(image)] = image
+    return images
+
+
+def rollout_state(service):
+    """
+    Returns 'stable', 'failed' or 'pending' for a service returned by
+    describe_services. A service is stable once its primary deployment is
+    the only one left and all of its tasks are running.
+    """
+    deployments = service.get('deployments', [])
+    for deployment in deployments:
+        if deployment.get('status') == 'PRIMARY' and \
+                deployment.get('rolloutState') == 'FAILED':
+            return 'failed'
+    if len(deployments) == 1 and \
+            service.get('runningCount') == service.get('desiredCount'):
+        return 'stable'
+    return 'pending'
+
 
 class Plugin(IPlugin):
     """Build docker images, push them to aws ecr, and refresh
     the ecs services that use them.
     """
     NAME = 'ecs'
+    DEFERRED_IMPORTS = ['boto3']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.task_definitions = {}
+        self._lock = threading.Lock()
+
+    def get_client(self):
+        from boto3.session import Session
 
-    def refresh_cluster(self, deploy_config):
-        cluster = deploy_config.__dict__.get('cluster')
         session = Session(
             profile_name=os.environ.get('AWS_PROFILE', None),
             region_name=os.environ.get('AWS_REGION', None)
         )
-        client = session.client('ecs')
-        resp = client.list_services(cluster=cluster)
+        return session.client('ecs')
+
+    def list_services(self, client, cluster):
+        """Returns the arns of every service in the cluster (all pages)"""
+        service_arns = []
+        paginator = client.get_paginator('list_services')
+        for page in paginator.paginate(cluster=cluster):
+            service_arns += page.get('serviceArns', [])
+        return service_arns
+
+    def describe_services(self, client, cluster, service_arns):
+        """Returns the description of each service (in batches)"""
+        services = []
+        for batch in chunks(service_arns, DESCRIBE_SERVICES_LIMIT):
+            resp = client.describe_services(cluster=cluster, services=batch)
+            services += resp.get('services', [])
+        return services
+
+    def get_task_definition(self, client, arn):
+        """
+        Returns a described task definition. Revisions never change, so
+        each one is only described once.
+        """
+        with self._lock:
+            if arn not in self.task_definitions:
+                resp = client.describe_task_definition(taskDefinition=arn)
+                self.task_definitions[arn] = resp['taskDefinition']
+            return self.task_definitions[arn]
+
+    def uses_images(self, task_definition, images):
+        """Returns whether any container of a task definition uses images"""
+        return any(
+            image_repository(container.get('image', '')) in images
+            for container in task_definition.get('containerDefinitions', [])
+        )
+
+    def image_digest(self, image):
+        """Returns the digest the registry has for a pushed image tag"""
+        digest = self.sykle.registry_digest(image)
+        if not digest:
+            raise Exception('No digest for "{}" in the registry'.format(image))
+        return digest
+
+    def pin_task_definition(self, client, task_definition, images):
+        """
+        Registers a new revision of a task definition, with the containers
+        using images pinned to the digests of the pushed tags (whatever the
+        containers used before, EX: a previously pinned digest). Returns its
+        arn.
+        """
+        containers = []
+        for container in task_definition['containerDefinitions']:
+            container = dict(container)
+            repository = image_repository(container.get('image', ''))
+            if repository in images:
+                container['image'] = self.image_digest(images[repository])
+            containers.append(container)
+
+        fields = {
+            key: task_definition[key] for key in TASK_DEFINITION_FIELDS
+            if key in task_definition
+        }
+        fields['containerDefinitions'] = containers
+        resp = client.register_task_definition(**fields)
+        arn = resp['taskDefinition']['taskDefinitionArn']
+        logger.info('Registered %s' % arn)
+        return arn
 
-        for service_arn in resp.get('serviceArns', []):
+    def update_services(
+        self, client, cluster, service_arns, max_workers=10,
+        task_definitions=None
+    ):
+        """
+        Deploys each service (several at once), either with a new task
+        definition (`task_definitions` maps service arns to them) or by
+        forcing a new deployment of the current one
+        """
+        if not service_arns:
+            return
+        task_definitions = task_definitions or {}
+
+        def update(service_arn):
             logger.info('Updating %s' % service_arn)
-            client.update_service(
-                cluster=cluster,
-                service=service_arn,
-                forceNewDeployment=True
+            if service_arn in task_definitions:
+                client.update_service(
+                    cluster=cluster,
+                    service=service_arn,
+                    taskDefinition=task_definitions[service_arn]
+                )
+            else:
+                client.update_service(
+                    cluster=cluster,
+                    service=service_arn,
+                    forceNewDeployment=True
+                )
+
+        with ThreadPoolExecutor(
+            max_workers=min(len(service_arns), max_workers)
+        ) as executor:
+            futures = {
+                arn: executor.submit(update, arn) for arn in service_arns
+            }
+        errors = {
+            arn: future.exception() for arn, future in futures.items()
+            if future.exception()
+        }
+        for arn, error in errors.items():
+            logger.error('Failed to update %s: %s' % (arn, error))
+        if errors:
+            raise Exception(
+                'Failed to update {} service(s)'.format(len(errors))
             )
 
+    def wait_for_services(
+        self, client, cluster, service_arns, timeout=900, interval=15,
+        clock=time.time, sleep=time.sleep
+    ):
+        """
+        Polls describe_services until every service is stable (or failed),
+        checking pending services every `interval` seconds for at most
+        `timeout` seconds. Returns arn -> (state, seconds taken).
+        """
+        started = clock()
+        pending = list(service_arns)
+        results = {}
+        attempts = max(1, int(timeout // interval))
+        for attempt in range(attempts):
+            if attempt:
+                sleep(interval)
+            for batch in chunks(pending, DESCRIBE_SERVICES_LIMIT):
+                resp = client.describe_services(
+                    cluster=cluster, services=batch
+                )
+                for service in resp.get('services', []):
+                    state = rollout_state(service)
+                    if state != 'pending':
+                        results[service['serviceArn']] = (
+                            state, clock() - started
+                        )
+                for failure in resp.get('failures', []):
+                    results[failure['arn']] = ('missing', clock() - started)
+            pending = [arn for arn in pending if arn not in results]
+            if not pending:
+                break
+        for arn in pending:
+            results[arn] = ('timeout', clock() - started)
+        return results
+
+    def report_rollout(self, cluster, service_arns, results):
+        print('Rollout of "{}":'.format(cluster))
+        for arn in service_arns:
+            state, duration = results[arn]
+            print('  {:<40} {:<8} {:.1f}s'.format(
+                arn.split('/')[-1], state.upper(), duration
+            ))
+        unstable = [arn for arn in service_arns if results[arn][0] != 'stable']
+        if unstable:
+            raise Exception(
+                '{} service(s) did not become stable'.format(len(unstable))
+            )
+
+    def refresh_cluster(self, deploy_config, wait=False, pushed=()):
+        """
+        Refreshes the services using the pushed images (`pushed` lists the
+        images, with their tags, that were pushed)
+        """
+        settings = deploy_config.__dict__
+        cluster = settings.get('cluster')
+        client = self.get_client()
+        service_arns = self.list_services(client, cluster)
+        images = pushed_images(settings.get('docker_vars'), pushed=pushed)
+
+        # NB: service arn -> task definition, for services using the images
+        affected = {}
+        if images:
+            services = self.describe_services(client, cluster, service_arns)
+            for service in services:
+                task_definition = self.get_task_definition(
+                    client, service['taskDefinition']
+                )
+                if self.uses_images(task_definition, images):
+                    affected[service['serviceArn']] = task_definition
+                else:
+                    logger.info('Skipping %s' % service['serviceArn'])
+            service_arns = [arn for arn in service_arns if arn in affected]
+
+        task_definitions = {}
+        if settings.get('pin_digests'):
+            # NB: services sharing a task definition share the new revision
+            pinned = {}
+            for service_arn, task_definition in affected.items():
+                arn = task_definition['taskDefinitionArn']
+                if arn not in pinned:
+                    pinned[arn] = self.pin_task_definition(
+                        client, task_definition, images
+                    )
+                task_definitions[service_arn] = pinned[arn]
+
+        self.update_services(
+            client, cluster, service_arns,
+            max_workers=int(settings.get('max_parallel_updates', 10)),
+            task_definitions=task_definitions
+        )
+        if wait and service_arns:
+            results = self.wait_for_services(
+                client, cluster, service_arns,
+                timeout=settings.get('wait_timeout', 900),
+                interval=settings.get('wait_interval', 15)
+            )
+            self.report_rollout(cluster, service_arns, results)
+
     def run(self):
         self.args = docopt(__doc__, version=__version__)
         self.sykle.debug = self.args.get('debug', False)
@@ -80,4 +361,13 @@ class Plugin(IPlugin):
             )
             self.sykle.predeploy(deployment)
             self.sykle.push(deployment)
-            self.refresh_cluster(deploy_config)
+            pushed = images_from_compose_config(self.sykle.dc(
+                input=['config'],
+                docker_type='prod-build',
+                deployment=deployment,
+                capture=True
+            ))
+            self.refresh_cluster(
+                deploy_config, wait=self.args.get('--wait', False),
+                pushed=pushed
+            )
@@ -21,26 +21,21 @@ from docopt import docopt
 
 from sykle.plugin_utils import IPlugin
 
-from .scm import SCM
-
 
 logger = logging.getLogger(__name__)
 
 
 class Plugin(IPlugin):
     NAME = 'repo'
+    DEFERRED_IMPORTS = ['git', 'github']
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-        self.args = docopt(__doc__, version=__version__)
+    def new_repo(self):
+        from .scm import SCM
 
         self.scm = SCM(
             org=self.args.get('--org'),
             token=self.args.get('--token'),
         )
-
-    def new_repo(self):
         repo_name = self.args['<name>']
 
         logger.info('Creating the repo')
@@ -61,7 +56,11 @@ class Plugin(IPlugin):
         logger.info('Cloning into the current directory')
         self.scm.clone_repo()
 
-    @logger.halo(succeed=True)
     def run(self):
+        self.args = docopt(__doc__, version=__version__)
+        self._run()
+
+    @logger.halo(succeed=True)
+    def _run(self):
         if self.args['new-repo']:
             self.new_repo()
@@ -3,21 +3,34 @@
 Usage:
   syk sync_pg_data recreate --dest=<name> [--debug]
   syk sync_pg_data restore --dest=<name> [--file=<name>] [--debug]
-  syk sync_pg_data dump --src=<name> [--debug]
-  syk sync_pg_data --src=<name> --dest=<name> [--debug]
+  syk sync_pg_data dump --src=<name> [--subset] [--force] [--debug]
+  syk sync_pg_data list [--src=<name>]
+  syk sync_pg_data snapshot --dest=<name> --name=<snapshot> [--debug]
+  syk sync_pg_data reset --dest=<name> --name=<snapshot> [--debug]
+  syk sync_pg_data --src=<name> --dest=<name> [--stream [--backup] | --subset]
+                   [--force] [--debug]
 
 Options:
   -h --help         Show help info
   --version         Show version
   --src=<name>      Specify where to pull data from
-  --dest=<name>     Specify where to push data to
+  --dest=<name>     Specify where to push data to (several can be given,
+                    comma separated, when restoring or syncing)
   --debug           Print debug information
   --file=<name>     Restore from a file
+  --stream          Pipe the dump straight into the restore (no dump file)
+  --backup          Also save the streamed dump to a file
+  --subset          Only dump the subset configured for the src location
+  --name=<snapshot> Name of a snapshot
+  --force           Dump even if the src hasn't changed since the last dump
 
 Description:
   recreate          Drops and then recreates a database (with data)
   dump              Dumps data to a file
   restore           Restores from a file
+  list              Lists backups (of the src location)
+  snapshot          Saves the dest database as a template database
+  reset             Recreates the dest database from a snapshot
 
 Example .sykle.json:
   {
@@ -26,10 +39,52 @@ Example .sykle.json:
             "dependent_services": [],    // List of any services that should be
                                          // stopped while syncing and restarted
                                          // afterwards. (OPTIONAL)
+            "max_parallel_restores": 4,  // Max destinations restored at
+                                         // once (OPTIONAL)
+            "host_clients": true,        // Use pg_dump/pg_restore/psql
+                                         // installed on the host when
+                                         // their version matches (OPTIONAL)
+            "compression": "auto",       // Compression for tar backups:
+                                         // "zstd", "gzip" (pigz if
+                                         // installed), "none" or "auto"
+                                         // (zstd if installed) (OPTIONAL)
+            "compression_threads": 0,    // Threads to compress with (0 uses
+                                         // every core) (OPTIONAL)
+            "retention": {               // Backups to keep (OPTIONAL)
+                "count": 10,             // Max number of backups
+                "max_age_days": 30,      // Max age of backups
+                "max_size_mb": 10240     // Max total size of backups
+            },
             "locations": {
                 "local": {                   // Name of location
                     "env_file": ".env",      // Envfile for args (OPTIONAL)
                     "write": true,           // Allow writes to location
+                    "jobs": 4,               // Dump/restore using 4 parallel
+                                             // jobs (OPTIONAL, uses the
+                                             // directory format if > 1)
+                    "include_tables": [],    // Only dump these tables
+                                             // (OPTIONAL)
+                    "exclude_tables": [],    // Don't dump these tables
+                                             // (OPTIONAL)
+                    "exclude_table_data": [  // Dump these tables without
+                        "audit_log"          // their rows (OPTIONAL)
+                    ],
+                    "fast_restore": true,    // Restore without durability
+                                             // (for throwaway dbs, or a
+                                             // dict of settings) (OPTIONAL)
+                    "skip_unchanged": true,  // Reuse the last dump if nothing
+                                             // changed since (OPTIONAL)
+                    "subset": {              // Used by --subset (OPTIONAL)
+                        "roots": {           // Rows to start from: a WHERE
+                                             // predicate, a percentage of
+                                             // rows or true (all rows)
+                            "auth_user": "is_staff",
+                            "orders": 10,
+                            "django_migrations": true
+                        },
+                        "max_depth": 10      // Foreign keys to follow from
+                                             // the roots (OPTIONAL)
+                    },
                     "args": {
                        "PORT": 5432,         // Port for postgres (OPTIONAL)
                        "HOST": "$PG_HOST",   // Host for postgres
@@ -47,31 +102,141 @@ Example .sykle.json:
 
 __version__ = '0.1.0'
 
-from sykle.call_subprocess import call_subprocess
+from sykle.call_subprocess import (
+    call_subprocess, pipefail, NonZeroReturnCodeException
+)
 from sykle.plugin_utils import IPlugin
 from sykle.config import Config
 from docopt import docopt
 from datetime import datetime
 import os
+import re
+import json
+import time
+import shlex
+import shutil
+import hashlib
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .backup_store import BackupStore, path_size
+from .codec import get_codec, codec_for_path
+from .clients import PgClients
+from .progress import TableProgress, showing_progress
+from .subset import (
+    FOREIGN_KEYS_QUERY, DEFAULT_MAX_DEPTH, data_script, parse_foreign_keys,
+    subset_conditions
+)
 
 
 class Plugin(IPlugin):
     REQUIRED_ARGS = ['USER', 'HOST', 'NAME', 'PASSWORD']
     NAME = 'sync_pg_data'
     dump_dir = 'backups'
+    show_progress = True
 
-    def get_dump_file_name(self, location):
-        now = str(datetime.now()).replace(' ', '_')
-        filename = '{}_backup_{}'.format(location, now)
-        return os.path.join(self.dump_dir, filename)
+    FORMAT_EXTENSIONS = {
+        'tar': '', 'directory': '.dir', 'custom': '.dump', 'subset': '.subset'
+    }
+    SUBSET_SCHEMA_FILE = 'schema.dump'
+    SUBSET_DATA_FILE = 'data.sql'
+    SUBSET_SCRIPT_FILE = 'subset.sql'
+    SNAPSHOT_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_]+$')
+    # NB: also matches the names used before (EX: with `str(datetime)`)
+    DUMP_FILE_PATTERN = re.compile(
+        r'^.+_backup_\d[-\d_:.T]*(\.dir|\.dump|\.subset)?(\.gz|\.zst)?$'
+    )
+    MAINTENANCE_DATABASE = 'postgres'
 
-    def _get_location_args(self, location_name):
+    # NB: pg_restore already adds constraints after the data is loaded, so
+    #     most of the gain is in not waiting on WAL flushes and in giving
+    #     index builds/constraint validation plenty of memory
+    FAST_RESTORE_SETTINGS = {
+        'synchronous_commit': 'off',
+        'maintenance_work_mem': '1GB',
+    }
+
+    # NB: counts rows written by every transaction in the database (schema
+    #     changes included), so they only move when something changed
+    CHANGE_MARKER_QUERY = (
+        'SELECT tup_inserted, tup_updated, tup_deleted, stats_reset '
+        'FROM pg_stat_database WHERE datname = current_database()'
+    )
+
+    def get_dump_file_name(self, location, format=None):
+        if format is None:
+            format = 'directory' if self.get_jobs(location) > 1 else 'tar'
+        now = datetime.now().strftime('%Y%m%dT%H%M%S')
+        name = '{}_backup_{}'.format(location, now)
+
+        # NB: dumps made within the same second get a `-N` suffix rather
+        #     than overwriting each other. codec extensions are added to
+        #     the name later on, so any file with the name is a clash
+        existing = (
+            os.listdir(self.dump_dir) if os.path.isdir(self.dump_dir)
+            else []
+        )
+        unique, count = name, 0
+        while any(
+            f == unique or f.startswith(unique + '.') for f in existing
+        ):
+            count += 1
+            unique = '{}-{}'.format(name, count)
+        return os.path.join(
+            self.dump_dir, unique + self.FORMAT_EXTENSIONS[format]
+        )
+
+    @property
+    def store(self):
+        if not hasattr(self, '_store'):
+            self._store = BackupStore(self.dump_dir)
+        return self._store
+
+    def _get_location(self, location_name):
         locations = self.config.get("locations", {})
         location = locations.get(location_name)
         if location is None:
             raise Exception(
                 'Unknown location "{}" (check "sync_pg_data" config)'
                 .format(location_name))
+        return location
+
+    def get_fast_restore_settings(self, location_name):
+        """
+        Returns the settings to restore the location with (None unless the
+        location has `fast_restore` set)
+        """
+        fast_restore = self._get_location(location_name).get('fast_restore')
+        if not fast_restore:
+            return None
+        settings = dict(self.FAST_RESTORE_SETTINGS)
+        if isinstance(fast_restore, dict):
+            settings.update(fast_restore)
+        return settings
+
+    def get_jobs(self, location_name):
+        """Number of parallel jobs to dump/restore the location with"""
+        return int(self._get_location(location_name).get('jobs', 1))
+
+    def get_table_args(self, location_name, schema_only=False):
+        """pg_dump args for the tables included/excluded by the location"""
+        location = self._get_location(location_name)
+        options = [
+            ('include_tables', '--table'),
+            ('exclude_tables', '--exclude-table'),
+        ]
+        if not schema_only:
+            options.append(('exclude_table_data', '--exclude-table-data'))
+
+        table_args = []
+        for key, flag in options:
+            for table in location.get(key, []):
+                table_args.append('{}={}'.format(flag, shlex.quote(table)))
+        return table_args
+
+    def _get_location_args(self, location_name):
+        location = self._get_location(location_name)
 
         env_file = location.get('env_file')
         args = location.get('args')
@@ -96,31 +261,352 @@ class Plugin(IPlugin):
         if not os.path.isdir(self.dump_dir):
             os.makedirs(self.dump_dir)
 
-    def dump(self, location, dump_file, debug=False):
+    @property
+    def clients(self):
+        if not hasattr(self, '_clients'):
+            self._clients = PgClients(
+                use_host=self.config.get('host_clients', True)
+            )
+        return self._clients
+
+    def _pg_command(
+        self, args, command, mount=None, interactive=False, env=None
+    ):
+        """
+        Wraps a postgres client command so it runs with a matching client
+        (mounting the `mount` directory if given, keeping stdin open if
+        `interactive` is true and setting any `env` variables)
+        """
+        return self.clients.command(args, command, mount, interactive, env)
+
+    def _psql_command(self, args, command, mount=None, database=None):
+        return self._pg_command(args, [
+            'psql', '-h', args['HOST'], '-U', args['USER'],
+            '-p', str(args.get('PORT', 5432)),
+            '-d', database or args['NAME'],
+            '-v', 'ON_ERROR_STOP=1', '-q',
+        ] + command, mount=mount)
+
+    def _call_with_progress(self, commands, progress, debug=False):
+        """
+        Runs verbose pg_dump/pg_restore commands (one after the other),
+        following their output to show progress and then printing how long
+        each table took
+        """
+        tail = deque(maxlen=20)
+
+        def on_stderr(line):
+            tail.append(line)
+            progress.feed(line)
+            if debug:
+                print(line)
+
+        try:
+            with showing_progress(
+                progress, enabled=self.show_progress and not debug
+            ):
+                for command in commands:
+                    call_subprocess(
+                        command=command, debug=debug, on_stderr=on_stderr
+                    )
+        except NonZeroReturnCodeException:
+            # NB: the output was swallowed, so the end of it is shown
+            if not debug:
+                print('\n'.join(tail))
+            raise
+        progress.finish()
+        print(progress.report())
+
+    def get_change_marker(self, location, subset=False, debug=False):
+        """
+        Returns a marker that changes whenever data in the given location
+        (or the way it gets dumped) changes, or None if the location
+        doesn't have `skip_unchanged` set (or the marker can't be read)
+        """
+        location_config = self._get_location(location)
+        if not location_config.get('skip_unchanged'):
+            return None
+        args = self._get_location_args(location)
+        try:
+            counters = call_subprocess(
+                command=self._psql_command(args, [
+                    '-At', '-c', shlex.quote(self.CHANGE_MARKER_QUERY)
+                ]),
+                debug=debug, capture=True
+            ).strip()
+        except NonZeroReturnCodeException:
+            return None
+        if not counters:
+            return None
+
+        options = {
+            key: location_config.get(key) for key in [
+                'include_tables', 'exclude_tables', 'exclude_table_data',
+                'jobs', 'subset',
+            ]
+        }
+        options['subset_dump'] = subset
+        options_hash = hashlib.sha256(
+            json.dumps(options, sort_keys=True).encode()
+        ).hexdigest()[:12]
+        return '{}:{}'.format(options_hash, counters)
+
+    def get_unchanged_backup(self, location, change_marker):
+        """Returns the latest backup of a location if it has the marker"""
+        latest = self.store.latest(location)
+        entry = latest and self.store.get(latest)
+        if entry and entry.get('change_marker') == change_marker:
+            return latest
+        return None
+
+    def dump(
+        self, location, dump_file, debug=False, subset=False, force=False
+    ):
         """
         Dumps data from the given location (no contraints/tables, just data)
+
+        Returns the dump's path, which is the previous dump of the location
+        when nothing changed since it was made (unless `force` is true)
         """
         self.ensure_dump_dir()
 
+        # NB: the marker is read before dumping so changes made during the
+        #     dump get picked up by the next one
+        change_marker = self.get_change_marker(location, subset, debug)
+        previous = change_marker and self.get_unchanged_backup(
+            location, change_marker
+        )
+        if previous and not force:
+            print('"{}" is unchanged since "{}", reusing it.'.format(
+                location, previous
+            ))
+            self.store.touch(previous)
+            return previous
+
+        if subset:
+            return self.dump_subset(
+                location, dump_file, debug, change_marker=change_marker
+            )
+
         args = self._get_location_args(location)
+        jobs = self.get_jobs(location)
+        pg_dump = [
+            'pg_dump', '-h', args['HOST'],
+            '-v', '-U', args['USER'], args['NAME'],
+            '-p', str(args.get('PORT', 5432)),
+        ] + self.get_table_args(location)
+
+        # NB: directory dumps are compressed by pg_dump itself, tar dumps
+        #     are piped through the codec as they are written
+        if jobs > 1:
+            format = 'directory'
+            codec = get_codec('none')
+            format_args = ['--format', 'directory', '--jobs', str(jobs)]
+        else:
+            format = 'tar'
+            codec = get_codec(self.config.get('compression', 'auto'))
+            format_args = ['--format', 'tar']
+
+        if codec.extension:
+            dump_file += codec.extension
+            command = pipefail(
+                self._pg_command(args, pg_dump + format_args) + ['|'] +
+                codec.compress_command(
+                    threads=self.config.get('compression_threads', 0)
+                ) + ['>', dump_file]
+            )
+        else:
+            command = self._pg_command(
+                args, pg_dump + ['-f', dump_file] + format_args,
+                mount=os.path.dirname(dump_file)
+            )
+
         print('Dumping "{}" to "{}"...'.format(location, dump_file))
-        dump_dir = os.path.dirname(dump_file)
+        start = time.time()
+        progress = TableProgress(
+            size=lambda: path_size(dump_file)
+            if os.path.exists(dump_file) else 0,
+            parallel=jobs > 1
+        )
+        try:
+            self._call_with_progress([command], progress, debug)
+        except Exception:
+            # NB: a dump that failed partway must never get restored
+            if os.path.isdir(dump_file):
+                shutil.rmtree(dump_file)
+            elif os.path.exists(dump_file):
+                os.remove(dump_file)
+            raise
+        duration = time.time() - start
+
+        self.store.add(
+            dump_file, location=location, format=format,
+            duration=duration, compression=codec.name,
+            table_report=progress.tables, change_marker=change_marker
+        )
+        self.store.enforce_retention(**self.config.get('retention', {}))
+        print('Dumped "{}" to "{}".'.format(location, dump_file))
+        return dump_file
+
+    def dump_subset(
+        self, location, dump_file, debug=False, change_marker=None
+    ):
+        """
+        Dumps the subset configured for the given location: the schema plus
+        the rows selected by the subset's roots and every row those rows
+        reference (through foreign keys)
+        """
+        location_config = self._get_location(location)
+        subset = location_config.get('subset')
+        if not subset or not subset.get('roots'):
+            raise Exception(
+                'Config for "{}" needs "subset" with "roots"!'
+                .format(location))
+        args = self._get_location_args(location)
+        if not os.path.isdir(dump_file):
+            os.makedirs(dump_file)
+        mount = os.path.dirname(dump_file)
+
+        print('Dumping subset of "{}" to "{}"...'.format(location, dump_file))
+        start = time.time()
         call_subprocess(
-            command=[
-                'docker', 'run', '-v',
-                "{}:/{}".format(os.path.abspath(dump_dir), dump_dir),
-                '-e', "PGPASSWORD={}".format(args['PASSWORD']),
-                "--network={}".format(args.get('NETWORK', 'default')),
-                "postgres:{}".format(args.get('VERSION', 10.5)),
+            command=self._pg_command(args, [
                 'pg_dump', '-h', args['HOST'],
                 '-v', '-U', args['USER'], args['NAME'],
                 '-p', str(args.get('PORT', 5432)),
-                '-f', dump_file,
-                '--format', 'tar'
-            ],
+                '-f', os.path.join(dump_file, self.SUBSET_SCHEMA_FILE),
+                '--format', 'custom', '--schema-only',
+            ] + self.get_table_args(location, schema_only=True), mount=mount),
             debug=debug
         )
-        print('Dumped "{}" to "{}".'.format(location, dump_file))
+
+        foreign_keys = parse_foreign_keys(call_subprocess(
+            command=self._psql_command(args, [
+                '-At', '-F', shlex.quote('|'),
+                '-c', shlex.quote(FOREIGN_KEYS_QUERY),
+            ]),
+            debug=debug, capture=True
+        ))
+        conditions = subset_conditions(
+            subset['roots'], foreign_keys,
+            subset.get('max_depth', DEFAULT_MAX_DEPTH)
+        )
+
+        exclude = set(
+            location_config.get('exclude_tables', []) +
+            location_config.get('exclude_table_data', [])
+        )
+        include = location_config.get('include_tables')
+        if include:
+            exclude |= set(conditions) - set(include)
+
+        # NB: the rows are selected by psql (in a single snapshot) and
+        #     written out as a script of COPY statements
+        script_file = os.path.join(dump_file, self.SUBSET_SCRIPT_FILE)
+        with open(script_file, 'w') as f:
+            f.write(data_script(conditions, exclude))
+        call_subprocess(
+            command=self._psql_command(args, [
+                '-At', '-f', script_file,
+                '-o', os.path.join(dump_file, self.SUBSET_DATA_FILE),
+            ], mount=mount),
+            debug=debug
+        )
+        duration = time.time() - start
+
+        self.store.add(
+            dump_file, location=location, format='subset', duration=duration,
+            subset_tables=sorted(set(conditions) - exclude),
+            change_marker=change_marker
+        )
+        self.store.enforce_retention(**self.config.get('retention', {}))
+        print('Dumped subset of "{}" to "{}".'.format(location, dump_file))
+        return dump_file
+
+    def restore_subset(self, location, restore_file, debug=False):
+        """
+        Restores a subset dumped by `dump_subset`. Constraints and indexes
+        are only created once all of the rows are in.
+        """
+        args = self._get_location_args(location)
+        mount = os.path.dirname(restore_file)
+        schema_file = os.path.join(restore_file, self.SUBSET_SCHEMA_FILE)
+        pg_restore = [
+            'pg_restore', '--verbose', '--host', args['HOST'],
+            '--username', args['USER'],
+            '--port', str(args.get('PORT', 5432)),
+            '--dbname', args['NAME'],
+        ]
+        call_subprocess(
+            command=self._pg_command(
+                args, pg_restore + ['--section=pre-data', schema_file],
+                mount=mount
+            ),
+            debug=debug
+        )
+        call_subprocess(
+            command=self._psql_command(args, [
+                '-f', os.path.join(restore_file, self.SUBSET_DATA_FILE)
+            ], mount=mount),
+            debug=debug
+        )
+        call_subprocess(
+            command=self._pg_command(
+                args, pg_restore + ['--section=post-data', schema_file],
+                mount=mount
+            ),
+            debug=debug
+        )
+
+    def stream(self, src, dest, backup_file=None, debug=False):
+        """
+        Pipes a dump of the source location straight into a restore of the
+        destination location, optionally saving the dump to `backup_file`
+        along the way. (requires truncation)
+        """
+        # Double check to ensure we aren't overwriting prod
+        self.check_write_permissions(dest)
+        src_args = self._get_location_args(src)
+        dest_args = self._get_location_args(dest)
+
+        tee = []
+        if backup_file:
+            self.ensure_dump_dir()
+            tee = ['tee', backup_file, '|']
+
+        dump_command = self._pg_command(src_args, [
+            'pg_dump', '-h', src_args['HOST'],
+            '-v', '-U', src_args['USER'], src_args['NAME'],
+            '-p', str(src_args.get('PORT', 5432)),
+            '--format', 'custom'
+        ] + self.get_table_args(src))
+        restore_command = self._pg_command(dest_args, [
+            'pg_restore', '--verbose', '--host', dest_args['HOST'],
+            '--username', dest_args['USER'],
+            '--port', str(dest_args.get('PORT', 5432)),
+            '--dbname', dest_args['NAME'],
+        ], interactive=True)
+
+        print('Streaming "{}" to "{}"...'.format(src, dest))
+        start = time.time()
+        try:
+            call_subprocess(
+                command=pipefail(dump_command + ['|'] + tee + restore_command),
+                debug=debug
+            )
+        except Exception:
+            # NB: a dump that failed partway leaves a truncated backup
+            if backup_file and os.path.exists(backup_file):
+                os.remove(backup_file)
+            raise
+        print('Streamed "{}" to "{}".'.format(src, dest))
+        if backup_file:
+            self.store.add(
+                backup_file, location=src, format='custom',
+                duration=time.time() - start
+            )
+            self.store.enforce_retention(**self.config.get('retention', {}))
+            print('Saved dump of "{}" to "{}".'.format(src, backup_file))
 
     def restore(self, location, restore_file, debug=False):
         """
@@ -130,25 +616,161 @@ class Plugin(IPlugin):
         self.check_write_permissions(location)
         args = self._get_location_args(location)
 
-        print('Restoring "{}" to "{}"...'.format(restore_file, location))
-        restore_dir = os.path.dirname(restore_file)
-        call_subprocess(
-            command=[
-                'docker', 'run', '-v',
-                "{}:/{}".format(os.path.abspath(restore_dir), restore_dir),
-                '-e', "PGPASSWORD={}".format(args['PASSWORD']),
-                "--network={}".format(args.get('NETWORK', 'default')),
-                "postgres:{}".format(args.get('VERSION', 10.5)),
-                'pg_restore', '--verbose', '--host', args['HOST'],
-                '--username', args['USER'],
-                '--port', str(args.get('PORT', 5432)),
-                '--dbname', args['NAME'],
-                restore_file
-            ],
-            debug=debug
+        entry = self.store.get(restore_file)
+        codec = get_codec(entry['compression']) if entry else \
+            codec_for_path(restore_file)
+
+        if restore_file.rstrip('/').endswith(
+            self.FORMAT_EXTENSIONS['subset']
+        ):
+            print('Restoring "{}" to "{}"...'.format(restore_file, location))
+            self.restore_subset(location, restore_file, debug)
+            self.store.touch(restore_file)
+            print('Restored "{}" to "{}".'.format(restore_file, location))
+            return
+
+        # NB: pg_restore can't restore tar archives in parallel
+        jobs = self.get_jobs(location)
+        jobs_args = []
+        if jobs > 1 and os.path.isdir(restore_file):
+            jobs_args = ['--jobs', str(jobs)]
+
+        pg_restore = [
+            'pg_restore', '--verbose', '--host', args['HOST'],
+            '--username', args['USER'],
+            '--port', str(args.get('PORT', 5432)),
+            '--dbname', args['NAME'],
+        ] + jobs_args
+
+        report = (entry or {}).get('table_report', {})
+        progress = TableProgress(
+            known_sizes={t: s['size'] for t, s in report.items()},
+            parallel=bool(jobs_args)
+        )
+
+        # NB: fast restores trade durability for speed with settings that
+        #     only last for pg_restore's sessions, so nothing needs reverting
+        env = None
+        sections = [[]]
+        fast_restore = self.get_fast_restore_settings(location)
+        if fast_restore:
+            env = {'PGOPTIONS': ' '.join(
+                '-c {}={}'.format(k, v)
+                for k, v in sorted(fast_restore.items())
+            )}
+            if not jobs_args:
+                sections = [
+                    ['--single-transaction', '--section={}'.format(section)]
+                    for section in ['pre-data', 'data', 'post-data']
+                ]
+
+        print('Restoring "{}" to "{}"{}...'.format(
+            restore_file, location, ' (fast)' if fast_restore else ''
+        ))
+        archive = restore_file
+        if codec.extension and len(sections) > 1:
+            # NB: every section reads the whole archive, so it is
+            #     decompressed once (next to the backup) rather than once
+            #     per section
+            fd, archive = tempfile.mkstemp(
+                suffix='.tar', dir=os.path.dirname(restore_file) or '.'
+            )
+            os.close(fd)
+        try:
+            if archive != restore_file:
+                call_subprocess(
+                    command=codec.decompress_command() + [
+                        restore_file, '>', archive
+                    ],
+                    debug=debug
+                )
+
+            commands = []
+            for section_args in sections:
+                if archive == restore_file and codec.extension:
+                    # NB: compressed backups are decompressed into
+                    #     pg_restore's stdin
+                    commands.append(pipefail(
+                        codec.decompress_command() + [
+                            restore_file, '|'
+                        ] + self._pg_command(
+                            args, pg_restore + section_args,
+                            interactive=True, env=env
+                        )
+                    ))
+                else:
+                    commands.append(self._pg_command(
+                        args, pg_restore + section_args + [archive],
+                        mount=os.path.dirname(archive), env=env
+                    ))
+            self._call_with_progress(commands, progress, debug)
+        finally:
+            if archive != restore_file:
+                os.remove(archive)
+        self.store.update(
+            restore_file, last_used=time.time(),
+            restore_report=progress.tables
         )
         print('Restored "{}" to "{}".'.format(restore_file, location))
 
+    def get_destinations(self, dest):
+        """
+        Splits a comma separated --dest, checking that every destination can
+        be written to before anything is done
+        """
+        dests = [d.strip() for d in dest.split(',') if d.strip()]
+        for location in dests:
+            self.check_write_permissions(location)
+        return dests
+
+    def restore_all(self, dests, restore_file, debug=False):
+        """
+        Recreates each destination and restores the same file into it.
+        Several destinations are restored in parallel (at most
+        `max_parallel_restores` at once) and summarized at the end.
+        """
+        if not dests:
+            return
+        if len(dests) == 1:
+            self.recreate(dests[0], debug)
+            self.restore(dests[0], restore_file, debug)
+            return
+
+        def restore(dest):
+            start = time.time()
+            self.recreate(dest, debug)
+            self.restore(dest, restore_file, debug)
+            return time.time() - start
+
+        # NB: spinners from several threads would fight over the terminal
+        self.show_progress = False
+        max_workers = min(
+            len(dests), int(self.config.get('max_parallel_restores', 4))
+        )
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {dest: executor.submit(restore, dest) for dest in dests}
+            for dest, future in futures.items():
+                try:
+                    results[dest] = (future.result(), None)
+                except Exception as e:
+                    results[dest] = (None, e)
+
+        print('Restored "{}" to:'.format(restore_file))
+        for dest in dests:
+            duration, error = results[dest]
+            if error:
+                print('  {:<24} FAILED  {}'.format(
+                    dest, str(error) or type(error).__name__
+                ))
+            else:
+                print('  {:<24} OK      {:.1f}s'.format(dest, duration))
+
+        failed = [dest for dest in dests if results[dest][1]]
+        if failed:
+            raise Exception(
+                'Failed to restore to {}'.format(', '.join(failed)))
+
     def recreate(self, location, debug=False):
         """
         Deletes all data in the given location.
@@ -159,43 +781,130 @@ class Plugin(IPlugin):
 
         print('Dropping "{}"...'.format(location))
         call_subprocess(
-            command=[
-                'docker', 'run',
-                '-e', "PGPASSWORD={}".format(args['PASSWORD']),
-                "--network={}".format(args.get('NETWORK', 'default')),
-                "postgres:{}".format(args.get('VERSION', 10.5)),
+            command=self._pg_command(args, [
                 'dropdb', '--host', args['HOST'],
                 '--username', args['USER'],
                 '--port', str(args.get('PORT', 5432)),
                 args['NAME']
-            ],
+            ]),
             debug=debug
         )
         print('Dropped "{}".'.format(location))
         print('Creating "{}"...'.format(location))
         call_subprocess(
-            command=[
-                'docker', 'run',
-                '-e', "PGPASSWORD={}".format(args['PASSWORD']),
-                "--network={}".format(args.get('NETWORK', 'default')),
-                "postgres:{}".format(args.get('VERSION', 10.5)),
+            command=self._pg_command(args, [
                 'createdb', '--host', args['HOST'],
                 '--username', args['USER'],
                 '--port', str(args.get('PORT', 5432)),
                 args['NAME']
-            ],
+            ]),
             env={'PGPASSWORD': str(args['PASSWORD'])},
             debug=debug
         )
         print('Created "{}".'.format(location))
 
+    def get_snapshot_database(self, location, name):
+        """Name of the template database holding a snapshot"""
+        if not self.SNAPSHOT_NAME_PATTERN.match(name or ''):
+            raise Exception(
+                'Invalid snapshot name "{}" (use letters, digits and _)'
+                .format(name))
+        args = self._get_location_args(location)
+        return '{}_snapshot_{}'.format(args['NAME'], name)
+
+    def _run_sql(self, args, statements, debug=False):
+        """
+        Runs each statement on its own (CREATE/DROP DATABASE can't run in
+        a transaction) from the maintenance database
+        """
+        command = []
+        for statement in statements:
+            command += ['-c', shlex.quote(statement)]
+        call_subprocess(
+            command=self._psql_command(
+                args, command, database=self.MAINTENANCE_DATABASE
+            ),
+            debug=debug
+        )
+
+    def _disconnect_sql(self, database):
+        return (
+            "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+            "WHERE datname = '{}' AND pid <> pg_backend_pid()"
+            .format(database)
+        )
+
+    def _drop_template_sql(self, database):
+        # NB: template databases can't be dropped until they're unmarked
+        return [
+            "DO $$BEGIN IF EXISTS (SELECT FROM pg_database "
+            "WHERE datname = '{0}') THEN "
+            "ALTER DATABASE \"{0}\" IS_TEMPLATE false; END IF; END$$"
+            .format(database),
+            'DROP DATABASE IF EXISTS "{}"'.format(database),
+        ]
+
+    def _require_database_sql(self, database):
+        # NB: psql stops at the first error, so nothing after this runs
+        #     if the database is missing
+        return (
+            "DO $$BEGIN IF NOT EXISTS (SELECT FROM pg_database "
+            "WHERE datname = '{0}') THEN "
+            "RAISE EXCEPTION 'Database \"{0}\" does not exist'; "
+            "END IF; END$$"
+            .format(database)
+        )
+
+    def snapshot(self, location, name, debug=False):
+        """
+        Copies the given location's database into a template database, so
+        that it can be `reset` to its current state later on (replaces any
+        previous snapshot with the same name)
+        """
+        self.check_write_permissions(location)
+        args = self._get_location_args(location)
+        snapshot = self.get_snapshot_database(location, name)
+
+        print('Snapshotting "{}" as "{}"...'.format(location, name))
+        # NB: a database can't be copied while anyone is connected to it
+        self._run_sql(args, self._drop_template_sql(snapshot) + [
+            self._disconnect_sql(args['NAME']),
+            'CREATE DATABASE "{}" TEMPLATE "{}"'.format(
+                snapshot, args['NAME']
+            ),
+            'ALTER DATABASE "{}" IS_TEMPLATE true'.format(snapshot),
+        ], debug)
+        print('Snapshotted "{}" as "{}".'.format(location, name))
+
+    def reset(self, location, name, debug=False):
+        """
+        Recreates the given location's database from a snapshot. (requires
+        truncation)
+        """
+        self.check_write_permissions(location)
+        args = self._get_location_args(location)
+        snapshot = self.get_snapshot_database(location, name)
+
+        print('Resetting "{}" to "{}"...'.format(location, name))
+        # NB: the snapshot is checked before anything gets dropped, so a
+        #     mistyped name leaves the database as it was
+        self._run_sql(args, [
+            self._require_database_sql(snapshot),
+            self._disconnect_sql(args['NAME']),
+            'DROP DATABASE IF EXISTS "{}"'.format(args['NAME']),
+            'CREATE DATABASE "{}" TEMPLATE "{}"'.format(
+                args['NAME'], snapshot
+            ),
+        ], debug)
+        print('Reset "{}" to "{}".'.format(location, name))
+
     def confirm_delete(self, location):
         return input(
             "This will delete all data in '{}'.\nContinue? (y/n): "
             .format(location)) == 'y'
 
     def confirm_dump(self, dump_file):
-        if os.path.isfile(dump_file):
+        if os.path.exists(dump_file):
             return input(
                 "'{}' will be overwritten.\nContinue? (y/n): "
                 .format(dump_file)) == 'y'
@@ -204,7 +913,7 @@ class Plugin(IPlugin):
     def confirm_restore(self, restore_file, location):
         if not restore_file:
             raise Exception('No restore file!')
-        if not os.path.isfile(restore_file):
+        if not os.path.exists(restore_file):
             raise Exception('{} does not exist!'.format(restore_file))
         return input(
             "Restore '{}' to '{}'? (y/n): "
@@ -217,10 +926,34 @@ class Plugin(IPlugin):
                 'Cannot delete/write data to "{}" '.format(location) +
                 '("write" is not set to true)')
 
-    def most_recent_backup(self):
-        files = [f for f in os.listdir(self.dump_dir)]
-        files.sort()
-        return os.path.join(self.dump_dir, files[-1]) if files else None
+    def most_recent_backup(self, location=None):
+        latest = self.store.latest(location)
+        if latest or location:
+            return latest
+
+        # NB: falls back to backups made before there was a catalog. they
+        #     are files (tar format) or directories (directory format), so
+        #     they are sorted by modification time. anything else in the
+        #     directory (assets, temp files, ...) is left out
+        paths = [
+            os.path.join(self.dump_dir, f) for f in os.listdir(self.dump_dir)
+            if self.DUMP_FILE_PATTERN.match(f)
+        ]
+        return max(paths, key=os.path.getmtime) if paths else None
+
+    def list_backups(self, location=None):
+        for entry in self.store.list(location):
+            print('{}  {}  {:>10.1f} MB  {:>8.1f}s  {}{}'.format(
+                datetime.fromtimestamp(entry['timestamp'])
+                .strftime('%Y-%m-%d %H:%M:%S'),
+                entry['location'],
+                entry['size'] / 1024 / 1024,
+                entry['duration'],
+                entry['format'],
+                ' ({})'.format(entry['compression'])
+                if entry['compression'] not in [None, 'none'] else '',
+            ))
+            print('  {}'.format(self.store.path_for(entry)))
 
     def run(self):
         args = docopt(__doc__, version=__version__)
@@ -228,7 +961,25 @@ class Plugin(IPlugin):
         dest = args.get('--dest')
         debug = args.get('--debug')
         self.sykle.debug = debug
+        self.clients.debug = debug
+
+        if args['list']:
+            self.list_backups(src)
+            return
+
+        single_dest_commands = ['recreate', 'snapshot', 'reset', '--stream']
+        if dest and ',' in dest and any(
+            args[command] for command in single_dest_commands
+        ):
+            raise Exception(
+                'Only restoring and syncing support several destinations')
+
+        try:
+            self._run(args, src, dest, debug)
+        finally:
+            self.clients.close()
 
+    def _run(self, args, src, dest, debug):
         dependent_services = self.config.get("dependent_services", [])
         for service in dependent_services:
             self.sykle.dc(["stop", service])
@@ -237,23 +988,48 @@ class Plugin(IPlugin):
             self.check_write_permissions(dest)
             if self.confirm_delete(dest):
                 self.recreate(dest, debug)
-        elif args['restore']:
+        elif args['snapshot']:
+            self.snapshot(dest, args['--name'], debug)
+        elif args['reset']:
             self.check_write_permissions(dest)
+            self.get_snapshot_database(dest, args['--name'])
+            if self.confirm_delete(dest):
+                self.reset(dest, args['--name'], debug)
+        elif args['restore']:
+            dests = self.get_destinations(dest)
             file = args['--file'] or self.most_recent_backup()
-            if self.confirm_restore(file, dest) and self.confirm_delete(dest):
-                self.recreate(dest, debug)
-                self.restore(dest, file, debug)
+            if self.confirm_restore(file, dest):
+                dests = [d for d in dests if self.confirm_delete(d)]
+                self.restore_all(dests, file, debug)
         elif args['dump']:
-            dump_file = self.get_dump_file_name(src)
+            dump_file = self.get_dump_file_name(
+                src, format='subset' if args['--subset'] else None
+            )
             if self.confirm_dump(dump_file):
-                self.dump(src, dump_file, debug)
-        else:
+                self.dump(
+                    src, dump_file, debug, subset=args['--subset'],
+                    force=args['--force']
+                )
+        elif args['--stream']:
             self.check_write_permissions(dest)
-            dump_file = self.get_dump_file_name(src)
-            if self.confirm_delete(dest) and self.confirm_dump(dump_file):
-                self.dump(src, dump_file, debug)
+            backup_file = None
+            if args['--backup']:
+                backup_file = self.get_dump_file_name(src, format='custom')
+            if self.confirm_delete(dest):
                 self.recreate(dest, debug)
-                self.restore(dest, dump_file, debug)
+                self.stream(src, dest, backup_file, debug)
+        else:
+            dests = self.get_destinations(dest)
+            dump_file = self.get_dump_file_name(
+                src, format='subset' if args['--subset'] else None
+            )
+            dests = [d for d in dests if self.confirm_delete(d)]
+            if dests and self.confirm_dump(dump_file):
+                dump_file = self.dump(
+                    src, dump_file, debug, subset=args['--subset'],
+                    force=args['--force']
+                )
+                self.restore_all(dests, dump_file, debug)
 
         for service in dependent_services:
             self.sykle.dc(["start", service])
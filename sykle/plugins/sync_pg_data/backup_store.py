@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+
+def path_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path) for f in files
+    )
+
+
+def file_checksum(path):
+    """Returns the sha256 of a backup file (None for directories)"""
+    if not os.path.isfile(path):
+        return None
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class BackupStore:
+    """
+    Keeps a catalog (`catalog.json`) of the backups in a dump directory,
+    recording each backup's location, timestamp, size, duration, format,
+    compression and checksum. The most recent backup of each location is
+    indexed so it can be found without listing the directory.
+    """
+    CATALOG_FILE = 'catalog.json'
+    ALL_LOCATIONS = '*'
+
+    def __init__(self, path):
+        self.path = path
+        self._catalog = None
+        # NB: backups can be restored to several locations at once
+        self._lock = threading.RLock()
+
+    @property
+    def catalog_file(self):
+        return os.path.join(self.path, self.CATALOG_FILE)
+
+    @property
+    def catalog(self):
+        if self._catalog is None:
+            self._catalog = {'backups': {}, 'latest': {}}
+            if os.path.isfile(self.catalog_file):
+                with open(self.catalog_file) as f:
+                    self._catalog = json.load(f)
+        return self._catalog
+
+    def save(self):
+        with self._lock:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            tmp_file = self.catalog_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(self.catalog, f, indent=2, sort_keys=True)
+            os.replace(tmp_file, self.catalog_file)
+
+    def add(
+        self, path, location, format, duration, compression=None, **extras
+    ):
+        """Records a new backup and returns its catalog entry"""
+        now = time.time()
+        entry = dict(extras, **{
+            'name': os.path.basename(path),
+            'location': location,
+            'timestamp': now,
+            'last_used': now,
+            'size': path_size(path),
+            'duration': round(duration, 3),
+            'format': format,
+            'compression': compression,
+            'checksum': file_checksum(path),
+        })
+        self.catalog['backups'][entry['name']] = entry
+        self.catalog['latest'][location] = entry['name']
+        self.catalog['latest'][self.ALL_LOCATIONS] = entry['name']
+        self.save()
+        return entry
+
+    def get(self, path):
+        """Returns the catalog entry of a backup (None if not cataloged)"""
+        return self.catalog['backups'].get(os.path.basename(path))
+
+    def path_for(self, entry):
+        return os.path.join(self.path, entry['name'])
+
+    def latest(self, location=None):
+        """Returns the path of the most recent backup (of a location)"""
+        name = self.catalog['latest'].get(location or self.ALL_LOCATIONS)
+        if name and os.path.exists(os.path.join(self.path, name)):
+            return os.path.join(self.path, name)
+        return None
+
+    def update(self, path, **fields):
+        """Updates the catalog entry of a backup (if it is cataloged)"""
+        with self._lock:
+            entry = self.get(path)
+            if entry:
+                entry.update(fields)
+                self.save()
+            return entry
+
+    def touch(self, path):
+        """Marks a backup as used (backups are evicted least used first)"""
+        self.update(path, last_used=time.time())
+
+    def list(self, location=None):
+        return sorted(
+            (
+                entry for entry in self.catalog['backups'].values()
+                if location is None or entry['location'] == location
+            ),
+            key=lambda entry: entry['timestamp']
+        )
+
+    def remove(self, entry):
+        path = self.path_for(entry)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        del self.catalog['backups'][entry['name']]
+
+        # NB: keeps the index of most recent backups up to date
+        latest = self.catalog['latest']
+        for location in list(latest.keys()):
+            if latest[location] == entry['name']:
+                remaining = self.list(
+                    None if location == self.ALL_LOCATIONS else location
+                )
+                if remaining:
+                    latest[location] = remaining[-1]['name']
+                else:
+                    del latest[location]
+
+    def enforce_retention(
+        self, count=None, max_age_days=None, max_size_mb=None
+    ):
+        """
+        Deletes backups older than `max_age_days`, then evicts the least
+        recently used backups until at most `count` backups taking up at
+        most `max_size_mb` remain. Returns the evicted entries.
+        """
+        evicted = []
+        if max_age_days is not None:
+            cutoff = time.time() - max_age_days * 24 * 60 * 60
+            evicted += [e for e in self.list() if e['timestamp'] < cutoff]
+
+        remaining = sorted(
+            (e for e in self.list() if e not in evicted),
+            key=lambda entry: entry['last_used']
+        )
+        max_size = None if max_size_mb is None else max_size_mb * 1024 * 1024
+        while remaining and (
+            (count is not None and len(remaining) > count) or
+            (max_size is not None and
+             sum(e['size'] for e in remaining) > max_size)
+        ):
+            evicted.append(remaining.pop(0))
+
+        for entry in evicted:
+            self.remove(entry)
+        if evicted:
+            self.save()
+        return evicted
@@ -0,0 +1,147 @@
+import os
+import re
+import shlex
+import shutil
+import threading
+import subprocess as _subprocess
+
+from sykle.call_subprocess import call_subprocess
+
+DEFAULT_VERSION = 10.5
+DEFAULT_NETWORK = 'default'
+
+VERSION_PATTERN = re.compile(r'(\d+)(?:\.(\d+))?')
+
+
+def major_version(version):
+    """
+    Returns the major version of a postgres version ('10.5' -> '10',
+    '9.6.3' -> '9.6'), or None if it can't be parsed
+    """
+    match = VERSION_PATTERN.search(str(version))
+    if not match:
+        return None
+    major, minor = match.groups()
+    if int(major) < 10 and minor is not None:
+        return '{}.{}'.format(major, minor)
+    return major
+
+
+class PgClients:
+    """
+    Runs postgres client commands (pg_dump, pg_restore, psql, ...) for the
+    duration of a sync.
+
+    Client binaries installed on the host are used directly when their major
+    version matches the location's `VERSION` (and the location isn't on a
+    docker network). Otherwise, every command is exec'd in one long lived
+    client container per (version, network), rather than starting a fresh
+    container for each step. `close` removes the containers.
+    """
+    def __init__(self, use_host=True, debug=False):
+        self.use_host = use_host
+        self.debug = debug
+        self.cwd = os.getcwd()
+        self.containers = {}
+        self._host_versions = {}
+        self._lock = threading.Lock()
+
+    def host_version(self, binary):
+        """Returns the major version of a host binary (None if missing)"""
+        if binary not in self._host_versions:
+            version = None
+            if shutil.which(binary):
+                p = _subprocess.run(
+                    [binary, '--version'], stdout=_subprocess.PIPE,
+                    stderr=_subprocess.DEVNULL
+                )
+                version = major_version(p.stdout.decode())
+            self._host_versions[binary] = version
+        return self._host_versions[binary]
+
+    def _in_cwd(self, path):
+        path = os.path.abspath(path)
+        return path == self.cwd or path.startswith(self.cwd + os.sep)
+
+    def container(self, version, network):
+        """Returns the client container for a version/network (starting it)"""
+        key = (str(version), network)
+        with self._lock:
+            if key not in self.containers:
+                name = 'sykle-pg-{}-{}'.format(
+                    os.getpid(), len(self.containers)
+                )
+                # NB: the working directory is mounted at the same path so
+                #     that relative (and absolute) paths under it just work
+                call_subprocess([
+                    'docker', 'run', '-d', '--rm', '--name', name,
+                    '--network={}'.format(network),
+                    '-v', '{0}:{0}'.format(self.cwd), '-w', self.cwd,
+                    'postgres:{}'.format(version), 'sleep', 'infinity'
+                ], debug=self.debug, capture=True)
+                self.containers[key] = name
+            return self.containers[key]
+
+    def _env(self, args, env=None):
+        variables = ["PGPASSWORD={}".format(args['PASSWORD'])]
+        for key, value in sorted((env or {}).items()):
+            variables.append(shlex.quote('{}={}'.format(key, value)))
+        return variables
+
+    def run_command(
+        self, args, command, mount=None, interactive=False, env=None
+    ):
+        """Wraps a command so it runs in a fresh (throwaway) container"""
+        volumes = []
+        if mount:
+            volumes = [
+                '-v', "{}:/{}".format(os.path.abspath(mount), mount)
+            ]
+        if interactive:
+            volumes = ['-i'] + volumes
+        environment = []
+        for variable in self._env(args, env):
+            environment += ['-e', variable]
+        return ['docker', 'run', '--rm'] + volumes + environment + [
+            "--network={}".format(args.get('NETWORK', DEFAULT_NETWORK)),
+            "postgres:{}".format(args.get('VERSION', DEFAULT_VERSION)),
+        ] + command
+
+    def command(
+        self, args, command, mount=None, interactive=False, env=None
+    ):
+        """
+        Wraps a client command so it runs with the location's client version
+        (`mount` is a directory the command needs to read/write,
+        `interactive` keeps stdin open for commands reading from a pipe and
+        `env` sets extra environment variables, EX: PGOPTIONS)
+        """
+        version = args.get('VERSION', DEFAULT_VERSION)
+        variables = self._env(args, env)
+
+        if self.use_host and 'NETWORK' not in args and \
+                self.host_version(command[0]) == major_version(version):
+            return ['env'] + variables + command
+
+        # NB: the client containers can only see the working directory
+        if mount and not self._in_cwd(mount):
+            return self.run_command(args, command, mount, interactive, env)
+
+        container = self.container(
+            version, args.get('NETWORK', DEFAULT_NETWORK)
+        )
+        environment = []
+        for variable in variables:
+            environment += ['-e', variable]
+        return ['docker', 'exec'] + (['-i'] if interactive else []) + \
+            environment + [container] + command
+
+    def close(self):
+        """Removes the client containers"""
+        with self._lock:
+            for name in self.containers.values():
+                call_subprocess(
+                    ['docker', 'rm', '-f', name], debug=self.debug,
+                    capture=True
+                )
+            self.containers = {}
@@ -0,0 +1,90 @@
+import shutil
+
+
+class Codec:
+    """
+    A compression format for backups and transfers. Codecs compress stdin to
+    stdout, so they can be used in pipelines (EX: `pg_dump | zstd > file`).
+
+    `remote` commands are used on hosts sykle knows nothing about, so they
+    stick to the most widely available binaries and flags.
+    """
+    name = None
+    extension = ''
+
+    def compress_command(self, threads=0, remote=False):
+        raise NotImplementedError
+
+    def decompress_command(self, remote=False):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return '<Codec {}>'.format(self.name)
+
+
+class NoCodec(Codec):
+    name = 'none'
+
+    def compress_command(self, threads=0, remote=False):
+        return ['cat']
+
+    def decompress_command(self, remote=False):
+        return ['cat']
+
+
+class GzipCodec(Codec):
+    """gzip, using pigz (parallel gzip) when it is installed"""
+    name = 'gzip'
+    extension = '.gz'
+
+    def _pigz(self, remote):
+        return not remote and shutil.which('pigz')
+
+    def compress_command(self, threads=0, remote=False):
+        if self._pigz(remote):
+            return ['pigz', '-c'] + (['-p', str(threads)] if threads else [])
+        return ['gzip', '-c']
+
+    def decompress_command(self, remote=False):
+        if self._pigz(remote):
+            return ['pigz', '-dc']
+        return ['gzip', '-dc']
+
+
+class ZstdCodec(Codec):
+    """zstd, using a thread per core (or `threads` threads)"""
+    name = 'zstd'
+    extension = '.zst'
+
+    def compress_command(self, threads=0, remote=False):
+        if remote:
+            return ['zstd', '-q', '-c']
+        return ['zstd', '-q', '-c', '-T{}'.format(threads)]
+
+    def decompress_command(self, remote=False):
+        return ['zstd', '-q', '-dc']
+
+
+CODECS = {codec.name: codec for codec in [NoCodec(), GzipCodec(), ZstdCodec()]}
+
+
+def get_codec(name='auto'):
+    """
+    Returns the codec for a configured value ('auto' picks zstd if it is
+    installed and falls back to gzip, 'none'/None disables compression)
+    """
+    if name is None:
+        return CODECS['none']
+    if name == 'auto':
+        return CODECS['zstd'] if shutil.which('zstd') else CODECS['gzip']
+    if name not in CODECS:
+        raise Exception('Unknown compression "{}"'.format(name))
+    return CODECS[name]
+
+
+def codec_for_path(path):
+    """Guesses the codec of a backup from its extension"""
+    for codec in CODECS.values():
+        if codec.extension and path.endswith(codec.extension):
+            return codec
+    return CODECS['none']
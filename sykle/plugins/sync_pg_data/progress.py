@@ -0,0 +1,157 @@
+import re
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from sykle.logger import FancyLogger
+
+
+logger = logging.getLogger(__name__)
+
+# NB: pg_dump -v and pg_restore --verbose announce each table's data as they
+#     get to it. parallel jobs also announce when an item is finished
+TABLE_START_PATTERN = re.compile(
+    r'(?:dumping contents of table|processing data for table) "?([^"]+)"?$'
+)
+TABLE_FINISH_PATTERN = re.compile(r'finished item \d+ TABLE DATA (\S+)')
+
+
+def format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return '{:02d}:{:02d}'.format(minutes, seconds)
+
+
+class TableProgress:
+    """
+    Follows the verbose output of pg_dump/pg_restore to track which table is
+    being processed, how long each table takes and how big each table is.
+
+    Parameters:
+        size (function): returns the number of bytes processed so far (EX:
+                         the size of the file being dumped to). Table sizes
+                         are measured with it when tables are processed one
+                         at a time
+        known_sizes (dict): table -> size, for when bytes can't be measured
+                            (EX: restores, using the report of the dump)
+        parallel (bool): whether several tables are processed at once
+    """
+    def __init__(self, size=None, known_sizes=None, parallel=False,
+                 clock=time.time):
+        self.size = size
+        self.known_sizes = known_sizes or {}
+        self.parallel = parallel
+        self.clock = clock
+        self.started = clock()
+        self.current = {}
+        self.tables = {}
+        self._lock = threading.Lock()
+
+    def _measure(self):
+        return self.size() if self.size else None
+
+    def _finish(self, table):
+        started, start_size = self.current.pop(table)
+        size = self.known_sizes.get(table)
+        end_size = self._measure()
+        if not self.parallel and start_size is not None and \
+                end_size is not None:
+            size = end_size - start_size
+        self.tables[table] = {
+            'duration': round(self.clock() - started, 3),
+            'size': size,
+        }
+
+    def feed(self, line):
+        """Updates the progress from a line of verbose output"""
+        with self._lock:
+            match = TABLE_START_PATTERN.search(line)
+            if match:
+                if not self.parallel:
+                    for table in list(self.current):
+                        self._finish(table)
+                self.current[match.group(1)] = (self.clock(), self._measure())
+                return
+
+            match = TABLE_FINISH_PATTERN.search(line)
+            if match:
+                name = match.group(1)
+                for table in list(self.current):
+                    if table == name or table.endswith('.' + name):
+                        self._finish(table)
+
+    def finish(self):
+        with self._lock:
+            for table in list(self.current):
+                self._finish(table)
+
+    @property
+    def elapsed(self):
+        return self.clock() - self.started
+
+    @property
+    def processed(self):
+        size = self._measure()
+        if size is None:
+            size = sum(t['size'] or 0 for t in self.tables.values())
+        return size
+
+    def status(self):
+        """Returns a one line summary (EX: for a spinner)"""
+        elapsed = self.elapsed
+        processed = self.processed
+        rate = processed / elapsed if elapsed > 0 else 0
+        return '{} | {} | {}/s | {}'.format(
+            ', '.join(sorted(self.current)) or '...',
+            format_size(processed),
+            format_size(rate),
+            format_duration(elapsed)
+        )
+
+    def report(self):
+        """Returns a table of each table's duration and size, slowest first"""
+        lines = ['{:<48} {:>10} {:>12}'.format('Table', 'Time', 'Size')]
+        for table, stats in sorted(
+            self.tables.items(), key=lambda item: -item[1]['duration']
+        ):
+            lines.append('{:<48} {:>9.1f}s {:>12}'.format(
+                table, stats['duration'],
+                '-' if stats['size'] is None else format_size(stats['size'])
+            ))
+        lines.append('Total: {} in {}'.format(
+            format_size(self.processed), format_duration(self.elapsed)
+        ))
+        return '\n'.join(lines)
+
+
+@contextmanager
+def showing_progress(progress, interval=0.5, enabled=True):
+    """
+    Shows the progress next to a spinner until the wrapped block is done
+    (does nothing unless sykle's fancy logger is in use)
+    """
+    if not enabled or not isinstance(logger, FancyLogger):
+        yield
+        return
+
+    done = threading.Event()
+
+    def update():
+        while not done.wait(interval):
+            logger.info(progress.status())
+
+    with logger.halo():
+        thread = threading.Thread(target=update, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
@@ -0,0 +1,112 @@
+"""
+Helpers for dumping a referentially intact subset of a database.
+
+A subset starts from "root" tables, each limited by a `WHERE` predicate or
+a sample percentage. Rows of other tables are only kept when rows already in
+the subset reference them through foreign keys, so every foreign key in the
+subset can be satisfied. Tables that are neither roots nor referenced end up
+empty.
+"""
+
+# NB: one line per foreign key: child|parent|child columns|parent columns
+FOREIGN_KEYS_QUERY = """
+SELECT c.conrelid::regclass, c.confrelid::regclass,
+  (SELECT string_agg(quote_ident(a.attname), ',' ORDER BY k.n)
+   FROM unnest(c.conkey) WITH ORDINALITY k(attnum, n)
+   JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum),
+  (SELECT string_agg(quote_ident(a.attname), ',' ORDER BY k.n)
+   FROM unnest(c.confkey) WITH ORDINALITY k(attnum, n)
+   JOIN pg_attribute a ON a.attrelid = c.confrelid AND a.attnum = k.attnum)
+FROM pg_constraint c
+WHERE c.contype = 'f'
+"""
+
+SEQUENCES_QUERY = """
+SELECT format('SELECT setval(%L, %s);',
+  quote_ident(schemaname) || '.' || quote_ident(sequencename), last_value)
+FROM pg_sequences
+WHERE last_value IS NOT NULL
+"""
+
+DEFAULT_MAX_DEPTH = 10
+
+
+def parse_foreign_keys(output):
+    """Parses the output of `FOREIGN_KEYS_QUERY` (run with psql -At -F'|')"""
+    foreign_keys = []
+    for line in output.splitlines():
+        fields = line.split('|')
+        if len(fields) == 4:
+            foreign_keys.append(tuple(fields))
+    return foreign_keys
+
+
+def root_condition(value):
+    """
+    Returns the condition for a root table. Strings are used as `WHERE`
+    predicates and numbers as the percentage of rows to sample.
+    """
+    if isinstance(value, str):
+        return value
+    if value is True:
+        return 'TRUE'
+    # NB: sampling has to pick the same rows every time it is evaluated,
+    #     so rows are picked by hashing their ctid rather than randomly
+    return '(hashtext(ctid::text) & 2147483647) % 10000 < {}'.format(
+        int(float(value) * 100)
+    )
+
+
+def subset_conditions(roots, foreign_keys, max_depth=DEFAULT_MAX_DEPTH):
+    """
+    Returns a `WHERE` condition for every table in the subset.
+
+    Parameters:
+        roots (dict): root table -> predicate (str) or sample percentage
+        foreign_keys (array[tuple]): (child, parent, child columns, parent
+                                     columns) for each foreign key
+        max_depth (int): how many foreign keys to follow away from the roots
+                         (only matters for cycles, which never settle)
+    """
+    base = {table: root_condition(value) for table, value in roots.items()}
+    conditions = dict(base)
+    for _ in range(max_depth):
+        parts = {table: [condition] for table, condition in base.items()}
+        for child, parent, child_columns, parent_columns in foreign_keys:
+            if child in conditions:
+                parts.setdefault(parent, []).append(
+                    '({}) IN (SELECT {} FROM {} WHERE {})'.format(
+                        parent_columns, child_columns, child,
+                        conditions[child]
+                    )
+                )
+        updated = {
+            table: ' OR '.join('({})'.format(p) for p in table_parts)
+            if len(table_parts) > 1 else table_parts[0]
+            for table, table_parts in parts.items()
+        }
+        if updated == conditions:
+            break
+        conditions = updated
+    return conditions
+
+
+def data_script(conditions, exclude=()):
+    """
+    Returns a psql script that writes the subset as a SQL file (made of
+    `COPY ... FROM stdin` blocks followed by sequence values) to its query
+    output. Data of the tables in `exclude` is left out.
+    """
+    lines = ['BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;']
+    for table, condition in sorted(conditions.items()):
+        if table in exclude:
+            continue
+        lines += [
+            "\\qecho 'COPY {} FROM stdin;'".format(table),
+            'COPY (SELECT * FROM {} WHERE {}) TO STDOUT;'.format(
+                table, condition
+            ),
+            "\\qecho '\\\\.'",
+        ]
+    lines += [SEQUENCES_QUERY.strip() + ';', 'COMMIT;']
+    return '\n'.join(lines) + '\n'
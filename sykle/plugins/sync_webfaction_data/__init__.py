@@ -21,6 +21,14 @@ Example .sykle.json:
   {
      "plugins": {
         "sync_webfaction_data": {
+            "remote_compression": "gzip",    // Compression for remote dumps:
+                                             // "gzip", "zstd" or "none"
+                                             // (OPTIONAL)
+            "assets": {                      // Asset syncing (OPTIONAL)
+                "jobs": 4,                   // Parallel transfers
+                "snapshots": 0               // Snapshots of synced assets
+                                             // to keep in backups/assets
+            },
             "locations": {
                 "local": {                   // Name of location
                     "env_file": ".env",      // Envfile for args (OPTIONAL)
@@ -53,31 +61,39 @@ Example .sykle.json:
 """
 
 import os
-import datetime
+import time
+import shlex
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 from docopt import docopt
 
-from sykle.call_subprocess import subprocess
+from sykle.call_subprocess import (
+    subprocess, call_subprocess, pipefail, NonZeroReturnCodeException
+)
 from sykle.config import Config
 from sykle.plugins.sync_pg_data import Plugin as SyncPGDataPlugin
+from sykle.plugins.sync_pg_data.backup_store import path_size
+from sykle.plugins.sync_pg_data.codec import get_codec
+from sykle.plugins.sync_pg_data.progress import TableProgress, format_size
 
-
-def glob(base_path):
-    return os.path.join(base_path, "*")
+from .assets import (
+    REMOTE_MANIFEST_COMMAND, MANIFEST_FILE, changed_files, link_files,
+    load_manifest, parse_manifest, save_manifest, scan_manifest, shard_files
+)
 
 
 def enquote(string):
     return "'%s'" % string
 
 
-def timestamp():
-    epoch = datetime.datetime.utcfromtimestamp(0)
-    return int(
-        (datetime.datetime.now() - epoch).total_seconds() * 1000.0
-    )
-
-
 class Location:
+    # NB: None lets sync_pg_data pick the format from the location's config
+    format = None
+
     def __init__(self, name, env_file=None, write=False, args={}, plugin=None):
         self.name = name
         self.env_args = Config.interpolate_env_values_from_file(
@@ -90,7 +106,7 @@ class Location:
     def dump_file(self):
         if not hasattr(self, "_dump_file"):
             self._dump_file = self.plugin.get_dump_file_name(
-                self.name
+                self.name, format=self.format
             )
         return self._dump_file
 
@@ -107,6 +123,9 @@ class Location:
     def copy_assets_from(self, src):
         raise NotImplementedError
 
+    def close(self):
+        pass
+
 
 class LocalLocation(Location):
     def restore(self, dump_file):
@@ -115,6 +134,8 @@ class LocalLocation(Location):
 
 class WebfactionLocation(Location):
     name = "webfaction"
+    # NB: the host always sends a single (compressed) tar archive
+    format = "tar"
 
     def __init__(
         self,
@@ -128,6 +149,15 @@ class WebfactionLocation(Location):
         self.host = webfaction_host
         self.user = webfaction_user
         self.password = self.env_args["WEBFACTION_PASSWORD"]
+        self.codec = get_codec(
+            self.plugin.config.get("remote_compression", "gzip")
+        )
+        self._connected = False
+        self._connect_lock = threading.Lock()
+
+    @property
+    def dump_file(self):
+        return super().dump_file + self.codec.extension
 
     def sshpass_cmd(self, cmd):
         return [
@@ -136,75 +166,130 @@ class WebfactionLocation(Location):
             self.password
         ] + cmd
 
+    @property
+    def control_path(self):
+        # NB: socket paths are limited to ~104 characters, which temp dirs
+        #     (EX: on macOS) can use up, so ssh's %C (a hash of the
+        #     connection) goes in a short, fixed directory
+        return "/tmp/sykle-%d-%%C" % os.getpid()
+
+    @property
+    def ssh_options(self):
+        return [
+            "-o", "IdentitiesOnly=yes",
+            "-o", "ControlPath=%s" % self.control_path
+        ]
+
+    def connect(self):
+        """
+        Logs in once (with sshpass), leaving a ControlMaster connection in
+        the background that later ssh/scp/rsync calls share
+        """
+        with self._connect_lock:
+            if self._connected:
+                return
+            call_subprocess(self.sshpass_cmd([
+                "ssh"
+            ] + self.ssh_options + [
+                "-o", "ControlMaster=yes",
+                "-o", "ControlPersist=yes",
+                "-N", "-f",
+                self.ssh_url
+            ]))
+            self._connected = True
+
+    def close(self):
+        """
+        Closes the shared connection (if it was opened). This is best
+        effort: the connection may already be gone
+        """
+        with self._connect_lock:
+            if not self._connected:
+                return
+            self._connected = False
+            try:
+                call_subprocess(
+                    ["ssh"] + self.ssh_options + ["-O", "exit", self.ssh_url],
+                    capture=True
+                )
+            except NonZeroReturnCodeException:
+                print("Could not close the ssh connection to %s" % self.name)
+
+    def remote_cmd(self, cmd):
+        """Makes sure a command reaching the host has a connection to use"""
+        self.connect()
+        return cmd
+
     @subprocess
     def ssh(self, cmd):
-        return self.sshpass_cmd([
-            "ssh",
-            self.ssh_url,
-            "-o", "IdentitiesOnly=yes"
+        return self.remote_cmd([
+            "ssh"
+        ] + self.ssh_options + [
+            self.ssh_url
         ] + cmd)
 
     @subprocess
     def scp(self, src, dest):
-        return self.sshpass_cmd([
-            "scp",
-            "-o", "IdentitiesOnly=yes",
+        return self.remote_cmd([
+            "scp"
+        ] + self.ssh_options + [
             "%s:%s" % (self.ssh_url, src),
             dest
         ])
 
-    @subprocess
-    def rsync(self, src, dest):
-        return self.sshpass_cmd([
-            "rsync",
-            "-chavzP",
-            "-e 'ssh -o IdentitiesOnly=yes'",
-            "%s:%s" % (self.ssh_url, src),
-            "--include='*/'",
-            "--include='*'",
-            dest
-        ])
-
     @property
     def ssh_url(self):
         return "%s@%s" % (self.user, self.host)
 
-    def fetch_remote_pg_dump(self):
-        self.scp(
-            src=self.remote_tmp_dump_location,
-            dest=self.dump_file
-        )
-
-    def cleanup_remote_pg_dump(self):
-        self.ssh([
-            "rm",
-            "-f",
-            self.remote_tmp_dump_location
-        ])
-
-    def create_remote_pg_dump(self, data_only=False):
-        self.ssh([
+    def stream_remote_pg_dump(self, data_only=False):
+        """
+        Streams a (compressed) pg_dump from the host straight into the
+        dump file over a single ssh session, showing progress as it goes
+        """
+        pg_dump = [
             "/usr/local/pgsql/bin/pg_dump",
             "--format", "tar",
+            "--verbose",
             "--data-only" if data_only else "",
-            "-f", self.remote_tmp_dump_location,
             self.env_args["DATABASE_URL"]
-        ])
+        ]
+        compress = self.codec.compress_command(remote=True)
+        # NB: without pipefail, ssh would return the compressor's status
+        #     and a failed pg_dump would leave a valid (empty) archive
+        remote_command = pipefail(pg_dump + ["|"] + compress)
+        command = self.remote_cmd([
+            "ssh"
+        ] + self.ssh_options + [
+            self.ssh_url,
+            shlex.quote(" ".join(remote_command))
+        ]) + [">", self.dump_file]
 
-    @property
-    def remote_tmp_dump_location(self):
-        if not hasattr(self, "_remote_tmp_dump_location"):
-            self._remote_tmp_dump_location = "/tmp/dump-%s.sql" % (
-                timestamp()
-            )
-        return self._remote_tmp_dump_location
+        progress = TableProgress(
+            size=lambda: path_size(self.dump_file)
+            if os.path.exists(self.dump_file) else 0
+        )
+        self.plugin._call_with_progress([command], progress)
+        return progress
 
     def dump(self):
         self.plugin.ensure_dump_dir()
-        self.create_remote_pg_dump()
-        self.fetch_remote_pg_dump()
-        self.cleanup_remote_pg_dump()
-
+        start = time.time()
+        try:
+            progress = self.stream_remote_pg_dump()
+        except Exception:
+            if os.path.exists(self.dump_file):
+                os.remove(self.dump_file)
+            raise
+
+        # NB: the catalog records the codec so restores can decompress it
+        self.plugin.store.add(
+            self.dump_file, location=self.name, format=self.format,
+            duration=time.time() - start, compression=self.codec.name,
+            table_report=progress.tables
+        )
+        self.plugin.store.enforce_retention(
+            **self.plugin.config.get("retention", {})
+        )
         return self.dump_file
 
     def restore(self, src_dump, dest_remote):
@@ -219,13 +304,114 @@ class WebfactionLocation(Location):
             src_dump,
         ]
 
+    def fetch_remote_manifest(self):
+        """Lists the host's media files (with sizes and mtimes) in one call"""
+        output = call_subprocess(self.remote_cmd([
+            "ssh"
+        ] + self.ssh_options + [
+            self.ssh_url,
+            shlex.quote("cd %s && %s" % (
+                shlex.quote(self.media_root), REMOTE_MANIFEST_COMMAND
+            ))
+        ]), capture=True)
+        return parse_manifest(output)
+
+    def fetch_assets(self, paths, target):
+        """Fetches the given media files (relative paths) into `target`"""
+        with tempfile.NamedTemporaryFile("w", suffix=".files") as files:
+            files.write("\n".join(paths) + "\n")
+            files.flush()
+            call_subprocess(self.remote_cmd([
+                "rsync",
+                "-az",
+                "--files-from=%s" % files.name,
+                "-e '%s'" % " ".join(["ssh"] + self.ssh_options),
+                "%s:%s/" % (self.ssh_url, enquote(self.media_root)),
+                os.path.join(target, "")
+            ]))
+
+    def fetch_assets_in_parallel(self, paths, manifest, target, jobs):
+        """Fetches files with up to `jobs` rsyncs, split by directory"""
+        shards = shard_files(paths, manifest, jobs)
+        if not shards:
+            return
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            list(executor.map(
+                lambda shard: self.fetch_assets(shard, target), shards
+            ))
+
     def copy_assets_to(self, dest):
-        return self.rsync(
-            src=enquote(
-                glob(self.media_root)
-            ),
-            dest=dest.media_root
-        )
+        """
+        Copies the media files that changed since the last sync to `dest`.
+        If `snapshots` are kept, each sync is also saved as a snapshot, with
+        unchanged files hard linked from the previous one.
+        """
+        settings = self.plugin.config.get("assets", {})
+        jobs = int(settings.get("jobs", 4))
+        snapshots = int(settings.get("snapshots", 0))
+        assets_dir = os.path.join(self.plugin.dump_dir, "assets")
+
+        remote = self.fetch_remote_manifest()
+        if snapshots:
+            changed = self._copy_assets_to_snapshot(
+                dest, remote, jobs, snapshots,
+                os.path.join(assets_dir, self.name)
+            )
+        else:
+            # NB: the manifest of what was synced last time stands in for
+            #     scanning the whole destination (delete it to rescan)
+            manifest_file = os.path.join(
+                assets_dir, "%s_%s.json" % (self.name, dest.name)
+            )
+            local = load_manifest(manifest_file)
+            if local is None:
+                local = scan_manifest(dest.media_root)
+            changed = changed_files(remote, local)
+            self.fetch_assets_in_parallel(
+                changed, remote, dest.media_root, jobs
+            )
+            local.update((path, remote[path]) for path in changed)
+            save_manifest(manifest_file, local)
+
+        print("Copied %d changed files (%s), %d unchanged." % (
+            len(changed),
+            format_size(sum(remote[path][0] for path in changed)),
+            len(remote) - len(changed)
+        ))
+
+    def _copy_assets_to_snapshot(self, dest, remote, jobs, keep, root):
+        previous = None
+        if os.path.isdir(root):
+            names = sorted(os.listdir(root))
+            previous = os.path.join(root, names[-1]) if names else None
+        name = datetime.now().strftime("%Y%m%dT%H%M%S")
+        snapshot = os.path.join(root, name)
+        # NB: names only go down to the second, so a second sync within
+        #     the same second gets a suffix (which still sorts last)
+        count = 0
+        while os.path.exists(snapshot):
+            count += 1
+            snapshot = os.path.join(root, "%s-%d" % (name, count))
+
+        local = {}
+        if previous:
+            local = load_manifest(os.path.join(previous, MANIFEST_FILE)) or {}
+        changed = changed_files(remote, local)
+        unchanged = sorted(set(remote) - set(changed))
+
+        os.makedirs(snapshot, exist_ok=True)
+        link_files(previous, snapshot, unchanged)
+        self.fetch_assets_in_parallel(changed, remote, snapshot, jobs)
+        save_manifest(os.path.join(snapshot, MANIFEST_FILE), remote)
+
+        # NB: the destination may not have the unchanged files (EX: it was
+        #     cleaned), so all of them get linked (files that are already
+        #     linked are skipped)
+        link_files(snapshot, dest.media_root, sorted(remote))
+
+        for name in sorted(os.listdir(root))[:-keep]:
+            shutil.rmtree(os.path.join(root, name))
+        return changed
 
 
 class LocationFactory:
@@ -245,23 +431,35 @@ class Plugin(SyncPGDataPlugin):
     NAME = "sync_webfaction_data"
     REQUIRED_VERSION = "0.3.0"
 
+    def open_location(self, name):
+        """Returns a location, keeping track of it so it gets closed"""
+        location = LocationFactory(name, self)
+        self.locations.append(location)
+        return location
+
     def run(self):
         args = docopt(__doc__)
         location = args.get("<location>", None)
         assets = args.get("--assets")
-
-        if args.get("dump", None) and location:
-            LocationFactory(location, self).dump()
-        else:
-            src = args.get("--src", None)
-            dest = args.get("--dest", None)
-
-            if src and dest:
-                src = LocationFactory(src, self)
-                dest = LocationFactory(dest, self)
-
-                dump = src.dump()
-                dest.restore(dump)
-
-                if assets:
-                    src.copy_assets_to(dest)
+        self.locations = []
+
+        try:
+            if args.get("dump", None) and location:
+                self.open_location(location).dump()
+            else:
+                src = args.get("--src", None)
+                dest = args.get("--dest", None)
+
+                if src and dest:
+                    src = self.open_location(src)
+                    dest = self.open_location(dest)
+
+                    dump = src.dump()
+                    dest.restore(dump)
+
+                    if assets:
+                        src.copy_assets_to(dest)
+        finally:
+            for location in self.locations:
+                location.close()
+            self.clients.close()
@@ -0,0 +1,112 @@
+"""
+Helpers for syncing media assets using manifests of (path, size, mtime).
+
+Rather than having rsync checksum the whole media library, the files on
+each side are listed with their size and modification time, and only files
+whose entry differs get transferred.
+"""
+
+import os
+import json
+import shutil
+
+# NB: lists every file under the current directory as path, size and mtime
+#     (run in the remote media root, in a single ssh call)
+REMOTE_MANIFEST_COMMAND = "find . -type f -printf '%P\\t%s\\t%T@\\n'"
+
+MANIFEST_FILE = '.manifest.json'
+
+
+def parse_manifest(output):
+    """Parses the output of `REMOTE_MANIFEST_COMMAND`"""
+    manifest = {}
+    for line in output.splitlines():
+        fields = line.rsplit('\t', 2)
+        if len(fields) == 3:
+            path, size, mtime = fields
+            manifest[path] = [int(size), int(float(mtime))]
+    return manifest
+
+
+def scan_manifest(root):
+    """Returns the manifest of the files under a local directory"""
+    manifest = {}
+    for directory, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(directory, name)
+            relative_path = os.path.relpath(path, root)
+            if relative_path == MANIFEST_FILE:
+                continue
+            stat = os.stat(path)
+            manifest[relative_path] = [stat.st_size, int(stat.st_mtime)]
+    return manifest
+
+
+def load_manifest(path):
+    """Returns a cached manifest (None if there isn't one)"""
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, sort_keys=True)
+    os.replace(tmp_file, path)
+
+
+def changed_files(remote, local):
+    """Returns the paths whose size/mtime differ (or are missing) locally"""
+    return sorted(
+        path for path, entry in remote.items() if local.get(path) != entry
+    )
+
+
+def shard_files(paths, manifest, shards):
+    """
+    Splits paths into (at most) `shards` groups of roughly equal size.
+    Files are grouped by top level directory, so each transfer stays within
+    a few directories.
+    """
+    directories = {}
+    for path in paths:
+        top = path.split('/', 1)[0] if '/' in path else ''
+        directories.setdefault(top, []).append(path)
+
+    groups = [[] for _ in range(max(1, min(shards, len(directories))))]
+    sizes = [0] * len(groups)
+
+    def size(paths):
+        return sum(manifest[p][0] for p in paths)
+
+    # NB: biggest directories first, each into the smallest group so far
+    for top in sorted(directories, key=lambda d: -size(directories[d])):
+        smallest = sizes.index(min(sizes))
+        groups[smallest] += directories[top]
+        sizes[smallest] += size(directories[top])
+    return [group for group in groups if group]
+
+
+def link_files(src_root, dest_root, paths):
+    """
+    Hard links files from one directory into another (copying them when
+    the directories are on different filesystems). Files that are already
+    linked are left alone.
+    """
+    for path in paths:
+        src = os.path.join(src_root, path)
+        dest = os.path.join(dest_root, path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if os.path.lexists(dest):
+            if os.path.exists(dest) and os.path.samefile(src, dest):
+                continue
+            os.remove(dest)
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copy2(src, dest)
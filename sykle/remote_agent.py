@@ -0,0 +1,67 @@
+"""
+A self-contained agent that runs a batch of deployment operations on a
+deployment target.
+
+Sykle sends the source of this module, followed by a call to `main` with
+the batch, over the stdin of a single ssh session (see
+`call_remote_agent`). Because of that it must only depend on the standard
+library and should stay compatible with older python 3 versions.
+
+Each operation in a batch is a dict with:
+    name (str): label used when reporting the result
+    argv (array[str]): the command to run
+    env (dict): extra environment variables for the command (OPTIONAL)
+    input (str): data to write to the command's stdin (OPTIONAL)
+
+A JSON result is written to stdout as soon as each operation finishes.
+Once an operation fails, the remaining operations are skipped.
+"""
+import os
+import sys
+import json
+import time
+import subprocess
+
+TAIL_LINES = 20
+
+
+def run_op(op, tail_lines=TAIL_LINES):
+    """Runs a single operation and returns its result"""
+    env = os.environ.copy()
+    env.update(op.get('env', {}))
+    input = op.get('input')
+
+    start = time.time()
+    try:
+        p = subprocess.Popen(
+            op['argv'], env=env,
+            stdin=subprocess.DEVNULL if input is None else subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        output, _ = p.communicate(None if input is None else input.encode())
+        returncode = p.returncode
+        output = output.decode(errors='replace')
+    except OSError as e:
+        returncode = 127
+        output = str(e)
+
+    return {
+        'name': op.get('name', ' '.join(op['argv'])),
+        'returncode': returncode,
+        'duration': round(time.time() - start, 3),
+        'tail': output.splitlines()[-tail_lines:],
+    }
+
+
+def main(ops, stream=sys.stdout):
+    """Runs a batch of operations, streaming one JSON result per line"""
+    failed = False
+    for op in ops:
+        if failed:
+            result = {'name': op.get('name'), 'skipped': True}
+        else:
+            result = run_op(op)
+            failed = result['returncode'] != 0
+        stream.write(json.dumps(result) + '\n')
+        stream.flush()
+    return 1 if failed else 0
@@ -1,13 +1,24 @@
+import os
+import json
+import time
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+
 from . import __version__
+from .config import Config
 from .call_subprocess import (
     call_subprocess, NonZeroReturnCodeException,
     SubprocessExceptionHandler
 )
-from .call_docker_compose import call_docker_compose
-
-
-class CommandException(Exception):
-    pass
+from .call_docker_compose import call_docker_compose, docker_compose_command
+from .call_remote_agent import call_remote_agent
+from .events import EventBus
+from .exceptions import CommandException
+from .health import wait_until_healthy
+from .deploy_state import (
+    DeployState, STATE_FILE, file_hash, image_repository,
+    images_from_compose_config
+)
 
 
 class Sykle():
@@ -18,6 +29,7 @@ class Sykle():
     def __init__(self, config, debug=False):
         self.config = config
         self.debug = debug
+        self.events = EventBus()
 
     def _run_commands(self, commands, exec=False, input=[], **kwargs):
         modified_kwargs = {**kwargs}
@@ -33,24 +45,14 @@ class Sykle():
         for command in commands:
             command.input += input
             try:
-                if command.service:
-                    # FIXME: change "exec" to "use_exec" so we don't override exec keyword
-                    if exec or command.use_exec:
-                        self.dc_exec(
-                            input=command.input,
-                            service=command.service,
-                            docker_type=docker_type or command.docker_type,
-                            **modified_kwargs
-                        )
-                    else:
-                        self.dc_run(
-                            input=command.input,
-                            service=command.service,
-                            docker_type=docker_type or command.docker_type,
-                            **modified_kwargs
-                        )
-                else:
-                    self.call_subprocess(command.input, env=env)
+                with self.events.span(
+                    'command', argv=command.input, service=command.service,
+                    docker_type=docker_type or command.docker_type,
+                    deployment=deployment
+                ):
+                    self._run_command(
+                        command, exec, docker_type, env, modified_kwargs
+                    )
             except NonZeroReturnCodeException as e:
                 exception_handler.push(e)
 
@@ -59,6 +61,26 @@ class Sykle():
         else:
             exception_handler.exit_without_stacktraces()
 
+    def _run_command(self, command, exec, docker_type, env, kwargs):
+        if command.service:
+            # FIXME: change "exec" to "use_exec" so we don't override exec keyword
+            if exec or command.use_exec:
+                self.dc_exec(
+                    input=command.input,
+                    service=command.service,
+                    docker_type=docker_type or command.docker_type,
+                    **kwargs
+                )
+            else:
+                self.dc_run(
+                    input=command.input,
+                    service=command.service,
+                    docker_type=docker_type or command.docker_type,
+                    **kwargs
+                )
+        else:
+            self.call_subprocess(command.input, env=env)
+
     def _run_tests(self, commands, input=[], service=None, fast=False):
         commands = commands.for_service(service) if service else commands
         self._run_commands(
@@ -69,16 +91,25 @@ class Sykle():
         return call_docker_compose(*args, **kwargs)
 
     def call_subprocess(self, *args, **kwargs):
-        call_subprocess(*args, **kwargs, debug=self.debug)
+        return call_subprocess(*args, **kwargs, debug=self.debug)
+
+    def call_remote_agent(self, *args, **kwargs):
+        return call_remote_agent(*args, **kwargs, debug=self.debug)
 
-    def dc(self, input, docker_type='dev', deployment=None, local_test=False):
+    def dc(
+        self, input, docker_type='dev', deployment=None, local_test=False,
+        capture=False
+    ):
         """
         Runs a command with the correct docker compose file(s)
 
         - local_test: if this is true, will ignore any deployment targets
+        - capture: if this is true, returns the output instead of printing it
         """
 
         extras = {'type': docker_type}
+        if capture:
+            extras['capture'] = True
 
         if deployment:
             print(
@@ -98,11 +129,14 @@ class Sykle():
                 extras['env_file'] = deploy_config.env_file
 
         project_name = self.config.get_project_name(docker_type=docker_type)
-        self.call_docker_compose(
-            input,
-            project_name=project_name,
-            debug=self.debug, **extras
-        )
+        with self.events.span(
+            'dc', argv=input, docker_type=extras['type'], deployment=deployment
+        ):
+            return self.call_docker_compose(
+                input,
+                project_name=project_name,
+                debug=self.debug, **extras
+            )
 
     def dc_run(self, input, service, **kwargs):
         """
@@ -131,15 +165,52 @@ class Sykle():
             kwargs.pop('deployment', None)
             self.dc(input=['build'] + input, docker_type=docker_type, **kwargs)
 
-    def up(self, input=[], **kwargs):
-        """Starts up relevant docker compose services"""
+    def up(self, input=[], wait=False, timeout=300, **kwargs):
+        """
+        Starts up relevant docker compose services
+
+        - wait: if this is true, starts the services in the background and
+                blocks until they are healthy
+        - timeout: number of seconds to wait for services to become healthy
+        """
         if kwargs.get('deployment'):
             kwargs['docker_type'] = 'prod'
+        if wait and '-d' not in input:
+            input = input + ['-d']
         self.preup(**kwargs)
+
+        started = time.time()
         self.dc(
             input=['up', '--build', '--force-recreate'] + input,
             **kwargs
         )
+        if wait:
+            self.wait_healthy(timeout=timeout, started=started, **kwargs)
+
+    def wait_healthy(
+        self, docker_type='dev', deployment=None, local_test=False,
+        timeout=300, started=None
+    ):
+        """Blocks until relevant docker compose services are healthy"""
+        target = None
+        if deployment:
+            # NB: the project is named the same way `up` names it
+            docker_type = 'prod'
+            if not local_test:
+                target = self.config.for_deployment(deployment).target
+
+        print('Waiting for services to become healthy...')
+        times = wait_until_healthy(
+            '{}-{}'.format(
+                self.config.get_project_name(docker_type=docker_type),
+                docker_type
+            ),
+            target=target, timeout=timeout, started=started,
+            debug=self.debug
+        )
+        for service, seconds in sorted(times.items()):
+            print('{}: healthy after {:.1f}s'.format(service, seconds))
+        return times
 
     def down(self, input=[], **kwargs):
         """Spins down relevant docker compose services"""
@@ -173,64 +244,381 @@ class Sykle():
         if not fast:
             self.down(docker_type='test')
 
-    def push(self, deployment):
-        """Pushes docker images"""
-        self.dc(
-            input=['push'],
-            docker_type='prod-build',
-            deployment=deployment
+    def services(self, deployment, docker_type='prod-build', **kwargs):
+        """Lists the docker compose services used by a deployment"""
+        output = self.dc(
+            input=['config', '--services'],
+            docker_type=docker_type,
+            deployment=deployment,
+            capture=True,
+            **kwargs
         )
+        return output.split()
+
+    def push(self, deployment, services=None, on_pushed=None):
+        """
+        Pushes docker images
+
+        - services: if given, pushes the services one at a time
+        - on_pushed: called with the name of each service once it is pushed
+        """
+        if not services:
+            self.dc(
+                input=['push'],
+                docker_type='prod-build',
+                deployment=deployment
+            )
+            return
 
-    def pull(self, deployment=None):
+        for service in services:
+            self.dc(
+                input=['push', service],
+                docker_type='prod-build',
+                deployment=deployment
+            )
+            if on_pushed:
+                on_pushed(service)
+
+    def pull(self, deployment=None, services=[]):
         """Pulls docker images for a deployment (labels as prod images)"""
         self.dc(
-            input=['pull'],
+            input=['pull'] + services,
             docker_type='prod',
             deployment=deployment
         )
 
+    def push_pull(self, deployment):
+        """
+        Pushes docker images and pulls them on the deployment, starting the
+        pull of each service as soon as its push has finished
+        """
+        pushed_services = self.services(deployment)
+        prod_services = self.services(
+            deployment, docker_type='prod', local_test=True
+        )
+
+        with ThreadPoolExecutor(max_workers=len(prod_services) or 1) as pool:
+            # NB: services that are not built by us (databases, caches, etc)
+            #     can be pulled straight away
+            pulls = [
+                pool.submit(self.pull, deployment=deployment, services=[s])
+                for s in prod_services if s not in pushed_services
+            ]
+
+            def on_pushed(service):
+                if service in prod_services:
+                    pulls.append(pool.submit(
+                        self.pull, deployment=deployment, services=[service]
+                    ))
+
+            self.push(
+                deployment, services=pushed_services, on_pushed=on_pushed
+            )
+            for pull in pulls:
+                pull.result()
+
     def ssh_cp(self, input, deployment, dest='~'):
         """Copies a file to the deployment"""
         deploy_config = self.config.for_deployment(deployment)
         command = ['scp', '-o', 'StrictHostKeyChecking=no']
         command += input
         command += [deploy_config.target + ":{}".format(dest)]
-        self.call_subprocess(command)
+        with self.events.span('ssh_cp', argv=command, deployment=deployment):
+            self.call_subprocess(command)
 
-    def ssh_exec(self, input, deployment):
+    def ssh_exec(self, input, deployment, capture=False):
         deploy_config = self.config.for_deployment(deployment)
-        self.call_subprocess(input, target=deploy_config.target)
+        kwargs = {'capture': True} if capture else {}
+        with self.events.span('ssh_exec', argv=input, deployment=deployment):
+            return self.call_subprocess(
+                input, target=deploy_config.target, **kwargs
+            )
+
+    def ssh_script(self, script, deployment, capture=False):
+        """Runs a shell script on the deployment"""
+        # NB: the script is quoted once for the local shell, which leaves
+        #     ssh passing it verbatim to the remote shell
+        return self.ssh_exec(
+            [shlex.quote(script)], deployment=deployment, capture=capture
+        )
+
+    def remote_dc_op(self, name, input, deployment):
+        """
+        Returns a remote agent operation that runs a docker compose command
+        on the deployment
+        """
+        deploy_config = self.config.for_deployment(deployment)
+        return {
+            'name': name,
+            'argv': docker_compose_command(
+                input, type='prod',
+                project_name=self.config.get_project_name(docker_type='prod')
+            ),
+            # NB: like `call_subprocess`, env vars are interpolated based on
+            #     LOCAL environment variables
+            'env': Config.interpolate_env_values(
+                deploy_config.docker_vars, os.environ
+            ),
+        }
+
+    def remote_batch(self, ops, deployment):
+        """
+        Runs a batch of remote agent operations on the deployment using a
+        single ssh session
+        """
+        deploy_config = self.config.for_deployment(deployment)
+
+        def report(result):
+            if result.get('skipped'):
+                print('{}: skipped'.format(result['name']))
+            elif result['returncode'] == 0:
+                print('{}: done in {:.1f}s'.format(
+                    result['name'], result['duration']
+                ))
+            else:
+                print('{}: failed with returncode {} after {:.1f}s'.format(
+                    result['name'], result['returncode'], result['duration']
+                ))
+                print('\n'.join(result['tail']))
+
+        return self.call_remote_agent(
+            ops, target=deploy_config.target,
+            python=getattr(deploy_config, 'python', 'python3'),
+            on_result=report
+        )
 
     def ssh(self, deployment):
         """Opens an ssh connection to the deployment"""
         deploy_config = self.config.for_deployment(deployment)
         self.call_subprocess(['ssh', deploy_config.target])
 
-    def deploy(self, deployment):
-        """Deploys docker images/static assets and starts services"""
+    def registry_digest(self, image):
+        """
+        Returns the digest the registry has for an image (EX:
+        'repo@sha256:...'), or None if the registry doesn't have it
+        """
+        try:
+            output = self.call_subprocess([
+                'docker', 'buildx', 'imagetools', 'inspect', '--format',
+                "'{{json .Manifest}}'", shlex.quote(image)
+            ], capture=True)
+            digest = json.loads(output)['digest']
+        except (NonZeroReturnCodeException, ValueError, KeyError):
+            return None
+        return '{}@{}'.format(image_repository(image), digest)
+
+    def local_deploy_state(self, deployment, images=None):
+        """
+        Returns the `DeployState` that deploying the local images and config
+        would leave on the deployment. Local images that aren't what the
+        registry has (EX: builds that haven't been pushed) have no digest.
+
+        Returns None (with a warning) if the images aren't built.
+        """
         deploy_config = self.config.for_deployment(deployment)
+        if images is None:
+            images = images_from_compose_config(self.dc(
+                input=['config'],
+                docker_type='prod-build',
+                deployment=deployment,
+                capture=True
+            ))
+        try:
+            output = self.call_subprocess(
+                ['docker', 'image', 'inspect', '--format',
+                 "'{{json .RepoDigests}}'"] +
+                [shlex.quote(image) for image in images],
+                capture=True
+            )
+        except NonZeroReturnCodeException:
+            print(
+                'WARNING: can\'t track the state of "{}" (some images '
+                'aren\'t built)'.format(deployment)
+            )
+            return None
+
+        digests = {}
+        for image, line in zip(images, output.splitlines()):
+            # NB: the digests recorded for the local image (EX: by pushes)
+            #     tell whether it is what the registry has
+            local_digests = [
+                d.split('@')[-1] for d in json.loads(line) or []
+            ]
+            digest = local_digests and self.registry_digest(image)
+            digests[image] = digest if digest and \
+                digest.split('@')[-1] in local_digests else None
+
+        return DeployState(
+            images=digests,
+            compose_hash=file_hash('docker-compose.prod.yml'),
+            env_hash=file_hash(deploy_config.env_file),
+        )
 
-        self.predeploy(deployment)
-        self.push(deployment)
+    def remote_deploy_state(self, deployment):
+        """Returns the `DeployState` recorded on the deployment (if any)"""
+        return DeployState.loads(self.ssh_script(
+            'cat {} 2>/dev/null || true'.format(STATE_FILE),
+            deployment=deployment, capture=True
+        ))
+
+    def status(self, deployment):
+        """Prints what is currently deployed on the deployment"""
+        state = self.remote_deploy_state(deployment)
+        if state:
+            print(state)
+        else:
+            print('No deploy has been recorded on "{}"'.format(deployment))
+        return state
 
-        self.ssh_cp(
-            input=[deploy_config.env_file],
-            deployment=deployment, dest='~/.env'
-        )
-        self.ssh_cp(
-            input=['docker-compose.prod.yml'],
-            deployment=deployment
-        )
+    def deploy(self, deployment, force=False, wait=False, timeout=300):
+        """
+        Deploys docker images/static assets and starts services
+
+        - force: if this is true, deploys even if the deployment's recorded
+                 state shows that nothing changed
+        - wait: if this is true, blocks until the services are healthy
+        - timeout: number of seconds to wait for services to become healthy
+        """
+        deploy_config = self.config.for_deployment(deployment)
+        wait = wait or getattr(deploy_config, 'wait', False)
+
+        state = remote_state = None
+        if getattr(deploy_config, 'track_state', False):
+            state = self.local_deploy_state(deployment)
+            if not force:
+                remote_state = self.remote_deploy_state(deployment)
+            if state and state == remote_state:
+                print(
+                    'Nothing changed since the last deploy to "{}"'
+                    .format(deployment)
+                )
+                return
+        deploy_images = not (state and state.same_images(remote_state))
+
+        def stage(name):
+            return self.events.span(
+                'deploy_stage', stage=name, deployment=deployment
+            )
 
-        self.pull(deployment=deployment)
-        self.up(input=['-d'], deployment=deployment)
+        if deploy_images:
+            with stage('predeploy'):
+                self.predeploy(deployment)
 
-        # cleans up docker system
-        # TODO: might want to make this optional
-        self.ssh_exec(
-            ['docker', 'system', 'prune', '-a', '--force'],
-            deployment=deployment
-        )
+        with stage('copy'):
+            self.ssh_cp(
+                input=[deploy_config.env_file],
+                deployment=deployment, dest='~/.env'
+            )
+            self.ssh_cp(
+                input=['docker-compose.prod.yml'],
+                deployment=deployment
+            )
+
+        pipeline = deploy_images and getattr(deploy_config, 'pipeline', False)
+        if pipeline:
+            with stage('push_pull'):
+                self.push_pull(deployment)
+        elif deploy_images:
+            with stage('push'):
+                self.push(deployment)
+        else:
+            print('Images are already deployed, skipping push and pull...')
+        pull = deploy_images and not pipeline
+
+        if state and deploy_images:
+            # NB: images that were just pushed only have digests now
+            state = self.local_deploy_state(
+                deployment, images=list(state.images)
+            )
+        if state and not state.complete:
+            print(
+                'WARNING: can\'t record the state of "{}" (the registry '
+                'digests of some images are unknown)'.format(deployment)
+            )
+            state = None
+
+        batch = getattr(deploy_config, 'batch', False)
+        finish_ops = self._finish_ops(deployment, state) if batch else []
+        if batch:
+            self.preup(docker_type='prod', deployment=deployment)
+            # NB: the batch pulls and starts the services in one go, so the
+            #     time it takes to pull can't be told apart here
+            started = time.time()
+            with stage('batch'):
+                # NB: without a wait, pruning and recording the state can
+                #     go in the same batch since nothing can fail in between
+                self.remote_batch(
+                    self._deploy_ops(deployment, pull) +
+                    ([] if wait else finish_ops),
+                    deployment
+                )
+        else:
+            if pull:
+                with stage('pull'):
+                    self.pull(deployment=deployment)
+            # NB: services are timed from `up` so pulls aren't counted
+            started = time.time()
+            with stage('up'):
+                self.up(input=['-d'], deployment=deployment)
+
+        if wait:
+            with stage('wait'):
+                self.wait_healthy(
+                    docker_type='prod', deployment=deployment,
+                    timeout=timeout, started=started
+                )
+
+        # NB: the state is only recorded once the services are up (and
+        #     healthy, when waiting) so a failed rollout gets redeployed
+        if batch:
+            if wait and finish_ops:
+                with stage('finish'):
+                    self.remote_batch(finish_ops, deployment)
+        else:
+            with stage('prune'):
+                self.prune(deployment)
+            if state:
+                with stage('state'):
+                    self.ssh_script(
+                        'printf %s {} > {}'.format(
+                            shlex.quote(state.dumps()), STATE_FILE
+                        ),
+                        deployment=deployment
+                    )
+
+    def _deploy_ops(self, deployment, pull):
+        """Returns the remote agent operations that start a batched deploy"""
+        ops = [self.remote_dc_op('pull', ['pull'], deployment)] if pull else []
+        ops.append(self.remote_dc_op(
+            'up', ['up', '--build', '--force-recreate', '-d'], deployment
+        ))
+        return ops
+
+    def _finish_ops(self, deployment, state):
+        """
+        Returns the remote agent operations that prune the deployment and
+        record its state once a batched deploy is up
+        """
+        ops = []
+        policy = self.config.for_deployment(deployment).prune_policy
+        if policy:
+            ops.append({
+                'name': 'prune',
+                'argv': ['sh', '-c', policy.to_script()]
+            })
+        if state:
+            ops.append({
+                'name': 'state',
+                'argv': ['sh', '-c', 'cat > {}'.format(STATE_FILE)],
+                'input': state.dumps()
+            })
+        return ops
+
+    def prune(self, deployment):
+        """Cleans up the deployment's docker system per its prune policy"""
+        policy = self.config.for_deployment(deployment).prune_policy
+        if policy:
+            self.ssh_script(policy.to_script(), deployment=deployment)
 
     def preup(self, **kwargs):
         self._run_commands(self.config.preup_commands, **kwargs)
@@ -0,0 +1,63 @@
+from sykle.plugins.sync_webfaction_data.assets import (
+    changed_files, link_files, parse_manifest, save_manifest, scan_manifest,
+    shard_files, MANIFEST_FILE
+)
+import os
+import tempfile
+import unittest
+
+
+class AssetsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, path, contents='x'):
+        path = os.path.join(self.dir.name, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(contents)
+        os.utime(path, (100, 100))
+        return path
+
+    def test_parse_manifest(self):
+        self.assertEqual(
+            parse_manifest('a/b c.jpg\t10\t1500000000.5\nbad\n'),
+            {'a/b c.jpg': [10, 1500000000]}
+        )
+
+    def test_scan_manifest(self):
+        self.write('media/a/1.jpg', 'abc')
+        self.write('media/2.jpg')
+        save_manifest(os.path.join(self.dir.name, 'media', MANIFEST_FILE), {})
+        self.assertEqual(
+            scan_manifest(os.path.join(self.dir.name, 'media')),
+            {'a/1.jpg': [3, 100], '2.jpg': [1, 100]}
+        )
+
+    def test_changed_files(self):
+        remote = {'a': [1, 1], 'b': [2, 2], 'c': [3, 3]}
+        local = {'a': [1, 1], 'b': [2, 1]}
+        self.assertEqual(changed_files(remote, local), ['b', 'c'])
+
+    def test_shard_files(self):
+        manifest = {
+            'big/1': [100, 0], 'big/2': [100, 0], 'small/1': [10, 0],
+            'other/1': [50, 0], 'root': [5, 0],
+        }
+        shards = shard_files(sorted(manifest), manifest, 2)
+        self.assertEqual(shards, [
+            ['big/1', 'big/2'], ['other/1', 'small/1', 'root']
+        ])
+        self.assertEqual(len(shard_files(['big/1'], manifest, 4)), 1)
+        self.assertEqual(shard_files([], manifest, 4), [])
+
+    def test_link_files(self):
+        src = os.path.dirname(self.write('src/a/1.jpg'))
+        self.write('dest/a/1.jpg', 'old')
+        link_files(os.path.dirname(src), os.path.join(self.dir.name, 'dest'),
+                   ['a/1.jpg'])
+        self.assertTrue(os.path.samefile(
+            os.path.join(src, '1.jpg'),
+            os.path.join(self.dir.name, 'dest/a/1.jpg')
+        ))
@@ -0,0 +1,56 @@
+from sykle.plugins.sync_pg_data.backup_store import BackupStore
+import os
+import tempfile
+import unittest
+
+
+class BackupStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = BackupStore(self.dir.name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def add_backup(self, name, location, size=10):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return self.store.add(path, location=location, format='tar',
+                              duration=1)
+
+    def test_add(self):
+        entry = self.add_backup('a', 'staging')
+        self.add_backup('b', 'local')
+
+        self.assertEqual(entry['size'], 10)
+        self.assertEqual(len(entry['checksum']), 64)
+        self.assertEqual(self.store.latest(),
+                         os.path.join(self.dir.name, 'b'))
+        self.assertEqual(self.store.latest('staging'),
+                         os.path.join(self.dir.name, 'a'))
+
+        reloaded = BackupStore(self.dir.name)
+        self.assertEqual(reloaded.get('a')['location'], 'staging')
+
+    def test_retention_count_evicts_least_recently_used(self):
+        self.add_backup('a', 'staging')
+        self.add_backup('b', 'staging')
+        self.add_backup('c', 'staging')
+        self.store.touch(os.path.join(self.dir.name, 'a'))
+
+        evicted = self.store.enforce_retention(count=2)
+        self.assertEqual([e['name'] for e in evicted], ['b'])
+        self.assertFalse(os.path.exists(os.path.join(self.dir.name, 'b')))
+        self.assertEqual(
+            [e['name'] for e in self.store.list()], ['a', 'c']
+        )
+
+    def test_retention_size_updates_latest(self):
+        self.add_backup('a', 'staging', size=1024 * 1024)
+        self.add_backup('b', 'local', size=1024 * 1024)
+
+        self.store.enforce_retention(max_size_mb=1)
+        self.assertIsNone(self.store.latest('staging'))
+        self.assertEqual(self.store.latest(),
+                         os.path.join(self.dir.name, 'b'))
@@ -0,0 +1,37 @@
+from sykle.call_subprocess import (
+    call_subprocess, pipefail, NonZeroReturnCodeException
+)
+import os
+import tempfile
+import unittest
+
+
+class CallSubprocessTestCase(unittest.TestCase):
+    def test_capture(self):
+        self.assertEqual(call_subprocess(['echo', 'hi'], capture=True), 'hi\n')
+
+    def test_on_stderr(self):
+        lines = []
+        output = call_subprocess(
+            ['echo', 'out', '&&', 'echo', 'a', '>&2', '&&', 'echo', 'b',
+             '>&2'],
+            capture=True, on_stderr=lines.append
+        )
+        self.assertEqual(output, 'out\n')
+        self.assertEqual(lines, ['a', 'b'])
+
+    def test_on_stderr_failure(self):
+        lines = []
+        with self.assertRaises(NonZeroReturnCodeException):
+            call_subprocess(['echo', 'oops', '>&2', '&&', 'false'],
+                            on_stderr=lines.append)
+        self.assertEqual(lines, ['oops'])
+
+    def test_pipefail(self):
+        with tempfile.TemporaryDirectory() as dir:
+            output = os.path.join(dir, 'out.gz')
+            command = ['false', '|', 'gzip', '-c', '>', output]
+            call_subprocess(command)
+            with self.assertRaises(NonZeroReturnCodeException):
+                call_subprocess(pipefail(command))
+            call_subprocess(pipefail(['echo', "'a b'", '|', 'cat']))
@@ -0,0 +1,57 @@
+from sykle.plugins.sync_pg_data.clients import PgClients, major_version
+from unittest.mock import patch
+import unittest
+
+ARGS = {'PASSWORD': 'pw', 'VERSION': '10.5'}
+
+
+class PgClientsTestCase(unittest.TestCase):
+    def test_major_version(self):
+        self.assertEqual(major_version('10.5'), '10')
+        self.assertEqual(major_version(10.5), '10')
+        self.assertEqual(major_version('9.6.3'), '9.6')
+        self.assertEqual(major_version('pg_dump (PostgreSQL) 12.2'), '12')
+        self.assertEqual(major_version('unknown'), None)
+
+    def test_uses_matching_host_binary(self):
+        clients = PgClients()
+        with patch.object(clients, 'host_version', return_value='10'):
+            self.assertEqual(
+                clients.command(ARGS, ['pg_dump', 'db']),
+                ['env', 'PGPASSWORD=pw', 'pg_dump', 'db']
+            )
+
+    @patch('sykle.plugins.sync_pg_data.clients.call_subprocess')
+    def test_execs_in_one_container_per_version_and_network(
+        self, mock_call_subprocess
+    ):
+        clients = PgClients()
+        with patch.object(clients, 'host_version', return_value='12'):
+            first = clients.command(ARGS, ['dropdb', 'db'])
+            second = clients.command(ARGS, ['pg_restore'], interactive=True)
+            other = clients.command(
+                dict(ARGS, NETWORK='test'), ['createdb', 'db']
+            )
+
+        name = clients.containers[('10.5', 'default')]
+        self.assertEqual(
+            first, ['docker', 'exec', '-e', 'PGPASSWORD=pw', name, 'dropdb',
+                    'db']
+        )
+        self.assertEqual(
+            second, ['docker', 'exec', '-i', '-e', 'PGPASSWORD=pw', name,
+                     'pg_restore']
+        )
+        self.assertIn(clients.containers[('10.5', 'test')], other)
+        self.assertEqual(mock_call_subprocess.call_count, 2)
+
+        clients.close()
+        self.assertEqual(mock_call_subprocess.call_count, 4)
+        self.assertEqual(clients.containers, {})
+
+    def test_mounts_outside_working_directory_use_a_new_container(self):
+        clients = PgClients(use_host=False)
+        command = clients.command(ARGS, ['pg_dump'], mount='/elsewhere')
+        self.assertEqual(command[:3], ['docker', 'run', '--rm'])
+        self.assertIn('/elsewhere://elsewhere', command)
+        self.assertEqual(clients.containers, {})
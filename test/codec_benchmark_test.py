@@ -0,0 +1,73 @@
+from sykle.plugins.sync_pg_data.codec import CODECS
+import os
+import time
+import shutil
+import random
+import tempfile
+import subprocess
+import unittest
+
+# NB: rows of a fake COPY block, roughly as compressible as a real dump
+SYNTHETIC_ROWS = 100000
+
+
+def synthetic_dump(path, rows=SYNTHETIC_ROWS):
+    random.seed(0)
+    words = ['alpha', 'beta', 'gamma', 'delta', 'sykle', 'postgres', 'data']
+    with open(path, 'w') as f:
+        f.write('COPY public.events (id, name, email, payload, created) '
+                'FROM stdin;\n')
+        for i in range(rows):
+            f.write('{}\t{}\tuser{}@example.com\t{}\t2020-01-{:02d} '
+                    '{:02d}:{:02d}:00+00\n'.format(
+                        i, random.choice(words), random.randint(0, 5000),
+                        ' '.join(random.choice(words) for _ in range(8)),
+                        random.randint(1, 28), random.randint(0, 23),
+                        random.randint(0, 59)
+                    ))
+        f.write('\\.\n')
+
+
+def run(command, stdin, stdout):
+    with open(stdin, 'rb') as i, open(stdout, 'wb') as o:
+        start = time.perf_counter()
+        subprocess.run(command, stdin=i, stdout=o, check=True)
+        return time.perf_counter() - start
+
+
+# NB: compresses a large synthetic dump with every installed codec, which is
+#     too slow for the unit suite (set SYKLE_BENCHMARKS=1 and run with
+#     `-s` to see the table)
+@unittest.skipUnless(
+    os.environ.get('SYKLE_BENCHMARKS'), 'SYKLE_BENCHMARKS is not set'
+)
+class CodecBenchmarkTestCase(unittest.TestCase):
+    def test_codecs(self):
+        with tempfile.TemporaryDirectory() as dir:
+            dump = os.path.join(dir, 'dump.sql')
+            synthetic_dump(dump)
+            size = os.path.getsize(dump)
+
+            print('\n{:<6} {:>8} {:>10} {:>12}'.format(
+                'codec', 'ratio', 'compress', 'decompress'
+            ))
+            for name, codec in sorted(CODECS.items()):
+                command = codec.compress_command()
+                if not shutil.which(command[0]):
+                    continue
+                with self.subTest(codec=name):
+                    compressed = dump + codec.extension + '.out'
+                    restored = dump + '.restored'
+                    compress_time = run(command, dump, compressed)
+                    decompress_time = run(
+                        codec.decompress_command(), compressed, restored
+                    )
+                    ratio = os.path.getsize(compressed) / size
+                    print('{:<6} {:>8.3f} {:>9.3f}s {:>11.3f}s'.format(
+                        name, ratio, compress_time, decompress_time
+                    ))
+
+                    with open(dump, 'rb') as a, open(restored, 'rb') as b:
+                        self.assertEqual(a.read(), b.read())
+                    if codec.extension:
+                        self.assertLess(ratio, 0.5)
@@ -0,0 +1,44 @@
+from sykle.plugins.sync_pg_data.codec import (
+    CODECS, codec_for_path, get_codec
+)
+from unittest.mock import patch
+import unittest
+
+
+class CodecTestCase(unittest.TestCase):
+    def test_get_codec(self):
+        self.assertEqual(get_codec('gzip').name, 'gzip')
+        self.assertEqual(get_codec('none').name, 'none')
+        self.assertEqual(get_codec(None).name, 'none')
+        with self.assertRaises(Exception):
+            get_codec('lzma')
+
+    @patch('sykle.plugins.sync_pg_data.codec.shutil.which')
+    def test_auto(self, mock_which):
+        mock_which.return_value = '/usr/bin/zstd'
+        self.assertEqual(get_codec('auto').name, 'zstd')
+        mock_which.return_value = None
+        self.assertEqual(get_codec('auto').name, 'gzip')
+
+    def test_codec_for_path(self):
+        self.assertEqual(codec_for_path('backup.zst').name, 'zstd')
+        self.assertEqual(codec_for_path('backup.gz').name, 'gzip')
+        self.assertEqual(codec_for_path('backup.dir').name, 'none')
+
+    @patch('sykle.plugins.sync_pg_data.codec.shutil.which')
+    def test_gzip_uses_pigz(self, mock_which):
+        gzip = CODECS['gzip']
+        mock_which.return_value = '/usr/bin/pigz'
+        self.assertEqual(gzip.compress_command(threads=4),
+                         ['pigz', '-c', '-p', '4'])
+        self.assertEqual(gzip.decompress_command(), ['pigz', '-dc'])
+        self.assertEqual(gzip.compress_command(remote=True), ['gzip', '-c'])
+
+        mock_which.return_value = None
+        self.assertEqual(gzip.compress_command(threads=4), ['gzip', '-c'])
+
+    def test_zstd_threads(self):
+        zstd = CODECS['zstd']
+        self.assertEqual(zstd.compress_command(), ['zstd', '-q', '-c', '-T0'])
+        self.assertEqual(zstd.compress_command(threads=2)[-1], '-T2')
+        self.assertNotIn('-T0', zstd.compress_command(remote=True))
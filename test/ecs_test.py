@@ -0,0 +1,207 @@
+from sykle.plugins.ecs import (
+    Plugin, rollout_state, image_repository, pushed_images
+)
+from sykle.config import DeploymentConfig
+from unittest.mock import MagicMock, patch
+import unittest
+
+
+def service(arn, deployments=1, running=2, desired=2, rollout=None):
+    return {
+        'serviceArn': arn,
+        'runningCount': running,
+        'desiredCount': desired,
+        'deployments': [
+            {'status': 'PRIMARY', 'rolloutState': rollout}
+        ] + [{'status': 'ACTIVE'}] * (deployments - 1),
+    }
+
+
+def task_definition(arn, *images):
+    return {'taskDefinition': {
+        'taskDefinitionArn': arn,
+        'family': arn.split('/')[-1].split(':')[0],
+        'status': 'ACTIVE',
+        'containerDefinitions': [
+            {'name': 'c%d' % i, 'image': image}
+            for i, image in enumerate(images)
+        ],
+    }}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ECSTestCase(unittest.TestCase):
+    def setUp(self):
+        self.plugin = Plugin(MagicMock(), MagicMock(), None)
+        self.client = MagicMock()
+        self.client.get_paginator.return_value.paginate.return_value = [
+            {'serviceArns': ['svc/a', 'svc/b']},
+            {'serviceArns': ['svc/c']},
+        ]
+
+    def test_rollout_state(self):
+        self.assertEqual(rollout_state(service('a')), 'stable')
+        self.assertEqual(rollout_state(service('a', deployments=2)), 'pending')
+        self.assertEqual(rollout_state(service('a', running=1)), 'pending')
+        self.assertEqual(
+            rollout_state(service('a', deployments=2, rollout='FAILED')),
+            'failed'
+        )
+
+    def test_image_repository(self):
+        self.assertEqual(image_repository('repo'), 'repo')
+        self.assertEqual(image_repository('a.com/repo:1'), 'a.com/repo')
+        self.assertEqual(image_repository('a.com/r@sha256:ab'), 'a.com/r')
+        self.assertEqual(image_repository('a.com:5000/r'), 'a.com:5000/r')
+
+    def test_pushed_images(self):
+        images = pushed_images(
+            {'BACKEND_IMAGE': '$IMAGE', 'BUILD_NUMBER': '12'},
+            {'IMAGE': 'a.com/backend:12'}
+        )
+        self.assertEqual(images, {'a.com/backend': 'a.com/backend:12'})
+
+        docker_vars = {'BACKEND_IMAGE': 'a.com/backend', 'X_IMAGE': 'x'}
+        self.assertEqual(pushed_images(docker_vars), {
+            'a.com/backend': 'a.com/backend:latest', 'x': 'x:latest'
+        })
+        self.assertEqual(
+            pushed_images(docker_vars, pushed=['a.com/backend:12', 'y:1']),
+            {'a.com/backend': 'a.com/backend:12', 'x': 'x:latest'}
+        )
+
+    def describe(self, task_definitions, backend='a.com/backend:latest'):
+        self.client.describe_services.side_effect = lambda **kw: {
+            'services': [
+                {'serviceArn': arn, 'taskDefinition': task_definitions[arn]}
+                for arn in kw['services']
+            ]
+        }
+        self.client.describe_task_definition.side_effect = \
+            lambda taskDefinition: task_definition(
+                taskDefinition,
+                backend if 'web' in taskDefinition
+                else 'redis:5'
+            )
+
+    def test_refresh_cluster_skips_services_without_images(self):
+        self.describe({
+            'svc/a': 'td/web:1', 'svc/b': 'td/web:1', 'svc/c': 'td/redis:3'
+        })
+        config = DeploymentConfig(
+            cluster='foo', docker_vars={'BACKEND_IMAGE': 'a.com/backend'}
+        )
+        with patch.object(self.plugin, 'get_client', return_value=self.client):
+            self.plugin.refresh_cluster(config)
+
+        updated = sorted(
+            c[1]['service'] for c in self.client.update_service.call_args_list
+        )
+        self.assertEqual(updated, ['svc/a', 'svc/b'])
+        # NB: each revision is only described once
+        self.assertEqual(self.client.describe_task_definition.call_count, 2)
+        self.client.register_task_definition.assert_not_called()
+
+    def pin(self, backend):
+        self.plugin.sykle.registry_digest.return_value = \
+            'a.com/backend@sha256:ab'
+        self.client.register_task_definition.return_value = {
+            'taskDefinition': {'taskDefinitionArn': 'td/web:2'}
+        }
+        self.describe({
+            'svc/a': 'td/web:1', 'svc/b': 'td/web:1', 'svc/c': 'td/redis:3'
+        }, backend=backend)
+        config = DeploymentConfig(
+            cluster='foo', pin_digests=True,
+            docker_vars={'BACKEND_IMAGE': 'a.com/backend'}
+        )
+        with patch.object(self.plugin, 'get_client', return_value=self.client):
+            self.plugin.refresh_cluster(config, pushed=['a.com/backend:12'])
+
+    def test_refresh_cluster_pins_digests(self):
+        self.pin('a.com/backend:latest')
+
+        self.client.register_task_definition.assert_called_once()
+        fields = self.client.register_task_definition.call_args[1]
+        self.assertNotIn('status', fields)
+        self.assertEqual(fields['family'], 'web')
+        self.assertEqual(
+            fields['containerDefinitions'][0]['image'],
+            'a.com/backend@sha256:ab'
+        )
+        self.plugin.sykle.registry_digest.assert_called_with(
+            'a.com/backend:12'
+        )
+        for c in self.client.update_service.call_args_list:
+            self.assertEqual(c[1]['taskDefinition'], 'td/web:2')
+            self.assertNotIn('forceNewDeployment', c[1])
+
+    def test_refresh_cluster_repins_pinned_task_definition(self):
+        self.pin('a.com/backend@sha256:old')
+
+        # NB: the digest comes from the pushed tag, not the pinned image
+        self.plugin.sykle.registry_digest.assert_called_once_with(
+            'a.com/backend:12'
+        )
+        fields = self.client.register_task_definition.call_args[1]
+        self.assertEqual(
+            fields['containerDefinitions'][0]['image'],
+            'a.com/backend@sha256:ab'
+        )
+
+    def test_refresh_cluster_updates_every_page(self):
+        config = DeploymentConfig(cluster='foo')
+        with patch.object(self.plugin, 'get_client', return_value=self.client):
+            self.plugin.refresh_cluster(config)
+
+        self.client.get_paginator.assert_called_once_with('list_services')
+        updated = sorted(
+            c[1]['service'] for c in self.client.update_service.call_args_list
+        )
+        self.assertEqual(updated, ['svc/a', 'svc/b', 'svc/c'])
+        self.client.describe_services.assert_not_called()
+
+    def test_update_failures_raise(self):
+        self.client.update_service.side_effect = Exception('throttled')
+        with self.assertRaises(Exception):
+            self.plugin.update_services(self.client, 'foo', ['svc/a'])
+
+    def test_wait_for_services(self):
+        arns = ['svc/%d' % i for i in range(12)]
+        polls = {arn: 0 for arn in arns}
+
+        def describe_services(cluster, services):
+            self.assertLessEqual(len(services), 10)
+            for arn in services:
+                polls[arn] += 1
+            return {'services': [
+                service(arn, deployments=1 if polls[arn] > 1 else 2)
+                if arn != 'svc/0' else service(arn, deployments=2)
+                for arn in services
+            ]}
+
+        self.client.describe_services.side_effect = describe_services
+        clock = FakeClock()
+        results = self.plugin.wait_for_services(
+            self.client, 'foo', arns, timeout=60, interval=15,
+            clock=clock, sleep=clock.sleep
+        )
+
+        self.assertEqual(results['svc/1'], ('stable', 15))
+        self.assertEqual(results['svc/0'], ('timeout', 45))
+        # NB: 2 calls for each of the first 2 checks, then only svc/0 is left
+        self.assertEqual(self.client.describe_services.call_count, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+from sykle.events import EventBus
+from sykle.call_subprocess import NonZeroReturnCodeException
+from unittest.mock import MagicMock
+import unittest
+
+
+class EventBusTestCase(unittest.TestCase):
+    def test_span(self):
+        bus = EventBus()
+        events = []
+        bus.subscribe('dc', events.append)
+
+        with bus.span('dc', argv=['up'], docker_type='dev'):
+            pass
+        with bus.span('ssh_exec', argv=['ls']):
+            pass
+
+        self.assertEqual([e.phase for e in events], ['start', 'finish'])
+        self.assertEqual(events[1].argv, ['up'])
+        self.assertEqual(events[1].returncode, 0)
+
+    def test_span_error(self):
+        bus = EventBus()
+        events = []
+        bus.subscribe('*', events.append)
+        error = NonZeroReturnCodeException(process=MagicMock(returncode=2))
+
+        with self.assertRaises(NonZeroReturnCodeException):
+            with bus.span('command', argv=['false']):
+                raise error
+
+        self.assertEqual(events[1].returncode, 2)
+        self.assertIs(events[1].error, error)
@@ -0,0 +1,110 @@
+from sykle.health import (
+    wait_until_healthy, compose_project_label, HealthCheckException,
+    _ready_at
+)
+from unittest.mock import MagicMock, patch
+import io
+import json
+import time
+import unittest
+
+
+def events_process(*events):
+    process = MagicMock()
+    process.stdout = io.BytesIO(
+        b''.join(json.dumps(e).encode() + b'\n' for e in events)
+    )
+    return process
+
+
+class HealthTestCase(unittest.TestCase):
+    def test_compose_project_label(self):
+        self.assertEqual(compose_project_label('My.Project-prod'),
+                         'myproject-prod')
+
+    @patch('sykle.health._inspect_containers')
+    @patch('sykle.health._subprocess.Popen')
+    def test_wait_until_healthy(self, popen, inspect):
+        inspect.return_value = [
+            ('a', 'backend', 'running', '0', 'starting', None),
+            ('b', 'redis', 'running', '0', '', None),
+        ]
+        popen.return_value = events_process(
+            {'id': 'old', 'status': 'die', 'Actor': {'Attributes': {}}},
+            {'id': 'a', 'status': 'health_status: healthy'},
+        )
+
+        times = wait_until_healthy('test-prod', timeout=5)
+        self.assertEqual(set(times.keys()), {'backend', 'redis'})
+
+    def test_ready_at(self):
+        self.assertEqual(_ready_at({
+            'Status': 'running',
+            'StartedAt': '1970-01-01T00:01:40.500000000Z',
+        }), 100.5)
+        self.assertEqual(_ready_at({
+            'Status': 'exited',
+            'StartedAt': '1970-01-01T00:01:40Z',
+            'FinishedAt': '1970-01-01T02:01:41+02:00',
+        }), 101)
+        self.assertEqual(_ready_at({
+            'Status': 'running',
+            'Health': {'Status': 'healthy', 'Log': [
+                {'ExitCode': 0, 'End': '1970-01-01T00:00:01Z'},
+                {'ExitCode': 1, 'End': '1970-01-01T00:00:02Z'},
+                {'ExitCode': 0, 'End': '1970-01-01T00:00:03.25Z'},
+                {'ExitCode': 0, 'End': '1970-01-01T00:00:04Z'},
+            ]},
+        }), 3.25)
+        self.assertIsNone(_ready_at({
+            'Status': 'running', 'StartedAt': '0001-01-01T00:00:00Z'
+        }))
+
+    @patch('sykle.health._inspect_containers')
+    @patch('sykle.health._subprocess.Popen')
+    def test_already_healthy_uses_recorded_time(self, popen, inspect):
+        started = time.time() - 60
+        inspect.return_value = [
+            ('a', 'backend', 'running', '0', 'healthy', started + 2),
+            ('b', 'backend', 'running', '0', 'healthy', started + 5),
+            ('c', 'redis', 'running', '0', '', started - 10),
+        ]
+        popen.return_value = events_process()
+
+        times = wait_until_healthy('test-prod', timeout=5, started=started)
+        self.assertEqual(times, {'backend': 5.0, 'redis': 0})
+
+    @patch('sykle.health._inspect_containers')
+    @patch('sykle.health._subprocess.Popen')
+    def test_wait_until_healthy_unhealthy(self, popen, inspect):
+        inspect.return_value = [
+            ('a', 'backend', 'running', '0', 'starting', None)
+        ]
+        popen.return_value = events_process(
+            {'id': 'a', 'status': 'health_status: unhealthy'},
+        )
+
+        with self.assertRaises(HealthCheckException):
+            wait_until_healthy('test-prod', timeout=5)
+
+    @patch('sykle.health._inspect_containers')
+    @patch('sykle.health._subprocess.Popen')
+    def test_wait_until_healthy_no_containers(self, popen, inspect):
+        inspect.return_value = []
+        popen.return_value = events_process()
+
+        with self.assertRaisesRegex(HealthCheckException, 'No containers'):
+            wait_until_healthy('test-prod', timeout=5)
+
+    @patch('sykle.health._inspect_containers')
+    @patch('sykle.health._subprocess.Popen')
+    def test_wait_until_healthy_timeout(self, popen, inspect):
+        inspect.return_value = [
+            ('a', 'backend', 'running', '0', 'starting', None)
+        ]
+        process = events_process()
+        process.stdout = (time.sleep(1) for _ in range(1))
+        popen.return_value = process
+
+        with self.assertRaisesRegex(HealthCheckException, 'Timed out'):
+            wait_until_healthy('test-prod', timeout=0.1)
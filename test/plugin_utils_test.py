@@ -0,0 +1,123 @@
+from sykle.plugin_utils import Plugins, PluginDir, EntryPointPlugin
+from sykle.sykle import Sykle
+from sykle.config import ConfigV2
+from importlib.metadata import EntryPoint
+from unittest.mock import patch
+import os
+import sys
+import tempfile
+import unittest
+
+PLUGIN_SOURCE = """
+from sykle.plugin_utils import IPlugin
+
+RAN = []
+
+
+class Plugin(IPlugin):
+    NAME = '{name}'
+    REQUIRED_VERSION = '{version}'
+
+    def run(self):
+        RAN.append(self.NAME)
+"""
+
+
+class PluginsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.TemporaryDirectory()
+        os.chdir(self.dir.name)
+        os.mkdir('.syk-plugins')
+        self.config = ConfigV2({})
+        self.sykle = Sykle(config=self.config)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.dir.cleanup()
+        for name in ['ecs', 'json', 'syk_test_local']:
+            sys.modules.pop('_sykle_local_plugins.' + name, None)
+        sys.modules.pop('syk_test_installed', None)
+
+    def write_plugin(self, path, name, version='0.0.1'):
+        with open(os.path.join(path, name + '.py'), 'w') as f:
+            f.write(PLUGIN_SOURCE.format(name=name, version=version))
+
+    def test_global_plugins_are_not_imported(self):
+        sys.modules.pop('sykle.plugins.ecs', None)
+        plugins = Plugins.list()
+
+        self.assertIsInstance(plugins['ecs'], PluginDir)
+        self.assertEqual(plugins['ecs'].module_name, 'sykle.plugins.ecs')
+        self.assertNotIn('sykle.plugins.ecs', sys.modules)
+
+    def test_local_plugin_overrides_global_plugin(self):
+        self.write_plugin('.syk-plugins', 'ecs')
+        plugins = Plugins(config=self.config, sykle=self.sykle)
+
+        plugins.run('ecs')
+        module = sys.modules['_sykle_local_plugins.ecs']
+        self.assertEqual(module.RAN, ['ecs'])
+        self.assertIs(plugins.plugins['ecs'].module, module)
+        self.assertNotIn('ecs', sys.modules)
+
+    def test_local_plugin_named_like_a_module(self):
+        import json
+        self.write_plugin('.syk-plugins', 'json')
+        plugins = Plugins(config=self.config, sykle=self.sykle)
+
+        plugins.run('json')
+        self.assertIsNot(plugins.plugins['json'].module, json)
+        self.assertEqual(plugins.plugins['json'].module.RAN, ['json'])
+        self.assertIs(sys.modules['json'], json)
+
+    def test_plugins_added_later_are_found(self):
+        self.assertFalse(Plugins.exists('syk_test_local'))
+        self.write_plugin('.syk-plugins', 'syk_test_local')
+        self.assertTrue(Plugins.exists('syk_test_local'))
+
+    def test_local_plugin_required_version(self):
+        self.write_plugin('.syk-plugins', 'syk_test_local', version='999.0')
+        plugins = Plugins(config=self.config, sykle=self.sykle)
+
+        with self.assertRaisesRegex(Exception, 'requires sykle 999.0'):
+            plugins.run('syk_test_local')
+
+    @patch('sykle.plugin_utils._plugin_entry_points')
+    def test_entry_point_plugin(self, plugin_entry_points):
+        self.write_plugin(self.dir.name, 'syk_test_installed')
+        sys.path.insert(0, self.dir.name)
+        self.addCleanup(sys.path.remove, self.dir.name)
+        plugin_entry_points.return_value = [EntryPoint(
+            name='installed', value='syk_test_installed',
+            group='sykle.plugins'
+        )]
+        plugins = Plugins(config=self.config, sykle=self.sykle)
+
+        self.assertIsInstance(plugins.plugins['installed'], EntryPointPlugin)
+        self.assertNotIn('syk_test_installed', sys.modules)
+        plugins.run('installed')
+        self.assertEqual(
+            sys.modules['syk_test_installed'].RAN, ['syk_test_installed']
+        )
+
+    @patch('sykle.plugin_utils.call_subprocess')
+    def test_install_requirements(self, call_subprocess):
+        plugins = Plugins.list()
+        with patch('sykle.plugin_utils.INSTALL_CACHE_DIR', self.dir.name):
+            self.assertTrue(Plugins.install_requirements(
+                plugins, wheel_dir='wheels'
+            ))
+            self.assertFalse(Plugins.install_requirements(plugins))
+            self.assertTrue(Plugins.install_requirements(plugins, force=True))
+
+        self.assertEqual(call_subprocess.call_count, 2)
+        command = call_subprocess.call_args_list[0][0][0]
+        self.assertEqual(command[1:6], [
+            '-m', 'pip', 'install', '--no-index', '--find-links'
+        ])
+        self.assertEqual(
+            command.count('-r'),
+            len([p for p in plugins.values()
+                 if os.path.isfile(p.requirements_file)])
+        )
@@ -0,0 +1,78 @@
+from sykle.plugin_utils import Plugins
+import os
+import sys
+import json
+import subprocess
+import unittest
+
+# NB: seconds `syk <plugin> --help` may take, including importing sykle
+IMPORT_TIME_BUDGET = 1.0
+
+HELP_SCRIPT = """
+import sys
+import json
+import time
+
+start = time.perf_counter()
+from sykle.config import ConfigV2
+from sykle.sykle import Sykle
+from sykle.plugin_utils import Plugins
+
+sys.argv = ['syk', '{name}', '--help']
+plugins = Plugins(config=ConfigV2({{}}), sykle=Sykle(ConfigV2({{}})))
+try:
+    plugins.run('{name}')
+except SystemExit:
+    pass
+seconds = time.perf_counter() - start
+
+deferred = plugins.plugins['{name}'].plugin_class.DEFERRED_IMPORTS
+print(json.dumps({{
+    'seconds': seconds,
+    'imported': [m for m in deferred if m in sys.modules],
+}}))
+"""
+
+LIST_SCRIPT = """
+import sys
+import json
+from sykle.plugin_utils import Plugins
+
+Plugins.list()
+print(json.dumps([m for m in sys.modules if m.startswith('sykle.plugins.')]))
+"""
+
+
+def run_script(script):
+    p = subprocess.run(
+        [sys.executable, '-c', script], stdout=subprocess.PIPE,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    return json.loads(p.stdout.decode().splitlines()[-1])
+
+
+class PluginsImportTestCase(unittest.TestCase):
+    def test_help_defers_imports(self):
+        for name in sorted(Plugins.list().keys()):
+            with self.subTest(plugin=name):
+                result = run_script(HELP_SCRIPT.format(name=name))
+                self.assertEqual(result['imported'], [])
+
+    def test_list_imports_no_plugins(self):
+        self.assertEqual(run_script(LIST_SCRIPT), [])
+
+
+# NB: import times depend on the machine and on what else is running, so
+#     they are kept out of the unit suite (set SYKLE_BENCHMARKS=1 and run
+#     with `-s` to see the table)
+@unittest.skipUnless(
+    os.environ.get('SYKLE_BENCHMARKS'), 'SYKLE_BENCHMARKS is not set'
+)
+class PluginsImportBenchmarkTestCase(unittest.TestCase):
+    def test_help_import_time(self):
+        print('\n{:<24} {:>8}'.format('plugin', 'seconds'))
+        for name in sorted(Plugins.list().keys()):
+            with self.subTest(plugin=name):
+                result = run_script(HELP_SCRIPT.format(name=name))
+                print('{:<24} {:>7.3f}s'.format(name, result['seconds']))
+                self.assertLess(result['seconds'], IMPORT_TIME_BUDGET)
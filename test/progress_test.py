@@ -0,0 +1,52 @@
+from sykle.plugins.sync_pg_data.progress import TableProgress
+import unittest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TableProgressTestCase(unittest.TestCase):
+    def test_sequential_tables(self):
+        clock = Clock()
+        written = [0]
+        progress = TableProgress(size=lambda: written[0], clock=clock)
+
+        progress.feed('pg_dump: reading schemas')
+        progress.feed('pg_dump: dumping contents of table "public.users"')
+        self.assertEqual(list(progress.current), ['public.users'])
+        clock.now, written[0] = 4, 4096
+        self.assertEqual(progress.status(),
+                         'public.users | 4.0 KB | 1.0 KB/s | 00:04')
+
+        progress.feed('pg_dump: dumping contents of table "public.orders"')
+        clock.now, written[0] = 5, 5120
+        progress.finish()
+
+        self.assertEqual(progress.tables, {
+            'public.users': {'duration': 4, 'size': 4096},
+            'public.orders': {'duration': 1, 'size': 1024},
+        })
+        report = progress.report().splitlines()
+        self.assertTrue(report[1].startswith('public.users'))
+        self.assertEqual(report[-1], 'Total: 5.0 KB in 00:05')
+
+    def test_parallel_tables(self):
+        clock = Clock()
+        progress = TableProgress(
+            known_sizes={'public.users': 10}, parallel=True, clock=clock
+        )
+        progress.feed('pg_restore: processing data for table "public.users"')
+        progress.feed('pg_restore: processing data for table "public.orders"')
+        self.assertEqual(len(progress.current), 2)
+
+        clock.now = 3
+        progress.feed('pg_restore: finished item 2 TABLE DATA users')
+        self.assertEqual(list(progress.current), ['public.orders'])
+        self.assertEqual(progress.tables['public.users'],
+                         {'duration': 3, 'size': 10})
+        self.assertEqual(progress.processed, 10)
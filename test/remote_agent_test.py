@@ -0,0 +1,53 @@
+from sykle.remote_agent import main, run_op
+from sykle.call_remote_agent import remote_agent_program
+import io
+import sys
+import json
+import subprocess
+import unittest
+
+
+class RemoteAgentTestCase(unittest.TestCase):
+    def test_run_op(self):
+        result = run_op({
+            'name': 'echo',
+            'argv': [
+                sys.executable, '-c',
+                'import os, sys; print(os.environ["FOO"]); '
+                'print(sys.stdin.read())'
+            ],
+            'env': {'FOO': 'bar'},
+            'input': 'baz',
+        })
+        self.assertEqual(result['name'], 'echo')
+        self.assertEqual(result['returncode'], 0)
+        self.assertEqual(result['tail'], ['bar', 'baz'])
+
+    def test_run_op_missing_command(self):
+        result = run_op({'argv': ['sykle-command-that-does-not-exist']})
+        self.assertEqual(result['returncode'], 127)
+
+    def test_main_skips_after_failure(self):
+        stream = io.StringIO()
+        returncode = main([
+            {'name': 'fail', 'argv': [sys.executable, '-c', 'exit(3)']},
+            {'name': 'next', 'argv': [sys.executable, '-c', 'pass']},
+        ], stream=stream)
+        results = [json.loads(line) for line in stream.getvalue().splitlines()]
+
+        self.assertEqual(returncode, 1)
+        self.assertEqual(results[0]['returncode'], 3)
+        self.assertEqual(results[1], {'name': 'next', 'skipped': True})
+
+    def test_remote_agent_program(self):
+        program = remote_agent_program([
+            {'name': 'hi', 'argv': [sys.executable, '-c', 'print("hi")']}
+        ])
+        p = subprocess.run(
+            [sys.executable, '-'], input=program.encode(),
+            stdout=subprocess.PIPE
+        )
+        result = json.loads(p.stdout.decode())
+
+        self.assertEqual(p.returncode, 0)
+        self.assertEqual(result['tail'], ['hi'])
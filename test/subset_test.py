@@ -0,0 +1,71 @@
+from sykle.plugins.sync_pg_data.subset import (
+    data_script, parse_foreign_keys, root_condition, subset_conditions
+)
+import unittest
+
+
+class SubsetTestCase(unittest.TestCase):
+    def test_parse_foreign_keys(self):
+        self.assertEqual(
+            parse_foreign_keys('orders|auth_user|user_id|id\n\nbad line\n'),
+            [('orders', 'auth_user', 'user_id', 'id')]
+        )
+
+    def test_root_condition(self):
+        self.assertEqual(root_condition('is_staff'), 'is_staff')
+        self.assertEqual(root_condition(True), 'TRUE')
+        self.assertEqual(
+            root_condition(2.5),
+            '(hashtext(ctid::text) & 2147483647) % 10000 < 250'
+        )
+
+    def test_subset_conditions_follows_foreign_keys(self):
+        foreign_keys = [
+            ('order_items', 'orders', 'order_id', 'id'),
+            ('orders', 'auth_user', 'user_id', 'id'),
+            ('audit_log', 'auth_user', 'user_id', 'id'),
+        ]
+        conditions = subset_conditions({'order_items': 'id < 10'},
+                                       foreign_keys)
+        self.assertEqual(conditions, {
+            'order_items': 'id < 10',
+            'orders': '(id) IN (SELECT order_id FROM order_items '
+                      'WHERE id < 10)',
+            'auth_user': '(id) IN (SELECT user_id FROM orders WHERE '
+                         '(id) IN (SELECT order_id FROM order_items '
+                         'WHERE id < 10))',
+        })
+
+    def test_subset_conditions_combines_roots_and_references(self):
+        foreign_keys = [('orders', 'auth_user', 'user_id', 'id')]
+        conditions = subset_conditions(
+            {'orders': 'id < 10', 'auth_user': 'is_staff'}, foreign_keys
+        )
+        self.assertEqual(
+            conditions['auth_user'],
+            '(is_staff) OR ((id) IN (SELECT user_id FROM orders '
+            'WHERE id < 10))'
+        )
+
+    def test_subset_conditions_stops_at_max_depth(self):
+        foreign_keys = [('employee', 'employee', 'manager_id', 'id')]
+        conditions = subset_conditions({'employee': 'id = 1'}, foreign_keys,
+                                       max_depth=2)
+        self.assertEqual(conditions['employee'].count('SELECT'), 2)
+
+    def test_data_script(self):
+        script = data_script(
+            {'orders': 'id < 10', 'audit_log': 'TRUE'}, exclude={'audit_log'}
+        )
+        lines = script.splitlines()
+        self.assertEqual(
+            lines[0], 'BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;'
+        )
+        self.assertEqual(lines[1:4], [
+            "\\qecho 'COPY orders FROM stdin;'",
+            'COPY (SELECT * FROM orders WHERE id < 10) TO STDOUT;',
+            "\\qecho '\\\\.'",
+        ])
+        self.assertNotIn('audit_log', script)
+        self.assertIn('setval', script)
+        self.assertEqual(lines[-1], 'COMMIT;')
@@ -1,6 +1,11 @@
 from sykle.sykle import Sykle
 from sykle.config import ConfigV2
-from unittest.mock import MagicMock
+from sykle.deploy_state import DeployState, file_hash
+from sykle.call_subprocess import NonZeroReturnCodeException
+from sykle.health import HealthCheckException
+from unittest.mock import MagicMock, patch
+import json
+import time
 import unittest
 
 
@@ -117,3 +122,341 @@ class SykleTestCase(unittest.TestCase):
                 type='prod'
             )
         )
+
+    def test_prune_default(self):
+        config = ConfigV2({
+            "deployments": {"staging": {"target": "fake-target"}}
+        })
+        sykle = Sykle(config=config)
+        sykle.call_subprocess = MagicMock()
+
+        sykle.prune('staging')
+        sykle.call_subprocess.assert_called_with(
+            ["'docker system prune -a --force'"], target='fake-target'
+        )
+
+    def test_prune_disabled(self):
+        config = ConfigV2({
+            "deployments": {
+                "staging": {"target": "fake-target", "prune": False}
+            }
+        })
+        sykle = Sykle(config=config)
+        sykle.call_subprocess = MagicMock()
+
+        sykle.prune('staging')
+        sykle.call_subprocess.assert_not_called()
+
+    def test_prune_policy(self):
+        config = ConfigV2({
+            "deployments": {
+                "staging": {
+                    "target": "fake-target",
+                    "prune": {"threshold": 80, "keep": 2, "detach": True}
+                }
+            }
+        })
+        script = config.for_deployment('staging').prune_policy.to_script()
+
+        self.assertTrue(script.startswith('nohup sh -c '))
+        self.assertTrue(script.endswith('>/dev/null 2>&1 &'))
+        self.assertIn('-lt 80 ] && exit 0', script)
+        self.assertIn('seen[$1]++ >= 2', script)
+        self.assertNotIn('prune -a', script)
+
+    def test_deploy_pipeline(self):
+        config = ConfigV2({
+            "project_name": "test",
+            "deployments": {
+                "staging": {
+                    "target": "fake-target",
+                    "env_file": "./.env.staging",
+                    "docker_vars": {},
+                    "pipeline": True
+                }
+            }
+        })
+
+        def call_docker_compose(input, type, **kwargs):
+            if input == ['config', '--services']:
+                return 'backend\nstatic\n' if type == 'prod-build' \
+                    else 'backend\npostgres\n'
+
+        sykle = Sykle(config=config)
+        sykle.call_subprocess = MagicMock()
+        sykle.call_docker_compose = MagicMock(side_effect=call_docker_compose)
+
+        sykle.deploy('staging')
+        commands = [
+            (c[1][0], c[2]['type'])
+            for c in sykle.call_docker_compose.mock_calls
+        ]
+        self.assertIn((['push', 'backend'], 'prod-build'), commands)
+        self.assertIn((['push', 'static'], 'prod-build'), commands)
+        self.assertIn((['pull', 'backend'], 'prod'), commands)
+        self.assertIn((['pull', 'postgres'], 'prod'), commands)
+        self.assertNotIn((['pull', 'static'], 'prod'), commands)
+        self.assertLess(
+            commands.index((['push', 'backend'], 'prod-build')),
+            commands.index((['pull', 'backend'], 'prod'))
+        )
+
+    def test_deploy_batch(self):
+        config = ConfigV2({
+            "project_name": "test",
+            "deployments": {
+                "staging": {
+                    "target": "fake-target",
+                    "env_file": "./.env.staging",
+                    "docker_vars": {"BUILD_NUMBER": "latest"},
+                    "batch": True
+                }
+            }
+        })
+        sykle = Sykle(config=config)
+        sykle.call_subprocess = MagicMock()
+        sykle.call_docker_compose = MagicMock()
+        sykle.call_remote_agent = MagicMock()
+
+        sykle.deploy('staging')
+        ops = sykle.call_remote_agent.call_args[0][0]
+        self.assertEqual(
+            [op['name'] for op in ops], ['pull', 'up', 'prune']
+        )
+        self.assertEqual(ops[0]['argv'], [
+            'docker-compose', '-p', 'test-prod',
+            '-f', './docker-compose.prod.yml', 'pull'
+        ])
+        self.assertEqual(ops[0]['env'], {'BUILD_NUMBER': 'latest'})
+        self.assertEqual(
+            sykle.call_remote_agent.call_args[1]['target'], 'fake-target'
+        )
+
+    @patch('sykle.health._subprocess.run')
+    @patch('sykle.health._subprocess.Popen')
+    def test_deploy_wait_project_name(self, popen, run):
+        config = ConfigV2({
+            "project_name": "test",
+            "deployments": {
+                "staging": {
+                    "target": "fake-target",
+                    "env_file": "./.env.staging",
+                    "docker_vars": {}
+                }
+            }
+        })
+        sykle = Sykle(config=config)
+        sykle.call_subprocess = MagicMock()
+        sykle.call_docker_compose = MagicMock()
+        popen.return_value.stdout = []
+        run.return_value.stdout = b'a backend {"Status": "running"}\n'
+
+        sykle.deploy('staging', wait=True)
+        self.assertEqual(
+            sykle.call_docker_compose.call_args[1]['project_name'], 'test'
+        )
+        for command in [popen.call_args[0][0], run.call_args[0][0]]:
+            self.assertEqual(command[3], 'fake-target')
+            self.assertIn('com.docker.compose.project=test-prod', command[4])
+
+    def test_deploy_batch_wait(self):
+        config = ConfigV2({
+            "project_name": "test",
+            "deployments": {
+                "staging": {
+                    "target": "fake-target",
+                    "env_file": "./.env.staging",
+                    "docker_vars": {"BUILD_NUMBER": "latest"},
+                    "batch": True
+                }
+            }
+        })
+        sykle = Sykle(config=config)
+        sykle.call_subprocess = MagicMock()
+        sykle.call_docker_compose = MagicMock()
+        sykle.call_remote_agent = MagicMock()
+        sykle.wait_healthy = MagicMock(
+            side_effect=HealthCheckException('unhealthy')
+        )
+
+        # NB: nothing gets pruned or recorded if the services aren't healthy
+        with self.assertRaises(HealthCheckException):
+            sykle.deploy('staging', wait=True)
+        ops = sykle.call_remote_agent.call_args[0][0]
+        self.assertEqual([op['name'] for op in ops], ['pull', 'up'])
+
+        sykle.wait_healthy.side_effect = None
+        sykle.call_remote_agent.reset_mock()
+        sykle.deploy('staging', wait=True)
+        batches = [
+            [op['name'] for op in c[0][0]]
+            for c in sykle.call_remote_agent.call_args_list
+        ]
+        self.assertEqual(batches, [['pull', 'up'], ['prune']])
+
+    def _track_state_sykle(self, remote_images, local_digests=None):
+        config = ConfigV2({
+            "project_name": "test",
+            "deployments": {
+                "staging": {
+                    "target": "fake-target",
+                    "env_file": "./.env.does-not-exist",
+                    "docker_vars": {},
+                    "track_state": True
+                }
+            }
+        })
+        remote_state = DeployState(
+            images=remote_images,
+            compose_hash=file_hash('docker-compose.prod.yml'),
+        )
+
+        def call_docker_compose(input, **kwargs):
+            if input == ['config']:
+                return 'services:\n  backend:\n    image: repo/backend:1\n'
+
+        # NB: RepoDigests of the local image for each inspect (the last
+        #     one repeats), None when the image isn't built
+        local_digests = local_digests or [['repo/backend@sha256:abc']]
+
+        def call_subprocess(input, **kwargs):
+            if input[:3] == ['docker', 'image', 'inspect']:
+                digests = local_digests[0]
+                if len(local_digests) > 1:
+                    local_digests.pop(0)
+                if digests is None:
+                    raise NonZeroReturnCodeException(process=None)
+                return json.dumps(digests) + '\n'
+            if input[:3] == ['docker', 'buildx', 'imagetools']:
+                return json.dumps({'digest': 'sha256:abc'})
+            if 'cat' in input[0]:
+                return remote_state.dumps()
+
+        sykle = Sykle(config=config)
+        sykle.call_subprocess = MagicMock(side_effect=call_subprocess)
+        sykle.call_docker_compose = MagicMock(side_effect=call_docker_compose)
+        return sykle
+
+    def test_deploy_unchanged(self):
+        sykle = self._track_state_sykle(
+            {'repo/backend:1': 'repo/backend@sha256:abc'}
+        )
+
+        sykle.deploy('staging')
+        commands = [c[1][0] for c in sykle.call_docker_compose.mock_calls]
+        self.assertEqual(commands, [['config']])
+
+    def test_deploy_unchanged_images(self):
+        sykle = self._track_state_sykle(
+            {'repo/backend:1': 'repo/backend@sha256:abc'}
+        )
+        sykle.config.raw['deployments']['staging']['env_file'] = 'setup.py'
+
+        sykle.deploy('staging')
+        commands = [c[1][0] for c in sykle.call_docker_compose.mock_calls]
+        self.assertEqual(
+            commands,
+            [['config'], ['up', '--build', '--force-recreate', '-d']]
+        )
+        self.assertIn('printf', sykle.call_subprocess.mock_calls[-1][1][0][0])
+
+    def test_deploy_changed_images(self):
+        sykle = self._track_state_sykle(
+            {'repo/backend:1': 'repo/backend@sha256:old'}
+        )
+
+        sykle.deploy('staging')
+        commands = [c[1][0] for c in sykle.call_docker_compose.mock_calls]
+        self.assertEqual(commands, [
+            ['config'], ['push'], ['pull'],
+            ['up', '--build', '--force-recreate', '-d']
+        ])
+
+    def test_deploy_wait_excludes_pull(self):
+        config = ConfigV2({
+            "project_name": "test",
+            "deployments": {
+                "staging": {
+                    "target": "fake-target",
+                    "env_file": "./.env.staging",
+                    "docker_vars": {}
+                }
+            }
+        })
+        sykle = Sykle(config=config)
+        sykle.call_subprocess = MagicMock()
+        sykle.call_docker_compose = MagicMock()
+        pulled = []
+        sykle.pull = MagicMock(
+            side_effect=lambda **kwargs: pulled.append(time.time())
+        )
+        sykle.wait_healthy = MagicMock()
+
+        sykle.deploy('staging', wait=True)
+        started = sykle.wait_healthy.call_args[1]['started']
+        self.assertGreaterEqual(started, pulled[0])
+
+    def test_deploy_records_pushed_digests(self):
+        # NB: the local build isn't in the registry until it is pushed
+        sykle = self._track_state_sykle(
+            {'repo/backend:1': 'repo/backend@sha256:old'},
+            local_digests=[[], ['repo/backend@sha256:abc']]
+        )
+
+        sykle.deploy('staging')
+        commands = [c[1][0] for c in sykle.call_docker_compose.mock_calls]
+        self.assertEqual(commands[:2], [['config'], ['push']])
+        recorded = sykle.call_subprocess.mock_calls[-1][1][0][0]
+        self.assertIn('repo/backend@sha256:abc', recorded)
+
+    def test_deploy_unbuilt_images(self):
+        sykle = self._track_state_sykle(
+            {'repo/backend:1': 'repo/backend@sha256:abc'},
+            local_digests=[None]
+        )
+
+        with patch('builtins.print') as mock_print:
+            sykle.deploy('staging')
+        printed = [c[0][0] for c in mock_print.call_args_list]
+        self.assertTrue(any('WARNING' in line for line in printed))
+        commands = [c[1][0] for c in sykle.call_docker_compose.mock_calls]
+        self.assertIn(['push'], commands)
+        last_command = sykle.call_subprocess.mock_calls[-1][1][0]
+        self.assertNotIn('printf', last_command[0])
+
+    def test_deploy_events(self):
+        config = ConfigV2({
+            "project_name": "test",
+            "deployments": {
+                "staging": {
+                    "target": "fake-target",
+                    "env_file": "./.env.staging",
+                    "docker_vars": {}
+                }
+            }
+        })
+        sykle = Sykle(config=config)
+        sykle.call_subprocess = MagicMock()
+        sykle.call_docker_compose = MagicMock()
+        events = []
+        sykle.events.subscribe('*', events.append)
+
+        sykle.deploy('staging')
+        stages = [
+            e.extras['stage'] for e in events
+            if e.name == 'deploy_stage' and e.phase == 'finish'
+        ]
+        self.assertEqual(
+            stages, ['predeploy', 'copy', 'push', 'pull', 'up', 'prune']
+        )
+        dc_finish = [
+            e for e in events if e.name == 'dc' and e.phase == 'finish'
+        ]
+        self.assertEqual(dc_finish[0].argv, ['push'])
+        self.assertEqual(dc_finish[0].docker_type, 'prod-build')
+        self.assertEqual(dc_finish[0].deployment, 'staging')
+        self.assertEqual(dc_finish[0].returncode, 0)
+        self.assertIsNotNone(dc_finish[0].duration)
+        self.assertEqual(
+            [e.name for e in events if e.phase == 'start'].count('ssh_cp'), 2
+        )
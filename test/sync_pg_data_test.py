@@ -0,0 +1,264 @@
+from sykle.plugins.sync_pg_data import Plugin
+from sykle.call_subprocess import (
+    call_subprocess, NonZeroReturnCodeException
+)
+from unittest.mock import MagicMock, patch
+import copy
+import os
+import shlex
+import tempfile
+import unittest
+
+CONFIG = {
+    'host_clients': False,
+    'locations': {
+        'local': {
+            'write': True,
+            'args': {
+                'HOST': 'db', 'USER': 'postgres', 'PASSWORD': 'pw',
+                'NAME': 'app',
+            },
+        },
+        'prod': {
+            'args': {
+                'HOST': 'prod', 'USER': 'postgres', 'PASSWORD': 'pw',
+                'NAME': 'app',
+            },
+        },
+    },
+}
+
+
+@patch('sykle.plugins.sync_pg_data.clients.call_subprocess')
+@patch('sykle.plugins.sync_pg_data.call_subprocess')
+class SyncPGDataTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = copy.deepcopy(CONFIG)
+        config = MagicMock()
+        config.for_plugin.return_value = self.config
+        self.plugin = Plugin(config, MagicMock(), None)
+
+    def sql(self, mock_call_subprocess):
+        command = mock_call_subprocess.call_args[1]['command']
+        self.assertEqual(command[command.index('-d') + 1], 'postgres')
+        return [
+            command[i + 1] for i, arg in enumerate(command) if arg == '-c'
+        ]
+
+    def test_snapshot(self, mock_call_subprocess, _):
+        self.plugin.snapshot('local', 'qa')
+        statements = self.sql(mock_call_subprocess)
+        self.assertIn(
+            '\'CREATE DATABASE "app_snapshot_qa" TEMPLATE "app"\'',
+            statements
+        )
+        self.assertIn('DROP DATABASE IF EXISTS "app_snapshot_qa"',
+                      statements[1])
+
+    def test_reset(self, mock_call_subprocess, _):
+        self.plugin.reset('local', 'qa')
+        statements = self.sql(mock_call_subprocess)
+        check = shlex.split(statements[0])[0]
+        self.assertIn("datname = 'app_snapshot_qa'", check)
+        self.assertIn('RAISE EXCEPTION', check)
+        self.assertEqual(statements[2:], [
+            '\'DROP DATABASE IF EXISTS "app"\'',
+            '\'CREATE DATABASE "app" TEMPLATE "app_snapshot_qa"\'',
+        ])
+
+    def test_snapshots_require_write_permission(self, mock_call_subprocess,
+                                                _):
+        with self.assertRaises(Exception):
+            self.plugin.snapshot('prod', 'qa')
+        with self.assertRaises(Exception):
+            self.plugin.reset('prod', 'qa')
+        mock_call_subprocess.assert_not_called()
+
+    def test_invalid_snapshot_name(self, mock_call_subprocess, _):
+        with self.assertRaises(Exception):
+            self.plugin.reset('local', 'qa"; DROP')
+        mock_call_subprocess.assert_not_called()
+
+    def test_dump_file_names_are_unique(self, mock_call_subprocess, _):
+        dir = tempfile.TemporaryDirectory()
+        self.addCleanup(dir.cleanup)
+        self.plugin.dump_dir = dir.name
+
+        with patch('sykle.plugins.sync_pg_data.datetime') as mock_datetime:
+            mock_datetime.now.return_value.strftime.return_value = '1'
+            names = []
+            for format in ['tar', 'tar', 'directory']:
+                names.append(self.plugin.get_dump_file_name('prod', format))
+                # NB: the codec extension gets added to the name later on
+                open(names[-1] + '.gz', 'w').close()
+
+        self.assertEqual([os.path.basename(n) for n in names], [
+            'prod_backup_1', 'prod_backup_1-1', 'prod_backup_1-2.dir'
+        ])
+
+    def test_most_recent_backup_without_catalog(self, mock_call_subprocess,
+                                                _):
+        dir = tempfile.TemporaryDirectory()
+        self.addCleanup(dir.cleanup)
+        self.plugin.dump_dir = dir.name
+
+        names = [
+            'prod_backup_2020-01-01_12:00:00.123456',
+            'prod_backup_20200102T120000-1.dir.zst',
+            'tmpabc.tar', 'assets', 'catalog.json.tmp',
+        ]
+        for i, name in enumerate(names):
+            path = os.path.join(dir.name, name)
+            open(path, 'w').close()
+            os.utime(path, (i, i))
+
+        self.assertEqual(
+            os.path.basename(self.plugin.most_recent_backup()), names[1]
+        )
+
+    def _previous_dump(self, mock_call_subprocess, counters):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.plugin.dump_dir = self.dir.name
+        self.config['compression'] = 'none'
+        self.config['locations']['prod']['skip_unchanged'] = True
+
+        mock_call_subprocess.return_value = counters
+        previous = os.path.join(self.dir.name, 'prod_backup_1')
+        open(previous, 'w').close()
+        self.plugin.store.add(
+            previous, location='prod', format='tar', duration=1,
+            change_marker=self.plugin.get_change_marker('prod')
+        )
+        return previous
+
+    def test_dump_reuses_unchanged_backup(self, mock_call_subprocess, _):
+        previous = self._previous_dump(mock_call_subprocess, '1|2|3|\n')
+
+        with patch.object(Plugin, '_call_with_progress') as mock_dump:
+            dump_file = self.plugin.dump('prod', previous + 'new')
+            self.assertEqual(dump_file, previous)
+            mock_dump.assert_not_called()
+
+            dump_file = self.plugin.dump('prod', previous + 'new', force=True)
+            self.assertEqual(dump_file, previous + 'new')
+            mock_dump.assert_called_once()
+
+    def test_dump_changed(self, mock_call_subprocess, _):
+        previous = self._previous_dump(mock_call_subprocess, '1|2|3|\n')
+        mock_call_subprocess.return_value = '1|2|4|\n'
+
+        with patch.object(Plugin, '_call_with_progress') as mock_dump:
+            dump_file = self.plugin.dump('prod', previous + 'new')
+            mock_dump.assert_called_once()
+        self.assertEqual(dump_file, previous + 'new')
+        self.assertTrue(
+            self.plugin.store.get(dump_file)['change_marker']
+            .endswith(':1|2|4|')
+        )
+
+    def test_fast_restore(self, mock_call_subprocess, _):
+        self.config['locations']['local']['fast_restore'] = {
+            'maintenance_work_mem': '2GB'
+        }
+        with tempfile.TemporaryDirectory() as dir, \
+                patch.object(Plugin, '_call_with_progress') as mock_restore:
+            self.plugin.restore('local', os.path.join(dir, 'backup'))
+        commands = mock_restore.call_args[0][0]
+
+        self.assertEqual(len(commands), 3)
+        for command, section in zip(
+            commands, ['pre-data', 'data', 'post-data']
+        ):
+            self.assertIn('--single-transaction', command)
+            self.assertIn('--section={}'.format(section), command)
+            self.assertIn(
+                "'PGOPTIONS=-c maintenance_work_mem=2GB "
+                "-c synchronous_commit=off'",
+                command
+            )
+
+    def test_fast_restore_decompresses_once(self, mock_call_subprocess, _):
+        self.config['locations']['local']['fast_restore'] = True
+        with tempfile.TemporaryDirectory() as dir, \
+                patch.object(Plugin, '_call_with_progress') as mock_restore:
+            self.plugin.restore('local', os.path.join(dir, 'backup.gz'))
+            self.assertEqual(os.listdir(dir), [])
+        commands = mock_restore.call_args[0][0]
+
+        decompress = mock_call_subprocess.call_args[1]['command']
+        self.assertEqual(decompress[-3], os.path.join(dir, 'backup.gz'))
+        archive = decompress[-1]
+        self.assertEqual(len(commands), 3)
+        for command in commands:
+            self.assertEqual(command[-1], archive)
+            self.assertFalse(any('gzip' in arg for arg in command))
+
+    def test_restore(self, mock_call_subprocess, _):
+        with tempfile.TemporaryDirectory() as dir, \
+                patch.object(Plugin, '_call_with_progress') as mock_restore:
+            self.plugin.restore('local', os.path.join(dir, 'backup'))
+        commands = mock_restore.call_args[0][0]
+
+        self.assertEqual(len(commands), 1)
+        self.assertNotIn('--single-transaction', commands[0])
+        self.assertFalse(any('PGOPTIONS' in arg for arg in commands[0]))
+
+    def test_restore_all(self, mock_call_subprocess, _):
+        self.config['locations']['qa'] = dict(
+            self.config['locations']['local'], write=True
+        )
+
+        def restore(location, restore_file, debug=False):
+            if location == 'qa':
+                raise Exception('boom')
+
+        mock_restore = patch.object(Plugin, 'restore', side_effect=restore)
+        with patch.object(Plugin, 'recreate'), mock_restore as mock_restore, \
+                patch('builtins.print') as mock_print:
+            with self.assertRaisesRegex(Exception, 'Failed .* qa$'):
+                self.plugin.restore_all(['local', 'qa'], 'backup')
+
+        self.assertEqual(mock_restore.call_count, 2)
+        summary = [call[0][0] for call in mock_print.call_args_list]
+        self.assertTrue(summary[1].strip().startswith('local'))
+        self.assertIn('OK', summary[1])
+        self.assertIn('FAILED  boom', summary[2])
+
+    def _failing_dump(self, mock_call_subprocess):
+        """Runs commands for real, with a pg_dump that dies partway"""
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.plugin.dump_dir = self.dir.name
+        self.plugin.show_progress = False
+        mock_call_subprocess.side_effect = call_subprocess
+
+        def pg_command(args, command, **kwargs):
+            if command[0] == 'pg_dump':
+                return ['sh', '-c', "'echo partial; exit 1'"]
+            return ['cat', '>', '/dev/null']
+        return patch.object(Plugin, '_pg_command', side_effect=pg_command)
+
+    def test_failed_stream_raises(self, mock_call_subprocess, _):
+        with self._failing_dump(mock_call_subprocess):
+            backup = os.path.join(self.dir.name, 'prod_backup')
+            with self.assertRaises(NonZeroReturnCodeException):
+                self.plugin.stream('prod', 'local', backup_file=backup)
+        self.assertFalse(os.path.exists(backup))
+        self.assertIsNone(self.plugin.store.get(backup))
+
+    def test_failed_dump_raises(self, mock_call_subprocess, _):
+        self.config['compression'] = 'gzip'
+        with self._failing_dump(mock_call_subprocess), \
+                patch('builtins.print'):
+            dump_file = os.path.join(self.dir.name, 'prod_backup')
+            with self.assertRaises(NonZeroReturnCodeException):
+                self.plugin.dump('prod', dump_file)
+        self.assertEqual(os.listdir(self.dir.name), [])
+        self.assertIsNone(self.plugin.store.get(dump_file + '.gz'))
+
+    def test_destinations_need_write_permission(self, mock_call_subprocess,
+                                                _):
+        self.assertEqual(self.plugin.get_destinations('local'), ['local'])
+        with self.assertRaises(Exception):
+            self.plugin.get_destinations('local,prod')
@@ -0,0 +1,194 @@
+from sykle.plugins.sync_webfaction_data import WebfactionLocation
+from sykle.call_subprocess import (
+    call_subprocess, NonZeroReturnCodeException
+)
+from unittest.mock import MagicMock, patch
+import os
+import shlex
+import shutil
+import tempfile
+import unittest
+
+
+class WebfactionLocationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.env_file = tempfile.NamedTemporaryFile('w', suffix='.env')
+        self.env_file.write('WEBFACTION_PASSWORD=pw\nDATABASE_URL=pg://db\n')
+        self.env_file.flush()
+        self.addCleanup(self.env_file.close)
+
+        self.plugin = MagicMock()
+        self.plugin.config = {
+            'remote_compression': 'gzip', 'retention': {'count': 3}
+        }
+        self.plugin.get_dump_file_name.return_value = 'backups/staging'
+        self.location = WebfactionLocation(
+            name='staging', plugin=self.plugin, env_file=self.env_file.name,
+            webfaction_user='foo', webfaction_host='example.com',
+            args={
+                'WEBFACTION_PASSWORD': '$WEBFACTION_PASSWORD',
+                'DATABASE_URL': '$DATABASE_URL',
+            }
+        )
+
+    @patch('sykle.plugins.sync_webfaction_data.call_subprocess')
+    def test_dump_streams_over_one_ssh_session(self, call_subprocess):
+        self.assertEqual(self.location.dump(), 'backups/staging.gz')
+
+        commands = self.plugin._call_with_progress.call_args[0][0]
+        self.assertEqual(len(commands), 1)
+        command = commands[0]
+        self.assertEqual(command[0], 'ssh')
+        self.assertIn(
+            'ControlPath=%s' % self.location.control_path, command
+        )
+        self.assertEqual(command[-2:], ['>', 'backups/staging.gz'])
+        remote_command = shlex.split(command[-3])
+        self.assertEqual(len(remote_command), 1)
+        self.assertEqual(shlex.split(remote_command[0]), [
+            'bash', '-o', 'pipefail', '-c',
+            '/usr/local/pgsql/bin/pg_dump --format tar --verbose  pg://db '
+            '| gzip -c'
+        ])
+
+        entry = self.plugin.store.add.call_args
+        self.assertEqual(entry[0][0], 'backups/staging.gz')
+        self.assertEqual(entry[1]['format'], 'tar')
+        self.assertEqual(entry[1]['compression'], 'gzip')
+        # NB: always a tar archive, whatever the location's jobs
+        self.plugin.get_dump_file_name.assert_called_with(
+            'staging', format='tar'
+        )
+        self.plugin.store.enforce_retention.assert_called_once_with(count=3)
+
+    @patch('sykle.plugins.sync_webfaction_data.call_subprocess')
+    def test_failed_remote_dump(self, _):
+        dir = tempfile.TemporaryDirectory()
+        self.addCleanup(dir.cleanup)
+        self.plugin.get_dump_file_name.return_value = os.path.join(
+            dir.name, 'staging'
+        )
+
+        def run_remote_locally(commands, progress):
+            # NB: the host's pg_dump fails, gzip still writes an archive
+            remote = commands[0][-3].replace(
+                '/usr/local/pgsql/bin/pg_dump', 'false'
+            )
+            call_subprocess(['sh', '-c', remote] + commands[0][-2:])
+
+        self.plugin._call_with_progress.side_effect = run_remote_locally
+        with self.assertRaises(NonZeroReturnCodeException):
+            self.location.dump()
+        self.assertFalse(os.path.exists(self.location.dump_file))
+        self.plugin.store.add.assert_not_called()
+        self.plugin.store.enforce_retention.assert_not_called()
+
+    @patch('sykle.call_subprocess.call_subprocess')
+    @patch('sykle.plugins.sync_webfaction_data.call_subprocess')
+    def test_connection_is_shared(self, call_subprocess, decorated):
+        decorated.side_effect = call_subprocess
+        self.location.ssh(['ls'])
+        self.location.scp('a', 'b')
+        self.location.close()
+        self.location.close()
+
+        commands = [c[0][0] for c in call_subprocess.call_args_list]
+        self.assertEqual(len(commands), 4)
+        master, ssh, scp, close = commands
+        self.assertEqual(master[:4], ['sshpass', '-p', 'pw', 'ssh'])
+        self.assertIn('ControlMaster=yes', master)
+        self.assertEqual(ssh[0], 'ssh')
+        self.assertEqual(scp[0], 'scp')
+        self.assertEqual(close[-3:], ['-O', 'exit', 'foo@example.com'])
+
+    @patch('sykle.plugins.sync_webfaction_data.call_subprocess')
+    def test_close_is_best_effort(self, call_subprocess):
+        def run(command, **kwargs):
+            if '-O' in command:
+                raise NonZeroReturnCodeException(process=None)
+
+        call_subprocess.side_effect = run
+        self.location.connect()
+        with patch('builtins.print') as mock_print:
+            self.location.close()
+        mock_print.assert_called_once()
+        self.location.close()
+        self.assertEqual(call_subprocess.call_count, 2)
+
+    def test_control_path_fits_socket_limit(self):
+        # NB: ssh expands %C to a 40 character hash
+        path = self.location.control_path
+        self.assertTrue(path.endswith('%C'))
+        self.assertLess(len(path) - 2 + 40, 104)
+
+    def test_copy_assets_to_cleaned_destination(self):
+        dir = tempfile.TemporaryDirectory()
+        self.addCleanup(dir.cleanup)
+        self.plugin.dump_dir = dir.name
+        self.plugin.config['assets'] = {'jobs': 2, 'snapshots': 2}
+        dest = MagicMock()
+        dest.media_root = os.path.join(dir.name, 'media')
+
+        def fetch_assets(paths, target):
+            for path in paths:
+                os.makedirs(os.path.join(target, os.path.dirname(path)),
+                            exist_ok=True)
+                open(os.path.join(target, path), 'w').close()
+
+        remote = {'a/1': [1, 1]}
+        with patch.object(self.location, 'fetch_remote_manifest',
+                          return_value=remote), \
+                patch.object(self.location, 'fetch_assets', fetch_assets), \
+                patch('sykle.plugins.sync_webfaction_data.datetime') as now:
+            # NB: both syncs happen within the same second
+            now.now.return_value.strftime.return_value = '1'
+            self.location.copy_assets_to(dest)
+            shutil.rmtree(dest.media_root)
+            self.location.copy_assets_to(dest)
+
+        snapshots = os.path.join(dir.name, 'assets', 'staging')
+        self.assertEqual(sorted(os.listdir(snapshots)), ['1', '1-1'])
+        self.assertTrue(os.path.samefile(
+            os.path.join(snapshots, '1-1', 'a/1'),
+            os.path.join(dest.media_root, 'a/1')
+        ))
+
+    def test_copy_assets_to_snapshots(self):
+        dir = tempfile.TemporaryDirectory()
+        self.addCleanup(dir.cleanup)
+        self.plugin.dump_dir = dir.name
+        self.plugin.config['assets'] = {'jobs': 2, 'snapshots': 1}
+        dest = MagicMock()
+        dest.media_root = os.path.join(dir.name, 'media')
+
+        fetched = []
+
+        def fetch_assets(paths, target):
+            fetched.append(sorted(paths))
+            for path in paths:
+                os.makedirs(os.path.join(target, os.path.dirname(path)),
+                            exist_ok=True)
+                open(os.path.join(target, path), 'w').close()
+
+        remote = {'a/1': [1, 1], 'b/1': [1, 1]}
+        with patch.object(self.location, 'fetch_remote_manifest',
+                          return_value=remote), \
+                patch.object(self.location, 'fetch_assets', fetch_assets), \
+                patch('sykle.plugins.sync_webfaction_data.datetime') as now:
+            now.now.return_value.strftime.return_value = '1'
+            self.location.copy_assets_to(dest)
+            remote['b/1'] = [2, 2]
+            now.now.return_value.strftime.return_value = '2'
+            self.location.copy_assets_to(dest)
+
+        self.assertEqual(sorted(fetched), [['a/1'], ['b/1'], ['b/1']])
+        snapshots = os.path.join(dir.name, 'assets', 'staging')
+        self.assertEqual(os.listdir(snapshots), ['2'])
+        self.assertTrue(os.path.samefile(
+            os.path.join(snapshots, '2', 'a/1'),
+            os.path.join(dest.media_root, 'a/1')
+        ))
+        self.assertTrue(os.path.samefile(
+            os.path.join(snapshots, '2', 'b/1'),
+            os.path.join(dest.media_root, 'b/1')
+        ))